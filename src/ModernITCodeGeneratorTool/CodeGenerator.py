@@ -0,0 +1,433 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import app_docs
+import app_epics_features_generator
+import app_gherkin_generator
+import app_knowledge_base
+import app_src_code_generator
+import app_unit_functional_code
+from pipeline.checkpoint import PipelineRunState
+from pipeline.clients import get_client
+from pipeline.manifest import StageManifest, combine_etags, get_object_etag
+from pipeline.metrics import log_metrics_summary, span
+from pipeline.outputs import flush_outputs, get_output_sink
+from pipeline.routing import log_route_summary
+from pipeline.storage import get_bucket_name
+
+BUCKET_NAME = get_bucket_name()
+KB_SOURCE_PREFIX = "source/PL-SQL-Chess-master"
+PLSQL_SOURCE_PREFIX = "source/PL-SQL-Chess-master/src"
+SRC_FOLDER = "target/src"
+DOCS_FOLDER = "target/docs"
+EPIC_FOLDER = "target/epics"
+TEST_FOLDER = "target/test"
+MAX_WORKERS = 8
+
+# Stage name -> (script module, manifest name, prompt version); order is the dependency order
+STAGES = {
+    "knowledge_base": (app_knowledge_base, "app_knowledge_base", app_knowledge_base.PROMPT_VERSION),
+    "source": (app_src_code_generator, "app_src_code_generator", app_src_code_generator.PROMPT_VERSION),
+    "docs": (app_docs, "app_docs", app_docs.PROMPT_VERSION),
+    "epics": (app_epics_features_generator, "app_epics_features_generator",
+              app_epics_features_generator.PROMPT_VERSION),
+    "unit_tests": (app_unit_functional_code, "app_unit_functional_code", app_unit_functional_code.PROMPT_VERSION),
+    "gherkin": (app_gherkin_generator, "app_gherkin_generator", app_gherkin_generator.GENERATOR_VERSION),
+}
+
+TaskId = Tuple[str, str]
+
+logger = logging.getLogger(__name__)
+
+def setup_logging(script_name: str) -> tuple:
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base_name = os.path.splitext(os.path.basename(script_name))[0]
+    log_filename = f"{base_name}_{timestamp}.log"
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s')
+    file_handler = logging.FileHandler(log_filename)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    logger = logging.getLogger(__name__)
+    # The stage scripts log through their own module loggers when imported
+    logger_names = [__name__, 'pipeline'] + [module.__name__ for module, _, _ in STAGES.values()]
+    for name in logger_names:
+        stage_logger = logging.getLogger(name)
+        stage_logger.setLevel(logging.INFO)
+        stage_logger.addHandler(file_handler)
+        stage_logger.addHandler(console_handler)
+    return logger, log_filename
+
+def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
+    try:
+        s3_client = get_client('s3')
+        log_key = f"logs/{log_filename}"
+
+        with open(log_filename, 'rb') as log_file:
+            s3_client.upload_fileobj(log_file, bucket_name, log_key)
+
+        logger.info(f"Log file uploaded to s3://{bucket_name}/{log_key}")
+        os.remove(log_filename)
+        logger.info(f"Local log file {log_filename} removed")
+
+    except ClientError as e:
+        logger.error(f"Error uploading log file to S3: {str(e)}")
+        raise
+
+class IncompleteOutputsError(Exception):
+    """Raised for a step that returned without all of its outputs, so its task counts as failed."""
+
+class Task:
+    """
+    One stage applied to one file, runnable once every task it depends on has succeeded.
+
+    Tasks in `after` are ordering-only dependencies: this task waits for them to
+    finish but still runs when they fail.
+    """
+
+    def __init__(self, stage: str, item: str, action: Callable[[], None], depends_on: Iterable[TaskId] = (),
+                 after: Iterable[TaskId] = ()):
+        self.stage = stage
+        self.item = item
+        self.action = action
+        self.after = set(after)
+        self.depends_on = set(depends_on) | self.after
+        self.dependents: List[TaskId] = []
+        self.status = "waiting"
+
+    @property
+    def id(self) -> TaskId:
+        return (self.stage, self.item)
+
+class StageGraph:
+    """Per-file dependency graph across the pipeline stages."""
+
+    def __init__(self):
+        self.tasks: Dict[TaskId, Task] = {}
+
+    def add(self, task: Task) -> Task:
+        # Dependencies on stages that are not part of this run are already satisfied
+        task.depends_on &= set(self.tasks)
+        task.after &= task.depends_on
+        for dependency in task.depends_on:
+            self.tasks[dependency].dependents.append(task.id)
+        self.tasks[task.id] = task
+        return task
+
+    def skip_dependents(self, task: Task) -> List[Task]:
+        """Skip what needed `task` to succeed; return the ordering-only dependents that are now ready."""
+        ready = []
+        for dependent_id in task.dependents:
+            dependent = self.tasks[dependent_id]
+            if dependent.status != "waiting":
+                continue
+            if task.id in dependent.after:
+                dependent.depends_on.discard(task.id)
+                if not dependent.depends_on:
+                    ready.append(dependent)
+                continue
+            dependent.status = "skipped"
+            logger.warning(f"Skipping {dependent.stage} for {dependent.item}: "
+                           f"upstream {task.stage} did not complete")
+            ready.extend(self.skip_dependents(dependent))
+        return ready
+
+    def restore(self, completed: Iterable[TaskId]) -> int:
+        """Mark tasks finished by an interrupted earlier run as resumed, releasing their dependents."""
+        restored = 0
+        for task_id in completed:
+            task = self.tasks.get(task_id)
+            if task is None or task.status != "waiting":
+                continue
+            task.status = "resumed"
+            restored += 1
+            for dependent_id in task.dependents:
+                self.tasks[dependent_id].depends_on.discard(task_id)
+        return restored
+
+    def run(self, max_workers: int, on_success: Optional[Callable[[Task], None]] = None) -> None:
+        """
+        Run every task as soon as its dependencies have succeeded.
+
+        A file flows to its downstream stages as soon as its own upstream outputs exist,
+        so independent stages and files overlap instead of waiting for whole-stage barriers.
+        A failed task is logged and its downstream tasks are skipped; other files carry on.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as executor:
+            running = {}
+
+            def start(task: Task) -> None:
+                task.status = "running"
+                logger.info(f"Starting {task.stage} for {task.item}")
+                running[executor.submit(task.action)] = task
+
+            for task in list(self.tasks.values()):
+                if task.status == "waiting" and not task.depends_on:
+                    start(task)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        task.status = "failed"
+                        logger.error(f"Failed {task.stage} for {task.item}: {str(e)}")
+                        for dependent in self.skip_dependents(task):
+                            if dependent.status == "waiting":
+                                start(dependent)
+                        continue
+
+                    task.status = "succeeded"
+                    logger.info(f"Completed {task.stage} for {task.item} ({self.progress()})")
+                    if on_success is not None:
+                        # Bookkeeping errors must not turn a task that succeeded into a failure
+                        try:
+                            on_success(task)
+                        except Exception as e:
+                            logger.warning(f"Could not record {task.stage} for {task.item} as completed: {str(e)}")
+
+                    for dependent_id in task.dependents:
+                        dependent = self.tasks[dependent_id]
+                        if dependent.status != "waiting":
+                            continue
+                        dependent.depends_on.discard(task.id)
+                        if not dependent.depends_on:
+                            start(dependent)
+
+    def progress(self) -> str:
+        finished = sum(1 for task in self.tasks.values()
+                       if task.status in ("succeeded", "failed", "skipped", "resumed"))
+        return f"{finished}/{len(self.tasks)} tasks finished"
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        counts: Dict[str, Dict[str, int]] = {}
+        for task in self.tasks.values():
+            stage_counts = counts.setdefault(task.stage, {})
+            stage_counts[task.status] = stage_counts.get(task.status, 0) + 1
+        return counts
+
+class PipelineOrchestrator:
+    """Builds the per-file stage graph for one bucket and runs it, honouring each stage's manifest."""
+
+    def __init__(self, bucket_name: str, stages: List[str]):
+        self.bucket_name = bucket_name
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.s3_client = get_client('s3')
+        self.bedrock_client = get_client('bedrock-runtime')
+        self.manifests = {
+            stage: StageManifest(bucket_name, STAGES[stage][1], STAGES[stage][2], self.s3_client).load()
+            for stage in self.stages
+        }
+        self.graph = StageGraph()
+        self.package_graph = None
+
+    def run_step(self, stage: str, input_key: str, version_keys: List[str],
+                 step: Callable[[], Optional[List[str]]]) -> None:
+        """
+        Run one stage for one input unless the manifest shows it is unchanged.
+
+        ETags are read when the step starts, because upstream stages may have
+        rewritten the input earlier in this run. `step` returns the output keys to
+        record, or None when the outputs are incomplete; the task then fails, its
+        dependents are skipped and it is retried by the next run or `--resume`.
+        A step's outputs upload concurrently in the background, and the task finishes
+        once they are stored, so dependent tasks can read them and a resumed run never
+        skips a task whose outputs were lost. Each call is timed as a `stage` span for
+        the run metrics.
+        """
+        with span('stage', stage=stage) as stage_span:
+            etags = [get_object_etag(self.s3_client, self.bucket_name, key) for key in version_keys]
+            if any(etag is None for etag in etags):
+                raise FileNotFoundError(f"Input for {stage} is missing: {', '.join(version_keys)}")
+            etag = combine_etags(*etags)
+
+            manifest = self.manifests[stage]
+            if manifest.is_current(input_key, etag):
+                logger.info(f"Skipping {stage} for {input_key}: unchanged since last run")
+                stage_span.set(outcome='unchanged')
+                return
+
+            output_keys = step()
+            if output_keys is None:
+                stage_span.set(outcome='incomplete')
+                # Failing the task keeps it out of the run state, so --resume runs it again
+                raise IncompleteOutputsError(f"{stage} for {input_key} did not produce all of its outputs")
+            get_output_sink().wait_for(self.bucket_name, output_keys)
+            stage_span.set(outcome='complete')
+            manifest.record(input_key, etag, output_keys)
+            manifest.save()
+
+    def knowledge_base_step(self, file_key: str) -> Optional[List[str]]:
+        if app_knowledge_base.is_readme_file(file_key):
+            output_keys = app_knowledge_base.process_readme_file(self.bucket_name, file_key)
+        else:
+            output_keys = app_knowledge_base.process_plsql_file(self.bucket_name, file_key)
+        return output_keys if len(output_keys) == len(app_knowledge_base.ANALYSIS_TYPES) else None
+
+    def source_step(self, base_name: str) -> List[str]:
+        app_src_code_generator.process_single_file(self.s3_client, self.bedrock_client, self.bucket_name,
+                                                   base_name, PLSQL_SOURCE_PREFIX, SRC_FOLDER,
+                                                   self.package_graph)
+        return [f"{SRC_FOLDER}/{base_name}.py"]
+
+    def docs_step(self, python_key: str) -> List[str]:
+        app_docs.process_single_file(self.bucket_name, python_key, DOCS_FOLDER)
+        return [app_docs.generate_docs_key(python_key, DOCS_FOLDER)]
+
+    def epics_step(self, python_key: str) -> List[str]:
+        app_epics_features_generator.process_single_file(self.bucket_name, python_key, EPIC_FOLDER)
+        return [app_epics_features_generator.generate_requirements_key(python_key, EPIC_FOLDER)]
+
+    def unit_tests_step(self, python_key: str) -> List[str]:
+        app_unit_functional_code.process_single_file(self.bucket_name, python_key, TEST_FOLDER)
+        return [app_unit_functional_code.generate_test_key(python_key, TEST_FOLDER, "unit"),
+                app_unit_functional_code.generate_test_key(python_key, TEST_FOLDER, "functional")]
+
+    def gherkin_step(self, unit_test_key: str, functional_test_key: str) -> List[str]:
+        app_gherkin_generator.process_test_pair(self.bucket_name, unit_test_key, functional_test_key)
+        return [app_gherkin_generator.get_gherkin_filename(unit_test_key)]
+
+    def add_task(self, stage: str, item: str, input_key: str, version_keys: List[str],
+                 step: Callable[[], Optional[List[str]]], depends_on: Iterable[TaskId] = (),
+                 after: Iterable[TaskId] = ()) -> None:
+        if stage not in self.stages:
+            return
+        self.graph.add(Task(stage, item, lambda: self.run_step(stage, input_key, version_keys, step),
+                            depends_on, after))
+
+    def build_graph(self) -> StageGraph:
+        if "knowledge_base" in self.stages:
+            plsql_files, readme_files = app_knowledge_base.list_files_by_type(self.bucket_name, KB_SOURCE_PREFIX)
+            for file_key in plsql_files + readme_files:
+                self.add_task("knowledge_base", file_key, file_key, [file_key],
+                              lambda file_key=file_key: self.knowledge_base_step(file_key))
+
+        base_names = []
+        if "source" in self.stages:
+            base_names = app_src_code_generator.list_plsql_files(self.s3_client, self.bucket_name,
+                                                                 PLSQL_SOURCE_PREFIX)
+            # Packages are converted after the packages they call, whose interfaces go into their prompts
+            self.package_graph = app_src_code_generator.analyze_package_dependencies(
+                self.s3_client, self.bucket_name, PLSQL_SOURCE_PREFIX, base_names)
+            for base_name in self.package_graph.conversion_order(base_names):
+                source_keys = [f"{PLSQL_SOURCE_PREFIX}/{base_name}.pks", f"{PLSQL_SOURCE_PREFIX}/{base_name}.pkb"]
+                # A package is converted again when a package it calls changes, not only its own pair
+                version_keys = app_src_code_generator.source_version_keys(PLSQL_SOURCE_PREFIX, base_name,
+                                                                          self.package_graph)
+                self.add_task("source", base_name, base_name, version_keys,
+                              lambda base_name=base_name: self.source_step(base_name),
+                              depends_on=[("knowledge_base", key) for key in source_keys],
+                              after=[("source", dependency)
+                                     for dependency in self.package_graph.upstream(base_name)])
+
+        python_keys = {f"{SRC_FOLDER}/{base_name}.py": base_name for base_name in base_names}
+        if any(stage in self.stages for stage in ("docs", "epics", "unit_tests", "gherkin")):
+            for python_key in app_docs.list_python_files(self.bucket_name, SRC_FOLDER):
+                python_keys.setdefault(python_key, app_docs.get_base_filename(python_key))
+
+        for python_key, base_name in sorted(python_keys.items()):
+            upstream = [("source", base_name)]
+            self.add_task("docs", python_key, python_key, [python_key],
+                          lambda python_key=python_key: self.docs_step(python_key), upstream)
+            self.add_task("epics", python_key, python_key, [python_key],
+                          lambda python_key=python_key: self.epics_step(python_key), upstream)
+            self.add_task("unit_tests", python_key, python_key, [python_key],
+                          lambda python_key=python_key: self.unit_tests_step(python_key), upstream)
+
+        if "gherkin" in self.stages:
+            test_pairs = {
+                app_unit_functional_code.generate_test_key(python_key, TEST_FOLDER, "unit"):
+                    (app_unit_functional_code.generate_test_key(python_key, TEST_FOLDER, "functional"), python_key)
+                for python_key in python_keys
+            }
+            for unit_test_key, functional_test_key in app_gherkin_generator.list_test_files(self.bucket_name,
+                                                                                          TEST_FOLDER):
+                test_pairs.setdefault(unit_test_key, (functional_test_key, None))
+
+            for unit_test_key, (functional_test_key, python_key) in sorted(test_pairs.items()):
+                self.add_task("gherkin", unit_test_key, unit_test_key, [unit_test_key, functional_test_key],
+                              lambda u=unit_test_key, f=functional_test_key: self.gherkin_step(u, f),
+                              depends_on=[("unit_tests", python_key)] if python_key else [])
+
+        logger.info(f"Built pipeline graph with {len(self.graph.tasks)} tasks across stages: {', '.join(self.stages)}")
+        return self.graph
+
+def main(bucket_name: str, stages: List[str], max_workers: int, resume: bool = False) -> None:
+    run_state = None
+    try:
+        run_state = PipelineRunState(bucket_name)
+        previous_run = run_state.load() if resume else None
+        if resume and (previous_run is None or previous_run.get('status') == 'completed'):
+            logger.info("No interrupted run to resume; starting a new run")
+            previous_run = None
+
+        if previous_run is not None:
+            stages = previous_run['stages']
+            run_state.resume(previous_run)
+            logger.info(f"Resuming the run started {previous_run['started']} "
+                        f"({len(previous_run['completed'])} tasks already completed)")
+        else:
+            run_state.start(stages)
+
+        logger.info(f"Starting pipeline for s3://{bucket_name} with {max_workers} workers")
+
+        orchestrator = PipelineOrchestrator(bucket_name, stages)
+        graph = orchestrator.build_graph()
+        restored = graph.restore(run_state.completed_tasks())
+        if restored:
+            logger.info(f"Skipping {restored} tasks completed before the interruption")
+        graph.run(max_workers, on_success=lambda task: run_state.mark_completed(task.id))
+
+        all_done = all(task.status in ("succeeded", "resumed") for task in graph.tasks.values())
+        run_state.finish("completed" if all_done else "incomplete")
+
+        for stage, counts in graph.summary().items():
+            logger.info(f"Stage {stage}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        logger.info("Pipeline completed")
+
+    except Exception as e:
+        logger.error(f"Error in pipeline: {str(e)}")
+        raise
+    finally:
+        flush_outputs()
+        if run_state is not None:
+            # Tasks finished since the last periodic save, should the run have stopped early
+            run_state.flush()
+        log_route_summary()
+        log_metrics_summary()
+        upload_log_to_s3(bucket_name, log_filename)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the code generation pipeline as a per-file stage graph")
+    parser.add_argument("--bucket", default=BUCKET_NAME, help="S3 bucket holding the sources and outputs")
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS,
+                        help="Number of stage tasks that may run at the same time")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"Comma-separated subset of stages to run (default: all of {', '.join(STAGES)})")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the last run for this bucket if it was interrupted, skipping its "
+                             "completed tasks and resuming partially converted packages")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    script_name = os.path.abspath(__file__)
+    logger, log_filename = setup_logging(script_name)
+
+    try:
+        selected_stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+        unknown_stages = set(selected_stages) - set(STAGES)
+        if unknown_stages:
+            raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown_stages))}")
+        main(args.bucket, selected_stages, args.max_workers, args.resume)
+    except Exception as e:
+        logger.error("Process failed with error:", exc_info=True)
+        exit(1)
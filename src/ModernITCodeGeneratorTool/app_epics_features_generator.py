@@ -1,4 +1,4 @@
-import boto3
+import asyncio
 import json
 import time
 from botocore.exceptions import ClientError
@@ -8,6 +8,21 @@ import random
 import os
 from datetime import datetime
 
+from pipeline import bedrock
+from pipeline.aio import AsyncAWS, run_bounded
+from pipeline.batch import BatchRequest, get_batch_backend, run_batch
+from pipeline.clients import get_client
+from pipeline.listing import get_object_lister
+from pipeline.manifest import StageManifest, object_info_from_listing
+from pipeline.metrics import inc, log_metrics_summary
+from pipeline.outputs import flush_outputs, get_output_sink
+from pipeline.routing import get_model_router, invoke_routed, log_route_summary
+from pipeline.storage import get_bucket_name
+from pipeline.text import read_object_text
+
+# Replaced by setup_logging when run as a script; lets CodeGenerator.py import the stage functions
+logger = logging.getLogger(__name__)
+
 def setup_logging(script_name: str) -> tuple:
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     base_name = os.path.splitext(os.path.basename(script_name))[0]
@@ -21,11 +36,15 @@ def setup_logging(script_name: str) -> tuple:
     logger.setLevel(logging.INFO)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
+    pipeline_logger = logging.getLogger('pipeline')
+    pipeline_logger.setLevel(logging.INFO)
+    pipeline_logger.addHandler(file_handler)
+    pipeline_logger.addHandler(console_handler)
     return logger, log_filename
 
 def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_client('s3')
         log_key = f"logs/{log_filename}"
         
         with open(log_filename, 'rb') as log_file:
@@ -45,6 +64,9 @@ def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
 class BedrockRetryException(Exception):
     pass
 
+# Bump whenever the prompt changes so the manifest stops skipping old outputs
+PROMPT_VERSION = "1"
+
 def get_base_filename(file_path: str) -> str:
     filename = os.path.basename(file_path)
     return os.path.splitext(filename)[0]
@@ -57,17 +79,14 @@ def exponential_backoff(attempt: int, max_delay: int = 32) -> float:
     delay = min(max_delay, (2 ** (attempt - 1))) + random.uniform(0, 0.1)
     return delay
 
-def list_python_files(bucket_name: str, prefix: str) -> List[str]:
+def list_python_files(bucket_name: str, prefix: str, object_info: Optional[dict] = None) -> List[str]:
     try:
-        s3_client = boto3.client('s3')
-        paginator = s3_client.get_paginator('list_objects_v2')
         python_files = []
 
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    if obj['Key'].endswith('.py'):
-                        python_files.append(obj['Key'])
+        for obj in get_object_lister().list_objects(bucket_name, prefix, ('.py',)):
+            python_files.append(obj['Key'])
+            if object_info is not None:
+                object_info[obj['Key']] = object_info_from_listing(obj)
         
         logger.info(f"Found {len(python_files)} Python files to process")
         return python_files
@@ -77,29 +96,20 @@ def list_python_files(bucket_name: str, prefix: str) -> List[str]:
 
 def read_file_from_s3(bucket_name: str, file_key: str) -> str:
     try:
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        logger.info(f"Successfully read file from S3. Status: {response['ResponseMetadata']['HTTPStatusCode']}")
-        file_content = response['Body'].read().decode('utf-8')
+        s3_client = get_client('s3')
+        file_content = read_object_text(s3_client, bucket_name, file_key)
+        logger.info(f"Successfully read file from S3: {file_key}")
         return file_content
     except ClientError as e:
         logger.error(f"Error reading file from S3: {e.response['Error']}")
         raise
 
 def write_to_s3(bucket_name: str, file_key: str, content: str) -> None:
-    try:
-        s3_client = boto3.client('s3')
-        response = s3_client.put_object(
-            Bucket=bucket_name,
-            Key=file_key,
-            Body=content.encode('utf-8')
-        )
-        logger.info(f"Successfully wrote to S3. Status: {response['ResponseMetadata']['HTTPStatusCode']}")
-    except ClientError as e:
-        logger.error(f"Error writing to S3: {e.response['Error']}")
-        raise
+    # Queued for the shared write-behind sink; uploads finish in the background and are flushed at stage end
+    get_output_sink().write(bucket_name, file_key, content)
 
-def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) -> Optional[dict]:
+def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10,
+                            route: str = 'epics') -> Optional[dict]:
     retryable_errors = [
         'ThrottlingException',
         'InternalServerError',
@@ -111,10 +121,7 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
     
     for attempt in range(1, max_retries + 1):
         try:
-            response = bedrock_client.invoke_model(
-                modelId='anthropic.claude-3-5-sonnet-20240620-v1:0',
-                body=body
-            )
+            response = invoke_routed(bedrock_client, body, route)
             
             status_code = response['ResponseMetadata']['HTTPStatusCode']
             logger.info(f"Bedrock API call successful on attempt {attempt}. Status Code: {status_code}")
@@ -135,6 +142,11 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
             """)
             
             if error_code in retryable_errors and attempt < max_retries:
+                inc('bedrock_retries_total', route=route, code=error_code)
+                if error_code == 'ThrottlingException':
+                    logger.info("Throttled; retrying at the rate limiter's reduced rate...")
+                    continue
+                
                 delay = exponential_backoff(attempt)
                 logger.info(f"Retrying in {delay:.2f} seconds...")
                 time.sleep(delay)
@@ -144,11 +156,9 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
                 raise BedrockRetryException(f"Failed after {max_retries} attempts. Last error: {error_message}")
             raise e
 
-def generate_requirements(code_content: str) -> str:
-    try:
-        bedrock_client = boto3.client('bedrock-runtime')
-        
-        prompt = f"""Analyze this Python code and generate comprehensive agile requirements documentation in Markdown format. 
+def build_requirements_body(code_content: str) -> str:
+    # The code goes in the cacheable prefix shared with the documentation and test stages
+    task = """Analyze the Python code above and generate comprehensive agile requirements documentation in Markdown format. 
         Include:
         
         1. Epic Overview
@@ -169,22 +179,16 @@ def generate_requirements(code_content: str) -> str:
            - As a [role], I want [goal], so that [benefit]
            - Story points estimation
            - Priority (Must Have/Should Have/Could Have)
-           - Acceptance Criteria (minimum 3 per story)
-        
-        Here's the code to analyze:
+           - Acceptance Criteria (minimum 3 per story)"""
+
+    return bedrock.build_module_task_body(code_content, task, max_tokens=4096)
 
-        {code_content}"""
 
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 4096,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        })
+def generate_requirements(code_content: str) -> str:
+    try:
+        bedrock_client = get_client('bedrock-runtime')
+        
+        body = build_requirements_body(code_content)
 
         response = call_bedrock_with_retry(bedrock_client, body)
         response_body = json.loads(response['body'].read())
@@ -197,6 +201,14 @@ def generate_requirements(code_content: str) -> str:
         logger.error(f"Unexpected error in generate_requirements: {str(e)}")
         raise
 
+async def generate_requirements_async(aws: AsyncAWS, code_content: str) -> str:
+    try:
+        response_body = await aws.invoke_model_with_retry(build_requirements_body(code_content), route='epics')
+        return response_body['content'][0]['text']
+    except Exception as e:
+        logger.error(f"Error in generate_requirements_async: {str(e)}")
+        raise
+
 def process_single_file(bucket_name: str, source_key: str, epic_folder: str) -> None:
     try:
         logger.info(f"Processing file: {source_key}")
@@ -213,41 +225,146 @@ def process_single_file(bucket_name: str, source_key: str, epic_folder: str) ->
         logger.error(f"Error processing file {source_key}: {str(e)}")
         raise
 
+async def process_single_file_async(aws: AsyncAWS, bucket_name: str, source_key: str, epic_folder: str) -> None:
+    try:
+        logger.info(f"Processing file: {source_key}")
+        code_content = await aws.get_object_text(bucket_name, source_key)
+        requirements = await generate_requirements_async(aws, code_content)
+        await aws.put_object_text(bucket_name, generate_requirements_key(source_key, epic_folder), requirements)
+        
+        logger.info(f"Requirements generated successfully for {source_key}")
+        
+    except Exception as e:
+        logger.error(f"Error processing file {source_key}: {str(e)}")
+        raise
+
 def main(bucket_name: str, source_prefix: str, epic_folder: str) -> None:
     try:
         logger.info(f"Starting batch requirements generation process for {source_prefix}")
         
-        python_files = list_python_files(bucket_name, source_prefix)
-        total_files = len(python_files)
+        manifest = StageManifest(bucket_name, 'app_epics_features_generator', PROMPT_VERSION).load()
         
-        for index, file_key in enumerate(python_files, 1):
+        # Files are processed as the listing streams them in, without waiting for it to finish
+        python_objects = get_object_lister().iter_objects(bucket_name, source_prefix, ('.py',))
+        total_files = 0
+        for index, (file_key, info) in enumerate(manifest.iter_pending(python_objects), 1):
+            total_files = index
             try:
-                logger.info(f"Processing file {index}/{total_files}: {file_key}")
+                logger.info(f"Processing file {index}: {file_key}")
                 process_single_file(bucket_name, file_key, epic_folder)
-                logger.info(f"Completed processing file {index}/{total_files}")
+                manifest.record(file_key, info['etag'], [generate_requirements_key(file_key, epic_folder)],
+                                info['last_modified'])
+                manifest.save()
+                logger.info(f"Completed processing file {index}")
             except Exception as e:
                 logger.error(f"Failed to process file {file_key}: {str(e)}")
                 logger.info("Continuing with next file...")
                 continue
         
-        logger.info("Batch requirements generation process completed")
+        # Wait for outputs still uploading; the manifest then also records the inputs that produced them
+        flush_outputs()
+        manifest.save()
+        
+        logger.info(f"Batch requirements generation process completed for {total_files} Python files")
         
     except Exception as e:
         logger.error(f"Error in batch requirements process: {str(e)}")
         raise
     finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
+        upload_log_to_s3(bucket_name, log_filename)
+
+async def main_async(bucket_name: str, source_prefix: str, epic_folder: str, max_concurrency: int) -> None:
+    try:
+        logger.info(f"Starting async requirements generation process for {source_prefix} with up to {max_concurrency} files in flight")
+        
+        async with AsyncAWS() as aws:
+            object_info = {}
+            python_files = []
+            async for obj in aws.list_objects(bucket_name, source_prefix, ('.py',)):
+                python_files.append(obj['Key'])
+                object_info[obj['Key']] = object_info_from_listing(obj)
+            
+            manifest = StageManifest(bucket_name, 'app_epics_features_generator', PROMPT_VERSION).load()
+            etags = {key: info['etag'] for key, info in object_info.items()}
+            python_files = manifest.filter_pending(python_files, etags)
+            
+            async def process(file_key: str) -> None:
+                await process_single_file_async(aws, bucket_name, file_key, epic_folder)
+                manifest.record(file_key, etags[file_key], [generate_requirements_key(file_key, epic_folder)], object_info[file_key]['last_modified'])
+                await asyncio.to_thread(manifest.save)
+            
+            await run_bounded(python_files, process, max_concurrency, "file")
+        
+        logger.info("Async requirements generation process completed")
+        
+    except Exception as e:
+        logger.error(f"Error in async requirements generation process: {str(e)}")
+        raise
+    finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
+        upload_log_to_s3(bucket_name, log_filename)
+
+def main_batch(bucket_name: str, source_prefix: str, epic_folder: str, batch_mode: str) -> None:
+    try:
+        logger.info(f"Starting requirements generation for {source_prefix} as a {batch_mode} batch job")
+        
+        object_info = {}
+        python_files = list_python_files(bucket_name, source_prefix, object_info)
+        
+        manifest = StageManifest(bucket_name, 'app_epics_features_generator', PROMPT_VERSION).load()
+        etags = {key: info['etag'] for key, info in object_info.items()}
+        python_files = manifest.filter_pending(python_files, etags)
+        
+        requests = []
+        for file_key in python_files:
+            code_content = read_file_from_s3(bucket_name, file_key)
+            requests.append(BatchRequest(file_key, build_requirements_body(code_content),
+                                         generate_requirements_key(file_key, epic_folder)))
+        
+        backend = get_batch_backend(batch_mode, get_model_router().primary_model('epics'))
+        completed = run_batch(bucket_name, 'app_epics_features_generator', requests, backend)
+        for file_key, output_keys in completed.items():
+            if len(output_keys) == 1:
+                manifest.record(file_key, etags[file_key], output_keys, object_info[file_key]['last_modified'])
+        manifest.save()
+        
+        logger.info(f"Batch requirements generation completed for {len(completed)}/{len(python_files)} files")
+        
+    except Exception as e:
+        logger.error(f"Error in batch requirements generation process: {str(e)}")
+        raise
+    finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
         upload_log_to_s3(bucket_name, log_filename)
 
 if __name__ == "__main__":
     script_name = os.path.abspath(__file__)
     logger, log_filename = setup_logging(script_name)
     
-    BUCKET_NAME = "s3-genai-coffee-and-innovate"
+    BUCKET_NAME = get_bucket_name()
     SOURCE_PREFIX = "target/src"
     EPIC_FOLDER = "target/epics"
     
+    # Set PIPELINE_ASYNC_CONCURRENCY to run the stage on the asyncio client layer with that many files in flight
+    ASYNC_CONCURRENCY = int(os.environ.get('PIPELINE_ASYNC_CONCURRENCY', '0'))
+    
+    # Set PIPELINE_BATCH_MODE to "bedrock" (batch inference job) or "local" (stand-in) to run as one batch
+    BATCH_MODE = os.environ.get('PIPELINE_BATCH_MODE')
+    
     try:
-        main(BUCKET_NAME, SOURCE_PREFIX, EPIC_FOLDER)
+        if BATCH_MODE:
+            main_batch(BUCKET_NAME, SOURCE_PREFIX, EPIC_FOLDER, BATCH_MODE)
+        elif ASYNC_CONCURRENCY > 0:
+            asyncio.run(main_async(BUCKET_NAME, SOURCE_PREFIX, EPIC_FOLDER, ASYNC_CONCURRENCY))
+        else:
+            main(BUCKET_NAME, SOURCE_PREFIX, EPIC_FOLDER)
     except Exception as e:
         logger.error("Process failed with error:", exc_info=True)
         upload_log_to_s3(BUCKET_NAME, log_filename)
@@ -1,4 +1,3 @@
-import boto3
 import json
 import time
 from botocore.exceptions import ClientError
@@ -9,6 +8,20 @@ import os
 from datetime import datetime
 import re
 
+from pipeline.clients import get_client
+from pipeline.listing import get_object_lister
+from pipeline.manifest import StageManifest, combine_etags, object_info_from_listing
+from pipeline.metrics import log_metrics_summary
+from pipeline.outputs import flush_outputs, get_output_sink
+from pipeline.storage import get_bucket_name
+from pipeline.text import read_object_text
+
+# Replaced by setup_logging when run as a script; lets CodeGenerator.py import the stage functions
+logger = logging.getLogger(__name__)
+
+# Bump whenever the feature file layout changes so the manifest stops skipping old outputs
+GENERATOR_VERSION = "1"
+
 def setup_logging(script_name: str) -> tuple:
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     base_name = os.path.splitext(os.path.basename(script_name))[0]
@@ -22,11 +35,15 @@ def setup_logging(script_name: str) -> tuple:
     logger.setLevel(logging.INFO)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
+    pipeline_logger = logging.getLogger('pipeline')
+    pipeline_logger.setLevel(logging.INFO)
+    pipeline_logger.addHandler(file_handler)
+    pipeline_logger.addHandler(console_handler)
     return logger, log_filename
 
 def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_client('s3')
         log_key = f"logs/{log_filename}"
         
         with open(log_filename, 'rb') as log_file:
@@ -40,19 +57,16 @@ def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
         logger.error(f"Error uploading log file to S3: {str(e)}")
         raise
 
-def list_test_files(bucket_name: str, test_folder: str) -> List[Tuple[str, str]]:
+def list_test_files(bucket_name: str, test_folder: str,
+                    object_info: Optional[dict] = None) -> List[Tuple[str, str]]:
     """Returns list of tuples containing (unit_test_file, functional_test_file)"""
     try:
-        s3_client = boto3.client('s3')
-        paginator = s3_client.get_paginator('list_objects_v2')
-        
-        # Get all Python files
+        # Get all Python files; pairing needs the whole listing, so it is collected first
         all_files = []
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=test_folder):
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    if obj['Key'].endswith('.py'):
-                        all_files.append(obj['Key'])
+        for obj in get_object_lister().list_objects(bucket_name, test_folder, ('.py',)):
+            all_files.append(obj['Key'])
+            if object_info is not None:
+                object_info[obj['Key']] = object_info_from_listing(obj)
         
         logger.info(f"Found {len(all_files)} Python files")
         for file in all_files:
@@ -82,26 +96,16 @@ def list_test_files(bucket_name: str, test_folder: str) -> List[Tuple[str, str]]
 
 def read_file_from_s3(bucket_name: str, file_key: str) -> str:
     try:
-        s3_client = boto3.client('s3')
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        file_content = response['Body'].read().decode('utf-8')
+        s3_client = get_client('s3')
+        file_content = read_object_text(s3_client, bucket_name, file_key)
         return file_content
     except ClientError as e:
         logger.error(f"Error reading file from S3: {e.response['Error']}")
         raise
 
 def write_to_s3(bucket_name: str, file_key: str, content: str) -> None:
-    try:
-        s3_client = boto3.client('s3')
-        response = s3_client.put_object(
-            Bucket=bucket_name,
-            Key=file_key,
-            Body=content.encode('utf-8')
-        )
-        logger.info(f"Successfully wrote to S3: {file_key}")
-    except ClientError as e:
-        logger.error(f"Error writing to S3: {e.response['Error']}")
-        raise
+    # Queued for the shared write-behind sink; uploads finish in the background and are flushed at stage end
+    get_output_sink().write(bucket_name, file_key, content)
 
 def extract_test_info(test_content: str) -> List[dict]:
     """Extract test cases and their docstrings/comments"""
@@ -201,7 +205,16 @@ def main(bucket_name: str, test_folder: str) -> None:
         logger.info("Starting test to Gherkin conversion process")
         
         # Get test file pairs
-        test_pairs = list_test_files(bucket_name, test_folder)
+        object_info = {}
+        test_pairs = list_test_files(bucket_name, test_folder, object_info)
+        
+        manifest = StageManifest(bucket_name, 'app_gherkin_generator', GENERATOR_VERSION).load()
+        etags = {
+            unit_file: combine_etags(object_info[unit_file]['etag'], object_info[functional_file]['etag'])
+            for unit_file, functional_file in test_pairs
+        }
+        pending_units = set(manifest.filter_pending([unit_file for unit_file, _ in test_pairs], etags))
+        test_pairs = [pair for pair in test_pairs if pair[0] in pending_units]
         total_pairs = len(test_pairs)
         
         logger.info(f"Found {total_pairs} test pairs to process")
@@ -210,18 +223,26 @@ def main(bucket_name: str, test_folder: str) -> None:
             try:
                 logger.info(f"Processing pair {index}/{total_pairs}")
                 process_test_pair(bucket_name, unit_file, functional_file)
+                manifest.record(unit_file, etags[unit_file], [get_gherkin_filename(unit_file)])
+                manifest.save()
                 logger.info(f"Completed processing pair {index}/{total_pairs}")
             except Exception as e:
                 logger.error(f"Failed to process test pair: {str(e)}")
                 logger.info("Continuing with next pair...")
                 continue
         
+        # Wait for outputs still uploading; the manifest then also records the inputs that produced them
+        flush_outputs()
+        manifest.save()
+        
         logger.info("Gherkin conversion process completed")
         
     except Exception as e:
         logger.error(f"Error in conversion process: {str(e)}")
         raise
     finally:
+        flush_outputs()
+        log_metrics_summary()
         upload_log_to_s3(bucket_name, log_filename)
 
 if __name__ == "__main__":
@@ -229,7 +250,7 @@ if __name__ == "__main__":
         script_name = os.path.abspath(__file__)
         logger, log_filename = setup_logging(script_name)
         
-        BUCKET_NAME = "s3-genai-coffee-and-innovate"
+        BUCKET_NAME = get_bucket_name()
         TEST_FOLDER = "target/test"
         
         main(BUCKET_NAME, TEST_FOLDER)
@@ -1,13 +1,105 @@
-import boto3
+import asyncio
 import json
+import re
 import time
 from botocore.exceptions import ClientError
 import logging
-from typing import Optional, List
+from typing import Dict, Iterable, Optional, List
 import random
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from pipeline.aio import AsyncAWS, run_bounded
+from pipeline.batch import BatchRequest, get_batch_backend, run_batch
+from pipeline.clients import get_client
+from pipeline.listing import get_object_lister
+from pipeline.manifest import StageManifest, object_info_from_listing
+from pipeline.metrics import inc, log_metrics_summary
+from pipeline.outputs import flush_outputs, get_output_sink
+from pipeline.routing import get_model_router, invoke_routed, log_route_summary
+from pipeline.storage import get_bucket_name
+from pipeline.text import IncrementalSourceNormalizer, iter_body_chunks
+
+# Replaced by setup_logging when run as a script; lets CodeGenerator.py import the stage functions
+logger = logging.getLogger(__name__)
+
+# Bump whenever the analysis prompts change so the manifest stops skipping old outputs
+PROMPT_VERSION = "2"
+ANALYSIS_TYPES = ("documentation", "domain_knowledge", "sme_conversation")
+ANALYSIS_WORKERS = len(ANALYSIS_TYPES)
+
+# Prompts for PL/SQL analysis
+PLSQL_PROMPTS = {
+    "documentation": """Generate comprehensive documentation for this PL/SQL code:
+            1. Overview and purpose
+            2. Detailed procedure/function descriptions
+            3. Parameters and return values
+            4. Dependencies and prerequisites
+            5. Usage examples
+            6. Best practices and considerations
+            
+            Code to analyze: {content}""",
+            
+    "domain_knowledge": """Analyze this PL/SQL code and extract domain-specific knowledge:
+            1. Business rules and logic implemented
+            2. Data model insights
+            3. Key business processes
+            4. Industry-specific patterns
+            5. Technical architecture considerations
+            
+            Code to analyze: {content}""",
+            
+    "sme_conversation": """Create a Q&A style knowledge base from an SME perspective:
+            1. Common questions about this code
+            2. Troubleshooting scenarios
+            3. Implementation considerations
+            4. Performance optimization tips
+            5. Maintenance and support guidance
+            
+            Code to analyze: {content}"""
+}
+
+# Prompts for README analysis
+README_PROMPTS = {
+    "documentation": """Generate comprehensive documentation for this project:
+            1. Project overview and objectives
+            2. Key features and components
+            3. System architecture and design
+            4. Setup and configuration steps
+            5. Usage guidelines
+            6. Integration points and dependencies
+            
+            README content: {content}""",
+            
+    "domain_knowledge": """Extract domain-specific knowledge from this project:
+            1. Business context and requirements
+            2. Domain terminology and concepts
+            3. Core business processes
+            4. System boundaries and constraints
+            5. Integration patterns and workflows
+            
+            README content: {content}""",
+            
+    "sme_conversation": """Create a Q&A knowledge base for this project:
+            1. Frequently asked questions
+            2. Common implementation challenges
+            3. Best practices and recommendations
+            4. Troubleshooting guide
+            5. Maintenance and support guidelines
+            
+            README content: {content}"""
+}
+
+# Used when KNOWLEDGE_BASE_COMBINED_ANALYSIS is set: one request returns every analysis, each in its own tag
+COMBINED_PROMPT = """Complete each of the tasks below for the same input. Write the result of each task
+            inside an XML tag named after the task, for example <documentation>...</documentation>,
+            and write nothing outside those tags.
+            
+            {tasks}
+            
+            Input: {content}"""
+
 def setup_logging(script_name: str) -> tuple:
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     base_name = os.path.splitext(os.path.basename(script_name))[0]
@@ -21,11 +113,15 @@ def setup_logging(script_name: str) -> tuple:
     logger.setLevel(logging.INFO)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
+    pipeline_logger = logging.getLogger('pipeline')
+    pipeline_logger.setLevel(logging.INFO)
+    pipeline_logger.addHandler(file_handler)
+    pipeline_logger.addHandler(console_handler)
     return logger, log_filename
 
 def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_client('s3')
         log_key = f"target/logs/{log_filename}"
         
         with open(log_filename, 'rb') as log_file:
@@ -57,21 +153,22 @@ def is_readme_file(file_key: str) -> bool:
     base_name = os.path.basename(file_key).lower()
     return base_name in ['readme.txt', 'readme.md']
 
-def list_files_by_type(bucket_name: str, prefix: str) -> tuple[List[str], List[str]]:
+def list_files_by_type(bucket_name: str, prefix: str,
+                       object_info: Optional[dict] = None) -> tuple[List[str], List[str]]:
     try:
-        s3_client = boto3.client('s3')
-        paginator = s3_client.get_paginator('list_objects_v2')
         plsql_files = []
         readme_files = []
 
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    if is_plsql_file(key):
-                        plsql_files.append(key)
-                    elif is_readme_file(key):
-                        readme_files.append(key)
+        for obj in get_object_lister().list_objects(bucket_name, prefix, from_inventory=True):
+            key = obj['Key']
+            if is_plsql_file(key):
+                plsql_files.append(key)
+            elif is_readme_file(key):
+                readme_files.append(key)
+            else:
+                continue
+            if object_info is not None:
+                object_info[key] = object_info_from_listing(obj)
         
         logger.info(f"Found {len(plsql_files)} PL/SQL files and {len(readme_files)} README files in {prefix}")
         return plsql_files, readme_files
@@ -83,7 +180,8 @@ def generate_output_key(source_key: str, output_type: str) -> str:
     base_name = os.path.splitext(os.path.basename(source_key))[0]
     return f"target/knowledge_base/{output_type}/{base_name}.md"
 
-def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) -> Optional[dict]:
+def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10,
+                            route: str = 'knowledge_base') -> Optional[dict]:
     retryable_errors = [
         'ThrottlingException',
         'InternalServerError',
@@ -95,10 +193,7 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
     
     for attempt in range(1, max_retries + 1):
         try:
-            response = bedrock_client.invoke_model(
-                modelId='anthropic.claude-3-5-sonnet-20240620-v1:0',
-                body=body
-            )
+            response = invoke_routed(bedrock_client, body, route)
             logger.info(f"Bedrock API call successful on attempt {attempt}")
             return response
             
@@ -119,6 +214,11 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
             logger.error(f"Bedrock API Error Details:\n{json.dumps(error_details, indent=2)}")
             
             if error_code in retryable_errors and attempt < max_retries:
+                inc('bedrock_retries_total', route=route, code=error_code)
+                if error_code == 'ThrottlingException':
+                    logger.info(f"Throttled; retrying at the rate limiter's reduced rate... (Attempt {attempt}/{max_retries})")
+                    continue
+                
                 delay = min(32, (2 ** (attempt - 1))) + random.uniform(0, 0.1)
                 logger.info(f"Retrying in {delay:.2f} seconds... (Attempt {attempt}/{max_retries})")
                 time.sleep(delay)
@@ -129,235 +229,350 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
                 raise Exception(f"Failed after {max_retries} attempts. Last error: {error_message}")
             raise e
 
+def build_analysis_body(prompt_template: str, content: str) -> str:
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1000000,
+        "messages": [{"role": "user", "content": prompt_template.format(content=content)}]
+    })
+
+def build_combined_body(prompts: Dict[str, str], content: str) -> str:
+    tasks = "\n\n".join(
+        f'<task name="{analysis_type}">\n{prompt_template.format(content="(the input at the end)")}\n</task>'
+        for analysis_type, prompt_template in prompts.items()
+    )
+    return build_analysis_body(COMBINED_PROMPT.format(tasks=tasks, content="{content}"), content)
+
+def split_combined_response(text: str, analysis_types) -> Dict[str, str]:
+    """Pull each analysis out of its tag in a combined response; missing or empty sections are left out."""
+    sections = {}
+    for analysis_type in analysis_types:
+        match = re.search(rf"<{analysis_type}>(.*?)</{analysis_type}>", text, re.DOTALL)
+        if match and match.group(1).strip():
+            sections[analysis_type] = match.group(1).strip()
+    return sections
+
+def combined_analysis_enabled() -> bool:
+    return os.environ.get('KNOWLEDGE_BASE_COMBINED_ANALYSIS', '').lower() in ('1', 'true', 'yes')
+
 def read_file_content(s3_client, bucket_name: str, file_key: str) -> str:
     """
-    Read file content with multiple encoding attempts and cleanup
+    Read a source file from S3 as normalized ASCII text (see normalize_file_content)
     """
     try:
         response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        content_bytes = response['Body'].read()
-        
-        # Try different encodings
-        encodings_to_try = ['utf-8', 'latin1', 'cp1252', 'iso-8859-1']
-        
-        for encoding in encodings_to_try:
-            try:
-                logger.info(f"Attempting to decode {file_key} with {encoding} encoding")
-                content = content_bytes.decode(encoding, errors='replace')
-                # Replace any questionable characters with spaces
-                content = ''.join(char if ord(char) < 128 else ' ' for char in content)
-                # Remove any null characters
-                content = content.replace('\x00', '')
-                # Replace multiple spaces with single space
-                content = ' '.join(content.split())
-                logger.info(f"Successfully decoded {file_key} with {encoding} encoding")
-                return content
-            except UnicodeDecodeError as e:
-                logger.warning(f"Failed to decode {file_key} with {encoding} encoding: {str(e)}")
-                continue
-        
-        # If all encodings fail, use 'replace' with utf-8 as last resort
-        logger.warning(f"All standard encodings failed for {file_key}, using utf-8 with replacement")
-        content = content_bytes.decode('utf-8', errors='replace')
-        content = ''.join(char if ord(char) < 128 else ' ' for char in content)
-        content = content.replace('\x00', '')
-        content = ' '.join(content.split())
-        return content
-        
+        return normalize_file_content(iter_body_chunks(response['Body']), file_key)
     except Exception as e:
         logger.error(f"Error reading file {file_key}: {str(e)}")
         raise
 
-def process_plsql_file(bucket_name: str, file_key: str) -> None:
+def normalize_file_content(chunks: Iterable[bytes], file_key: str) -> str:
+    """
+    Decode a file's bytes to ASCII text piece by piece as they stream in: non-ASCII characters
+    become spaces and control characters are dropped, keeping the line breaks
+    """
     try:
-        s3_client = boto3.client('s3')
-        bedrock_client = boto3.client('bedrock-runtime')
-        
-        # Read the source file with enhanced encoding handling
-        logger.info(f"Reading file {file_key} with enhanced encoding handling")
-        code_content = read_file_content(s3_client, bucket_name, file_key)
-        
-        # Define prompts for PL/SQL analysis
-        prompts = {
-            "documentation": """Generate comprehensive documentation for this PL/SQL code:
-            1. Overview and purpose
-            2. Detailed procedure/function descriptions
-            3. Parameters and return values
-            4. Dependencies and prerequisites
-            5. Usage examples
-            6. Best practices and considerations
-            
-            Code to analyze: {content}""",
-            
-            "domain_knowledge": """Analyze this PL/SQL code and extract domain-specific knowledge:
-            1. Business rules and logic implemented
-            2. Data model insights
-            3. Key business processes
-            4. Industry-specific patterns
-            5. Technical architecture considerations
-            
-            Code to analyze: {content}""",
-            
-            "sme_conversation": """Create a Q&A style knowledge base from an SME perspective:
-            1. Common questions about this code
-            2. Troubleshooting scenarios
-            3. Implementation considerations
-            4. Performance optimization tips
-            5. Maintenance and support guidance
-            
-            Code to analyze: {content}"""
-        }
+        normalizer = IncrementalSourceNormalizer(file_key)
+        pieces = [normalizer.normalize(data) for data in chunks]
+        pieces.append(normalizer.normalize(b'', final=True))
+        content = ''.join(pieces)
+        log_normalized_content(file_key, normalizer, content)
+        return content
+
+    except Exception as e:
+        logger.error(f"Error decoding file {file_key}: {str(e)}")
+        raise
+
+def log_normalized_content(file_key: str, normalizer: IncrementalSourceNormalizer, content: str) -> None:
+    line_count = content.count('\n') + 1
+    logger.info(f"Decoded {file_key} as {normalizer.encoding} ({normalizer.bytes_read} bytes, {line_count} lines)")
+
+def generate_analysis(bedrock_client, prompt_template: str, content: str, route: str = 'knowledge_base') -> str:
+    response = call_bedrock_with_retry(bedrock_client, build_analysis_body(prompt_template, content), route=route)
+    response_body = json.loads(response['body'].read())
+    return response_body['content'][0]['text']
+
+def generate_analyses(bedrock_client, prompts: Dict[str, str], content: str, file_key: str,
+                      combined: bool = False) -> Dict[str, str]:
+    """
+    Generate every analysis in `prompts` for one file's decoded content.
+
+    In combined mode a single request returns all of them as tagged sections, so the
+    content is sent and billed once. Analyses that are not in the combined response,
+    or all of them when combined mode is off, are requested concurrently.
+    """
+    analyses = {}
+    if combined:
+        try:
+            logger.info(f"Generating combined analysis for {file_key}")
+            response = call_bedrock_with_retry(bedrock_client, build_combined_body(prompts, content),
+                                               route='knowledge_base.combined')
+            response_body = json.loads(response['body'].read())
+            analyses = split_combined_response(response_body['content'][0]['text'], prompts)
+            missing = [analysis_type for analysis_type in prompts if analysis_type not in analyses]
+            if missing:
+                logger.warning(f"Combined analysis for {file_key} is missing {', '.join(missing)}; requesting separately")
+        except Exception as e:
+            logger.error(f"Error generating combined analysis for {file_key}, requesting separately: {str(e)}")
+    
+    pending = {analysis_type: prompt_template for analysis_type, prompt_template in prompts.items()
+               if analysis_type not in analyses}
+    if not pending:
+        return analyses
+    
+    with ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS) as executor:
+        futures = {}
+        for analysis_type, prompt_template in pending.items():
+            logger.info(f"Generating {analysis_type} for {file_key}")
+            future = executor.submit(generate_analysis, bedrock_client, prompt_template, content,
+                                     f"knowledge_base.{analysis_type}")
+            futures[future] = analysis_type
         
-        # Process each type individually
-        for analysis_type, prompt_template in prompts.items():
+        for future in as_completed(futures):
+            analysis_type = futures[future]
             try:
-                logger.info(f"Generating {analysis_type} for {file_key}")
-                
-                body = json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 1000000,
-                    "messages": [{"role": "user", "content": prompt_template.format(content=code_content)}]
-                })
-                
-                response = call_bedrock_with_retry(bedrock_client, body)
-                response_body = json.loads(response['body'].read())
-                content = response_body['content'][0]['text']
-                
-                output_key = generate_output_key(file_key, analysis_type)
-                s3_client.put_object(
-                    Bucket=bucket_name,
-                    Key=output_key,
-                    Body=content.encode('utf-8')
-                )
-                logger.info(f"Successfully generated {analysis_type} at {output_key}")
-                time.sleep(1)  # Add small delay between calls
-                
+                analyses[analysis_type] = future.result()
             except Exception as e:
                 logger.error(f"Error generating {analysis_type} for {file_key}: {str(e)}")
-                continue
+    
+    return analyses
+
+def process_source_file(bucket_name: str, file_key: str, prompts: Dict[str, str], output_type_prefix: str,
+                        s3_client=None, bedrock_client=None) -> List[str]:
+    s3_client = s3_client or get_client('s3')
+    bedrock_client = bedrock_client or get_client('bedrock-runtime')
+    
+    # Read and decode the source once; every analysis reuses the same content
+    logger.info(f"Reading file {file_key} with enhanced encoding handling")
+    content = read_file_content(s3_client, bucket_name, file_key)
+    
+    analyses = generate_analyses(bedrock_client, prompts, content, file_key, combined_analysis_enabled())
+    
+    # The analyses are uploaded concurrently in the background while the next file is analysed
+    output_sink = get_output_sink()
+    output_keys = []
+    for analysis_type in prompts:
+        if analysis_type not in analyses:
+            continue
+        try:
+            output_key = generate_output_key(file_key, f"{output_type_prefix}{analysis_type}")
+            output_sink.write(bucket_name, output_key, analyses[analysis_type])
+            output_keys.append(output_key)
+            logger.info(f"Successfully generated {analysis_type} at {output_key}")
+            
+        except Exception as e:
+            logger.error(f"Error writing {analysis_type} for {file_key}: {str(e)}")
+            continue
+
+    return output_keys
 
+def process_plsql_file(bucket_name: str, file_key: str, s3_client=None, bedrock_client=None) -> List[str]:
+    try:
+        return process_source_file(bucket_name, file_key, PLSQL_PROMPTS, "", s3_client, bedrock_client)
     except Exception as e:
         logger.error(f"Error processing PL/SQL file {file_key}: {str(e)}")
         raise
 
-def process_readme_file(bucket_name: str, file_key: str) -> None:
+def process_readme_file(bucket_name: str, file_key: str, s3_client=None, bedrock_client=None) -> List[str]:
     try:
-        s3_client = boto3.client('s3')
-        bedrock_client = boto3.client('bedrock-runtime')
+        return process_source_file(bucket_name, file_key, README_PROMPTS, "readme_", s3_client, bedrock_client)
+    except Exception as e:
+        logger.error(f"Error processing README file {file_key}: {str(e)}")
+        raise
+
+async def process_file_async(aws: AsyncAWS, bucket_name: str, file_key: str) -> List[str]:
+    """
+    Async counterpart of process_plsql_file/process_readme_file.
+
+    The file is read and decoded once. Its three analyses are requested in one combined
+    call when KNOWLEDGE_BASE_COMBINED_ANALYSIS is set, and any that are still missing are
+    requested concurrently. Failed analyses are logged and left out of the returned output keys.
+    """
+    try:
+        is_readme = is_readme_file(file_key)
+        prompts = README_PROMPTS if is_readme else PLSQL_PROMPTS
         
-        # Read the README file
-        logger.info(f"Reading README file {file_key}")
-        readme_content = read_file_content(s3_client, bucket_name, file_key)
+        logger.info(f"Reading file {file_key} with enhanced encoding handling")
+        normalizer = IncrementalSourceNormalizer(file_key)
+        pieces = [normalizer.normalize(data) async for data in aws.iter_object_chunks(bucket_name, file_key)]
+        pieces.append(normalizer.normalize(b'', final=True))
+        content = ''.join(pieces)
+        log_normalized_content(file_key, normalizer, content)
         
-        # Define prompts for README analysis with single content reference
-        prompts = {
-            "documentation": """Generate comprehensive documentation for this project:
-            1. Project overview and objectives
-            2. Key features and components
-            3. System architecture and design
-            4. Setup and configuration steps
-            5. Usage guidelines
-            6. Integration points and dependencies
-            
-            README content: {content}""",
-            
-            "domain_knowledge": """Extract domain-specific knowledge from this project:
-            1. Business context and requirements
-            2. Domain terminology and concepts
-            3. Core business processes
-            4. System boundaries and constraints
-            5. Integration patterns and workflows
-            
-            README content: {content}""",
-            
-            "sme_conversation": """Create a Q&A knowledge base for this project:
-            1. Frequently asked questions
-            2. Common implementation challenges
-            3. Best practices and recommendations
-            4. Troubleshooting guide
-            5. Maintenance and support guidelines
-            
-            README content: {content}"""
-        }
+        analyses = {}
+        if combined_analysis_enabled():
+            try:
+                logger.info(f"Generating combined analysis for {file_key}")
+                response_body = await aws.invoke_model_with_retry(build_combined_body(prompts, content),
+                                                                  route='knowledge_base.combined')
+                analyses = split_combined_response(response_body['content'][0]['text'], prompts)
+            except Exception as e:
+                logger.error(f"Error generating combined analysis for {file_key}, requesting separately: {str(e)}")
         
-        # Process each type individually
-        for analysis_type, prompt_template in prompts.items():
+        async def analyse(analysis_type: str, prompt_template: str) -> Optional[str]:
             try:
-                logger.info(f"Generating {analysis_type} for {file_key}")
-                
-                body = json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": 1000000,
-                    "messages": [{"role": "user", "content": prompt_template.format(content=readme_content)}]
-                })
-                
-                response = call_bedrock_with_retry(bedrock_client, body)
-                response_body = json.loads(response['body'].read())
-                content = response_body['content'][0]['text']
-                
-                output_key = generate_output_key(file_key, f"readme_{analysis_type}")
-                s3_client.put_object(
-                    Bucket=bucket_name,
-                    Key=output_key,
-                    Body=content.encode('utf-8')
-                )
+                if analysis_type in analyses:
+                    text = analyses[analysis_type]
+                else:
+                    logger.info(f"Generating {analysis_type} for {file_key}")
+                    response_body = await aws.invoke_model_with_retry(build_analysis_body(prompt_template, content),
+                                                                      route=f"knowledge_base.{analysis_type}")
+                    text = response_body['content'][0]['text']
+                output_key = generate_output_key(file_key, f"readme_{analysis_type}" if is_readme else analysis_type)
+                await aws.put_object_text(bucket_name, output_key, text)
                 logger.info(f"Successfully generated {analysis_type} at {output_key}")
-                time.sleep(1)  # Add small delay between calls
-                
+                return output_key
             except Exception as e:
                 logger.error(f"Error generating {analysis_type} for {file_key}: {str(e)}")
-                continue
+                return None
+        
+        output_keys = await asyncio.gather(*(analyse(analysis_type, prompt_template)
+                                             for analysis_type, prompt_template in prompts.items()))
+        return [output_key for output_key in output_keys if output_key]
 
     except Exception as e:
-        logger.error(f"Error processing README file {file_key}: {str(e)}")
+        logger.error(f"Error processing file {file_key}: {str(e)}")
         raise
 
 def main(bucket_name: str, source_prefix: str) -> None:
     try:
         logger.info(f"Starting knowledge base generation for files in {source_prefix}")
         
-        # Get PL/SQL and README files separately
-        plsql_files, readme_files = list_files_by_type(bucket_name, source_prefix)
+        manifest = StageManifest(bucket_name, 'app_knowledge_base', PROMPT_VERSION).load()
         
-        # Process PL/SQL files
-        logger.info("Processing PL/SQL files...")
-        for index, file_key in enumerate(plsql_files, 1):
-            try:
-                logger.info(f"Processing PL/SQL file {index}/{len(plsql_files)}: {file_key}")
-                process_plsql_file(bucket_name, file_key)
-                logger.info(f"Completed processing PL/SQL file {index}/{len(plsql_files)}")
-            except Exception as e:
-                logger.error(f"Failed to process PL/SQL file {file_key}: {str(e)}")
-                continue
+        s3_client = get_client('s3')
+        bedrock_client = get_client('bedrock-runtime')
         
-        # Process README files
-        logger.info("Processing README files...")
-        for index, file_key in enumerate(readme_files, 1):
+        # PL/SQL and README files are processed as the listing (or inventory) streams them in,
+        # without waiting for it to finish
+        source_objects = (obj for obj in get_object_lister().iter_objects(bucket_name, source_prefix, from_inventory=True)
+                          if is_plsql_file(obj['Key']) or is_readme_file(obj['Key']))
+        total_files = 0
+        for index, (file_key, info) in enumerate(manifest.iter_pending(source_objects), 1):
+            total_files = index
+            file_type, process_file = ('README', process_readme_file) if is_readme_file(file_key) \
+                else ('PL/SQL', process_plsql_file)
             try:
-                logger.info(f"Processing README file {index}/{len(readme_files)}: {file_key}")
-                process_readme_file(bucket_name, file_key)
-                logger.info(f"Completed processing README file {index}/{len(readme_files)}")
+                logger.info(f"Processing {file_type} file {index}: {file_key}")
+                output_keys = process_file(bucket_name, file_key, s3_client, bedrock_client)
+                if len(output_keys) == len(ANALYSIS_TYPES):
+                    manifest.record(file_key, info['etag'], output_keys, info['last_modified'])
+                    manifest.save()
+                logger.info(f"Completed processing {file_type} file {index}")
             except Exception as e:
-                logger.error(f"Failed to process README file {file_key}: {str(e)}")
+                logger.error(f"Failed to process {file_type} file {file_key}: {str(e)}")
                 continue
         
+        # Wait for outputs still uploading; the manifest then also records the inputs that produced them
+        flush_outputs()
+        manifest.save()
+        
+        logger.info(f"Processed {total_files} PL/SQL and README files")
+        logger.info("Knowledge base generation completed")
+        
+    except Exception as e:
+        logger.error(f"Error in knowledge base generation process: {str(e)}")
+        raise
+    finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
+        upload_log_to_s3(bucket_name, log_filename)
+
+async def main_async(bucket_name: str, source_prefix: str, max_concurrency: int) -> None:
+    try:
+        logger.info(f"Starting async knowledge base generation for files in {source_prefix}")
+        
+        async with AsyncAWS() as aws:
+            object_info = {}
+            source_files = []
+            async for obj in aws.list_objects(bucket_name, source_prefix):
+                if is_plsql_file(obj['Key']) or is_readme_file(obj['Key']):
+                    source_files.append(obj['Key'])
+                    object_info[obj['Key']] = object_info_from_listing(obj)
+            
+            manifest = StageManifest(bucket_name, 'app_knowledge_base', PROMPT_VERSION).load()
+            etags = {key: info['etag'] for key, info in object_info.items()}
+            source_files = manifest.filter_pending(source_files, etags)
+            
+            async def process(file_key: str) -> None:
+                output_keys = await process_file_async(aws, bucket_name, file_key)
+                if len(output_keys) == len(ANALYSIS_TYPES):
+                    manifest.record(file_key, etags[file_key], output_keys, object_info[file_key]['last_modified'])
+                    await asyncio.to_thread(manifest.save)
+            
+            await run_bounded(source_files, process, max_concurrency, "file")
+        
         logger.info("Knowledge base generation completed")
         
     except Exception as e:
         logger.error(f"Error in knowledge base generation process: {str(e)}")
         raise
     finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
+        upload_log_to_s3(bucket_name, log_filename)
+
+def main_batch(bucket_name: str, source_prefix: str, batch_mode: str) -> None:
+    try:
+        logger.info(f"Starting knowledge base generation for {source_prefix} as a {batch_mode} batch job")
+        
+        object_info = {}
+        plsql_files, readme_files = list_files_by_type(bucket_name, source_prefix, object_info)
+        
+        manifest = StageManifest(bucket_name, 'app_knowledge_base', PROMPT_VERSION).load()
+        etags = {key: info['etag'] for key, info in object_info.items()}
+        source_files = manifest.filter_pending(plsql_files + readme_files, etags)
+        
+        s3_client = get_client('s3')
+        requests = []
+        for file_key in source_files:
+            content = read_file_content(s3_client, bucket_name, file_key)
+            is_readme = is_readme_file(file_key)
+            prompts = README_PROMPTS if is_readme else PLSQL_PROMPTS
+            for analysis_type, prompt_template in prompts.items():
+                output_key = generate_output_key(file_key, f"readme_{analysis_type}" if is_readme else analysis_type)
+                requests.append(BatchRequest(file_key, build_analysis_body(prompt_template, content), output_key))
+        
+        backend = get_batch_backend(batch_mode, get_model_router().primary_model('knowledge_base'))
+        completed = run_batch(bucket_name, 'app_knowledge_base', requests, backend, s3_client)
+        for file_key, output_keys in completed.items():
+            if len(output_keys) == len(ANALYSIS_TYPES):
+                manifest.record(file_key, etags[file_key], output_keys, object_info[file_key]['last_modified'])
+        manifest.save()
+        
+        logger.info(f"Batch knowledge base generation completed for {len(completed)}/{len(source_files)} files")
+        
+    except Exception as e:
+        logger.error(f"Error in batch knowledge base generation process: {str(e)}")
+        raise
+    finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
         upload_log_to_s3(bucket_name, log_filename)
 
 if __name__ == "__main__":
     script_name = os.path.abspath(__file__)
     logger, log_filename = setup_logging(script_name)
 
-    BUCKET_NAME = "s3-genai-coffee-and-innovate"
+    BUCKET_NAME = get_bucket_name()
     SOURCE_PREFIX = "source/PL-SQL-Chess-master"
     
+    # Set PIPELINE_ASYNC_CONCURRENCY to run the stage on the asyncio client layer with that many files in flight
+    ASYNC_CONCURRENCY = int(os.environ.get('PIPELINE_ASYNC_CONCURRENCY', '0'))
+    
+    # Set PIPELINE_BATCH_MODE to "bedrock" (batch inference job) or "local" (stand-in) to run as one batch
+    BATCH_MODE = os.environ.get('PIPELINE_BATCH_MODE')
+    
     try:
-        main(BUCKET_NAME, SOURCE_PREFIX)
+        if BATCH_MODE:
+            main_batch(BUCKET_NAME, SOURCE_PREFIX, BATCH_MODE)
+        elif ASYNC_CONCURRENCY > 0:
+            asyncio.run(main_async(BUCKET_NAME, SOURCE_PREFIX, ASYNC_CONCURRENCY))
+        else:
+            main(BUCKET_NAME, SOURCE_PREFIX)
     except Exception as e:
         logger.error("Process failed with error:", exc_info=True)
         upload_log_to_s3(BUCKET_NAME, log_filename)
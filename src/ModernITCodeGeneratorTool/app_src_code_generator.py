@@ -1,19 +1,36 @@
-import boto3
 import json
 import os
-from botocore.exceptions import ClientError
+from botocore.exceptions import ClientError, ReadTimeoutError, ResponseStreamingError
 import logging
 from datetime import datetime
 import time
 import random
-from typing import Optional, Tuple, List
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from typing import Callable, Iterator, Optional, Tuple, List
+
+from pipeline import bedrock
+from pipeline.checkpoint import ConversionCheckpoint
+from pipeline.clients import get_client
+from pipeline.dependencies import PackageGraph, build_package_graph
+from pipeline.listing import get_object_lister
+from pipeline.manifest import StageManifest, combine_etags, object_info_from_listing
+from pipeline.plsql import chunk_plsql_package
+from pipeline.metrics import inc, log_metrics_summary
+from pipeline.outputs import flush_outputs, get_output_sink
+from pipeline.routing import get_model_router, invoke_routed, log_route_summary
+from pipeline.storage import get_bucket_name
+from pipeline.streaming import invoke_model_streaming, streaming_enabled
+from pipeline.text import iter_object_lines, read_object_text
+
+# Replaced by setup_logging when run as a script; lets CodeGenerator.py import the stage functions
+logger = logging.getLogger(__name__)
 
 def setup_logging(script_name: str) -> tuple:
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     base_name = os.path.splitext(os.path.basename(script_name))[0]
     log_filename = f"{base_name}_{timestamp}.log"
     
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(threadName)s] - %(message)s')
     
     file_handler = logging.FileHandler(log_filename)
     file_handler.setFormatter(formatter)
@@ -25,12 +42,16 @@ def setup_logging(script_name: str) -> tuple:
     logger.setLevel(logging.INFO)
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
+    pipeline_logger = logging.getLogger('pipeline')
+    pipeline_logger.setLevel(logging.INFO)
+    pipeline_logger.addHandler(file_handler)
+    pipeline_logger.addHandler(console_handler)
     
     return logger, log_filename
 
 def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
     try:
-        s3_client = boto3.client('s3')
+        s3_client = get_client('s3')
         log_key = f"logs/{log_filename}"
         
         with open(log_filename, 'rb') as log_file:
@@ -47,47 +68,59 @@ def upload_log_to_s3(bucket_name: str, log_filename: str) -> None:
 class BedrockRetryException(Exception):
     pass
 
+CHUNK_WORKERS = 4
+# Estimated input tokens of PL/SQL per chunk when a package is too large to convert in one request
+CHUNK_TOKEN_BUDGET = 8000
+# Above this estimated prompt size the converted output cannot also fit the context window, so go straight to chunks
+FULL_FILE_TOKEN_LIMIT = 60000
+# Converted chunks are merged in a tree: up to CONSOLIDATION_FAN_IN neighbours per prompt, within this many tokens
+CONSOLIDATION_FAN_IN = 4
+CONSOLIDATION_TOKEN_BUDGET = 24000
+# Bump whenever the conversion prompts change so the manifest stops skipping old outputs
+PROMPT_VERSION = "2"
+
+# Sent as the system prompt of every chunk request, so it is a stable, cacheable prefix
+CHUNK_INSTRUCTIONS = """You are an expert in both PL/SQL and Python, specifically focusing on chess engine development. 
+You convert PL/SQL chess engine code to equivalent Python code one chunk at a time.
+
+Convert each chunk to Python code that:
+1. Maintains the same chess logic and functionality
+2. Uses Pythonic patterns and best practices
+3. Can be integrated with other chunks of the same codebase
+4. Includes appropriate Python docstrings and type hints
+5. Maintains the same logic and functionality
+
+Ensure the code can be properly combined with the other chunks.
+Please provide only the converted Python code without any explanations."""
+
 def exponential_backoff(attempt: int, max_delay: int = 32) -> float:
     delay = min(max_delay, (2 ** (attempt - 1))) + random.uniform(0, 0.1)
     return delay
 
-def list_plsql_files(s3_client, bucket_name: str, source_prefix: str) -> List[str]:
+def list_plsql_files(s3_client, bucket_name: str, source_prefix: str,
+                     object_info: Optional[dict] = None) -> List[str]:
     try:
-        paginator = s3_client.get_paginator('list_objects_v2')
         all_files = set()
 
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=source_prefix):
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    if obj['Key'].endswith('.pks') or obj['Key'].endswith('.pkb'):
-                        base_name = os.path.splitext(os.path.basename(obj['Key']))[0]
-                        all_files.add(base_name)
+        # Sharded, concurrent listing (or the S3 Inventory when configured); the conversion
+        # order comes from the dependency graph, so the whole listing is collected first
+        for obj in get_object_lister().iter_objects(bucket_name, source_prefix, ('.pks', '.pkb'),
+                                                    s3_client, from_inventory=True):
+            base_name = os.path.splitext(os.path.basename(obj['Key']))[0]
+            all_files.add(base_name)
+            if object_info is not None:
+                object_info[obj['Key']] = object_info_from_listing(obj)
         
         logger.info(f"Found {len(all_files)} unique PL/SQL file pairs to process")
-        return list(all_files)
+        return sorted(all_files)
     except ClientError as e:
         logger.error(f"Error listing files from S3: {e.response['Error']}")
         raise
 
 def read_file_from_s3(s3_client, bucket_name: str, file_path: str) -> str:
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_path)
-        raw_content = response['Body'].read()
-        
-        encodings_to_try = ['utf-8', 'iso-8859-1', 'cp1252', 'latin1']
-        file_content = None
-
-        for encoding in encodings_to_try:
-            try:
-                file_content = raw_content.decode(encoding)
-                logger.info(f"Successfully decoded {file_path} using {encoding} encoding")
-                break
-            except UnicodeDecodeError:
-                continue
-
-        if file_content is None:
-            file_content = raw_content.decode('utf-8', errors='ignore')
-        return file_content
+        # Decoded incrementally as it streams in: UTF-8, falling back to latin-1 from the first invalid byte
+        return read_object_text(s3_client, bucket_name, file_path)
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
             logger.warning(f"File not found: {file_path}, returning empty string.")
@@ -95,16 +128,30 @@ def read_file_from_s3(s3_client, bucket_name: str, file_path: str) -> str:
             logger.error(f"Error reading file {file_path}: {e}")
         return ""
 
-def write_file_to_s3(s3_client, bucket_name: str, key: str, content: str) -> bool:
+def iter_file_lines_from_s3(s3_client, bucket_name: str, file_path: str) -> Iterator[str]:
+    """Lines of a file as they stream in from S3; a missing file has none, as in read_file_from_s3."""
     try:
-        s3_client.put_object(Bucket=bucket_name, Key=key, Body=content.encode('utf-8'))
-        logger.info(f"Successfully wrote file: {key}")
-        return True
+        yield from iter_object_lines(s3_client, bucket_name, file_path)
     except ClientError as e:
-        logger.error(f"Error writing file {key}: {e}")
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            logger.warning(f"File not found: {file_path}, treating it as empty.")
+        else:
+            logger.error(f"Error reading file {file_path}: {e}")
+
+def write_file_to_s3(s3_client, bucket_name: str, key: str, content: str,
+                     on_written: Optional[Callable[[], None]] = None) -> bool:
+    # Queued for the shared write-behind sink, which uploads with its own S3 client; `on_written`
+    # runs once the upload succeeds
+    try:
+        get_output_sink().write(bucket_name, key, content, on_written)
+        logger.info(f"Queued file for upload: {key}")
+        return True
+    except Exception as e:
+        logger.error(f"Error queueing file {key}: {e}")
         return False
 
-def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) -> Optional[dict]:
+def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10,
+                            label: str = "request", route: str = 'source') -> Optional[dict]:
     retryable_errors = [
         'ThrottlingException',
         'InternalServerError',
@@ -116,10 +163,13 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
     
     for attempt in range(1, max_retries + 1):
         try:
-            response = bedrock_client.invoke_model(
-                modelId='anthropic.claude-3-5-sonnet-20240620-v1:0',
-                body=body
-            )
+            # BEDROCK_STREAMING=1 consumes the response as it is generated, spooling partial output locally
+            if streaming_enabled():
+                response = invoke_routed(bedrock_client, body, route,
+                                         lambda client, routed_body, model_id:
+                                         invoke_model_streaming(client, routed_body, model_id, label))
+            else:
+                response = invoke_routed(bedrock_client, body, route)
             
             status_code = response['ResponseMetadata']['HTTPStatusCode']
             logger.info(f"Bedrock API call successful on attempt {attempt}. Status Code: {status_code}")
@@ -142,6 +192,11 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
                 if "Too many tokens" in error_message:
                     raise BedrockRetryException("Too many tokens")
                 
+                inc('bedrock_retries_total', route=route, code=error_code)
+                if error_code == 'ThrottlingException':
+                    logger.info("Throttled; retrying at the rate limiter's reduced rate...")
+                    continue
+                
                 delay = exponential_backoff(attempt)
                 logger.info(f"Retrying in {delay:.2f} seconds...")
                 time.sleep(delay)
@@ -151,54 +206,44 @@ def call_bedrock_with_retry(bedrock_client, body: str, max_retries: int = 10) ->
                 raise BedrockRetryException(f"Failed after {max_retries} attempts. Last error: {error_message}")
             raise e
 
-def split_code_into_chunks(pks_code: str, pkb_code: str, chunk_size: int = 6000) -> List[Tuple[str, str]]:
-    def split_plsql(code: str, chunk_size: int) -> List[str]:
-        if not code:
-            return [""]
-        
-        chunks = []
-        current_chunk = ""
-        
-        delimiters = [
-            "PROCEDURE", "FUNCTION", "CREATE OR REPLACE",
-            "procedure", "function", "create or replace"
-        ]
-        
-        lines = code.split('\n')
-        for line in lines:
-            if any(delimiter in line.upper() for delimiter in delimiters) and len(current_chunk) > chunk_size:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = ""
-            current_chunk += line + '\n'
-            
-        if current_chunk:
-            chunks.append(current_chunk)
-            
-        return chunks
-
-    pks_chunks = split_plsql(pks_code, chunk_size)
-    pkb_chunks = split_plsql(pkb_code, chunk_size)
-    
-    max_chunks = max(len(pks_chunks), len(pkb_chunks))
-    paired_chunks = []
-    
-    for i in range(max_chunks):
-        pks_chunk = pks_chunks[i] if i < len(pks_chunks) else ""
-        pkb_chunk = pkb_chunks[i] if i < len(pkb_chunks) else ""
-        paired_chunks.append((pks_chunk, pkb_chunk))
-    
+        except (ReadTimeoutError, ResponseStreamingError) as e:
+            # A streamed response resumes from its spool on the next attempt
+            logger.warning(f"Bedrock response for {label} interrupted (Attempt {attempt}/{max_retries}): {str(e)}")
+            if attempt == max_retries:
+                raise BedrockRetryException(f"Failed after {max_retries} attempts. Last error: {str(e)}")
+            inc('bedrock_retries_total', route=route, code=type(e).__name__)
+            delay = exponential_backoff(attempt)
+            logger.info(f"Retrying in {delay:.2f} seconds...")
+            time.sleep(delay)
+
+def split_code_into_chunks(pks_code: str, pkb_code: str,
+                          token_budget: int = CHUNK_TOKEN_BUDGET) -> List[Tuple[str, str]]:
+    """
+    Split a package into (spec, body) chunks that each fit `token_budget` estimated tokens.
+
+    Each spec declaration is paired with its body implementation by name, and whole
+    procedures/functions are packed together, so no chunk mixes unrelated spec and body fragments.
+    """
+    paired_chunks = chunk_plsql_package(pks_code, pkb_code, token_budget)
     logger.info(f"Split code into {len(paired_chunks)} chunks")
     return paired_chunks
 
 def convert_plsql_chunk_to_python(bedrock_client, chunk_number: int, total_chunks: int, 
-                                pks_chunk: str, pkb_chunk: str) -> Optional[str]:
+                                pks_chunk: str, pkb_chunk: str, file_label: str = "code",
+                                package_spec: Optional[str] = None,
+                                dependency_context: Optional[str] = None) -> Optional[str]:
     max_retries = 10
     
     for attempt in range(1, max_retries + 1):
         try:
-            prompt = f"""You are an expert in both PL/SQL and Python, specifically focusing on chess engine development. 
-            This is chunk {chunk_number} of {total_chunks} total chunks.
+            # The instructions and, with prompt caching, the whole package spec form a prefix shared by every chunk
+            context_parts = []
+            if dependency_context:
+                context_parts.append(dependency_context)
+            if package_spec:
+                context_parts.append(f"Full package specification (.pks), shared by every chunk:\n{package_spec}")
+            context = "\n\n".join(context_parts) or None
+            prompt = f"""This is chunk {chunk_number} of {total_chunks} total chunks.
             Please convert the following chunk of PL/SQL chess engine code to equivalent Python code. 
             
             Specification (.pks) chunk:
@@ -206,29 +251,13 @@ def convert_plsql_chunk_to_python(bedrock_client, chunk_number: int, total_chunk
 
             Body (.pkb) chunk:
             {pkb_chunk}
-
-            Please convert this chunk to Python code that:
-            1. Maintains the same chess logic and functionality
-            2. Uses Pythonic patterns and best practices
-            3. Can be integrated with other chunks of the same codebase
-            4. Includes appropriate Python docstrings and type hints
-            5. Maintains the same logic and functionality
             
-            Important: This is chunk {chunk_number} of {total_chunks}, so ensure the code can be properly combined with other chunks.
-            Please provide only the converted Python code without any explanations."""
-
-            body = json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 100000,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-
-            response = call_bedrock_with_retry(bedrock_client, body)
+            Important: This is chunk {chunk_number} of {total_chunks}, so ensure the code can be properly combined with other chunks."""
+
+            body = bedrock.build_messages_body(CHUNK_INSTRUCTIONS, prompt, 100000, context)
+
+            response = call_bedrock_with_retry(bedrock_client, body, route='source.chunk',
+                                               label=f"{file_label} chunk {chunk_number}/{total_chunks}")
             response_body = json.loads(response['body'].read())
             logger.info(f"Successfully converted chunk {chunk_number}/{total_chunks}")
             return response_body['content'][0]['text']
@@ -254,11 +283,171 @@ def convert_plsql_chunk_to_python(bedrock_client, chunk_number: int, total_chunk
                 continue
             raise
 
-def convert_plsql_to_python(bedrock_client, pks_code: str, pkb_code: str) -> Optional[str]:
+def convert_chunks_concurrently(bedrock_client, chunks: List[Tuple[str, str]],
+                                max_workers: int = CHUNK_WORKERS, file_label: str = "code",
+                                checkpoint: Optional[ConversionCheckpoint] = None,
+                                package_spec: Optional[str] = None,
+                                dependency_context: Optional[str] = None) -> List[str]:
+    total_chunks = len(chunks)
+    converted_chunks = [None] * total_chunks
+
+    if checkpoint is not None:
+        for i in range(1, total_chunks + 1):
+            converted_chunks[i - 1] = checkpoint.get_chunk(i)
+        resumed = sum(1 for chunk in converted_chunks if chunk is not None)
+        if resumed:
+            logger.info(f"Restored {resumed}/{total_chunks} converted chunks from checkpoint")
+
+    pending = [i for i in range(1, total_chunks + 1) if converted_chunks[i - 1] is None]
+    if (package_spec is not None or dependency_context is not None) and len(pending) > 1:
+        # Convert one chunk first so its request writes the shared prefix to the prompt cache before the rest read it
+        first = pending[0]
+        converted_chunks[first - 1] = convert_plsql_chunk_to_python(bedrock_client, first, total_chunks,
+                                                                    *chunks[first - 1], file_label, package_spec,
+                                                                    dependency_context)
+        if checkpoint is not None:
+            checkpoint.put_chunk(first, converted_chunks[first - 1])
+        logger.info(f"Successfully processed chunk {first}/{total_chunks}")
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chunk") as executor:
+        futures = {
+            executor.submit(convert_plsql_chunk_to_python, bedrock_client, i, total_chunks,
+                            pks_chunk, pkb_chunk, file_label, package_spec, dependency_context): i
+            for i, (pks_chunk, pkb_chunk) in enumerate(chunks, 1)
+            if converted_chunks[i - 1] is None
+        }
+
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                converted_chunks[i - 1] = future.result()
+                if checkpoint is not None:
+                    checkpoint.put_chunk(i, converted_chunks[i - 1])
+                logger.info(f"Successfully processed chunk {i}/{total_chunks}")
+            except Exception as chunk_error:
+                logger.error(f"Failed to process chunk {i} after all retries: {str(chunk_error)}")
+                for pending in futures:
+                    pending.cancel()
+                raise
+
+    return converted_chunks
+
+def merge_code_parts(bedrock_client, parts: List[str], final: bool, label: str) -> str:
+    combined_code = "\n\n".join(parts)
+    
+    if final:
+        prompt = f"""You are an expert Python developer. 
+        The following Python code was converted from PL/SQL in chunks. 
+        Please review and ensure all the code is properly integrated, 
+        remove any duplicates, and ensure consistent naming and structure.
+        Return only the final, cleaned-up Python code:
+
+        {combined_code}"""
+    else:
+        prompt = f"""You are an expert Python developer. 
+        The following Python code was converted from PL/SQL in chunks and is one consecutive 
+        section of a larger module; the other sections are merged separately and combined later. 
+        Please integrate these parts into one section, remove any duplicates within it, 
+        and ensure consistent naming and structure. Keep every public class, function and 
+        constant name unchanged so the sections still fit together.
+        Return only the merged Python code:
+
+        {combined_code}"""
+    
+    body = json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 100000,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    })
+    
+    response = call_bedrock_with_retry(bedrock_client, body, label=label, route='source.merge')
+    response_body = json.loads(response['body'].read())
+    return response_body['content'][0]['text']
+
+def group_adjacent_parts(parts: List[str], token_budget: int, fan_in: int) -> List[List[str]]:
+    """Group neighbouring parts, up to `fan_in` at a time, so each merge prompt stays within `token_budget`."""
+    groups = []
+    current = []
+    current_tokens = 0
+    for part in parts:
+        part_tokens = bedrock.estimate_text_tokens(part, get_model_router().primary_model('source.merge'))
+        if current and (len(current) == fan_in or current_tokens + part_tokens > token_budget):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(part)
+        current_tokens += part_tokens
+    if current:
+        groups.append(current)
+    
+    # Parts too large to share a prompt under the budget are still merged in pairs so the reduce makes progress
+    if len(groups) > 1 and all(len(group) == 1 for group in groups):
+        groups = [parts[i:i + 2] for i in range(0, len(parts), 2)]
+    return groups
+
+def consolidate_chunks(bedrock_client, converted_chunks: List[str], max_workers: int = CHUNK_WORKERS,
+                       file_label: str = "code", checkpoint: Optional[ConversionCheckpoint] = None) -> str:
+    """
+    Merge converted chunks with a tree-shaped reduce instead of one prompt holding the whole file.
+
+    Each level merges groups of adjacent parts (at most CONSOLIDATION_FAN_IN of them, within
+    CONSOLIDATION_TOKEN_BUDGET estimated tokens) in parallel and keeps their order. The last
+    merge, or a single part, gets the final cleanup prompt.
+    """
+    parts = list(converted_chunks)
+    level = 1
+    
+    while True:
+        groups = group_adjacent_parts(parts, CONSOLIDATION_TOKEN_BUDGET, CONSOLIDATION_FAN_IN)
+        final = len(groups) == 1
+        logger.info(f"Consolidation level {level}: merging {len(parts)} parts into {len(groups)}")
+        merged = [None] * len(groups)
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="merge") as executor:
+            futures = {}
+            for i, group in enumerate(groups):
+                if len(group) == 1 and not final:
+                    merged[i] = group[0]
+                    continue
+                if checkpoint is not None:
+                    merged[i] = checkpoint.get_merge(group, final)
+                    if merged[i] is not None:
+                        logger.info(f"Restored consolidation level {level} part {i + 1} from checkpoint")
+                        continue
+                label = f"{file_label} consolidation" if final else \
+                    f"{file_label} consolidation level {level} part {i + 1}/{len(groups)}"
+                futures[executor.submit(merge_code_parts, bedrock_client, group, final, label)] = i
+            
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    merged[i] = future.result()
+                    if checkpoint is not None:
+                        checkpoint.put_merge(groups[i], final, merged[i])
+                except Exception as merge_error:
+                    logger.error(f"Failed to merge consolidation level {level} part {i + 1}: {str(merge_error)}")
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+        
+        if final:
+            return merged[0]
+        parts = merged
+        level += 1
+
+def convert_plsql_to_python(bedrock_client, pks_code: str, pkb_code: str, file_label: str = "code",
+                            checkpoint: Optional[ConversionCheckpoint] = None,
+                            dependency_context: Optional[str] = None) -> Optional[str]:
     try:
         logger.info("Attempting to convert entire code at once...")
         max_retries = 10
         
+        dependency_section = f"\n\n{dependency_context}\n" if dependency_context else ""
         prompt = f"""You are an expert in both PL/SQL and Python, specifically focusing on chess engine development. 
         Please convert the following PL/SQL chess engine code to equivalent Python code. 
         The code is split into specification (.pks) and body (.pkb) files.
@@ -268,7 +457,7 @@ def convert_plsql_to_python(bedrock_client, pks_code: str, pkb_code: str) -> Opt
 
         Body (.pkb):
         {pkb_code}
-
+        {dependency_section}
         Please convert this to a well-structured Python implementation that:
         1. Maintains the same chess logic and functionality
         2. Uses Pythonic patterns and best practices
@@ -291,79 +480,95 @@ def convert_plsql_to_python(bedrock_client, pks_code: str, pkb_code: str) -> Opt
             ]
         })
 
-        # Try full conversion with retries
-        for attempt in range(1, max_retries + 1):
-            try:
-                response = call_bedrock_with_retry(bedrock_client, body)
-                response_body = json.loads(response['body'].read())
-                logger.info(f"Full code conversion successful on attempt {attempt}")
-                return response_body['content'][0]['text']
+        # Skip the full-file attempt outright when the prompt cannot fit
+        estimated_tokens = bedrock.estimate_body_tokens(body, get_model_router().primary_model('source.full'))
+        if estimated_tokens > FULL_FILE_TOKEN_LIMIT:
+            logger.info(f"Estimated {estimated_tokens} input tokens exceeds the full conversion limit "
+                        f"of {FULL_FILE_TOKEN_LIMIT}. Switching to chunk processing...")
+        else:
+            logger.info(f"Estimated {estimated_tokens} input tokens; trying full conversion with retries")
+            for attempt in range(1, max_retries + 1):
+                try:
+                    response = call_bedrock_with_retry(bedrock_client, body, label=f"{file_label} full file",
+                                                       route='source.full')
+                    response_body = json.loads(response['body'].read())
+                    logger.info(f"Full code conversion successful on attempt {attempt}")
+                    return response_body['content'][0]['text']
                 
-            except BedrockRetryException as e:
-                if "Too many tokens" in str(e):
-                    if attempt < max_retries:
-                        delay = exponential_backoff(attempt)
-                        logger.warning(f"Too many tokens for full conversion, attempt {attempt}/{max_retries}. Retrying in {delay:.2f} seconds...")
-                        time.sleep(delay)
-                        continue
+                except BedrockRetryException as e:
+                    if "Too many tokens" in str(e):
+                        if attempt < max_retries:
+                            delay = exponential_backoff(attempt)
+                            logger.warning(f"Too many tokens for full conversion, attempt {attempt}/{max_retries}. Retrying in {delay:.2f} seconds...")
+                            time.sleep(delay)
+                            continue
+                        else:
+                            logger.warning(f"Full conversion failed after {max_retries} attempts. Switching to chunk processing...")
+                            break
                     else:
-                        logger.warning(f"Full conversion failed after {max_retries} attempts. Switching to chunk processing...")
-                        break
-                else:
-                    raise
+                        raise
                     
-        # If we reach here, all full conversion attempts failed, switch to chunks
+        # If we reach here, the full conversion was skipped or failed, switch to chunks
         logger.info("Starting chunk processing...")
-        chunks = split_code_into_chunks(pks_code, pkb_code)
+        chunks = checkpoint.load_plan() if checkpoint is not None else None
+        if chunks is None:
+            chunks = split_code_into_chunks(pks_code, pkb_code)
+            if checkpoint is not None:
+                checkpoint.save_plan(chunks)
         total_chunks = len(chunks)
         logger.info(f"Processing code in {total_chunks} chunks")
         
-        converted_chunks = []
-        for i, (pks_chunk, pkb_chunk) in enumerate(chunks, 1):
-            try:
-                logger.info(f"Processing chunk {i}/{total_chunks}")
-                converted_chunk = convert_plsql_chunk_to_python(
-                    bedrock_client, i, total_chunks, pks_chunk, pkb_chunk
-                )
-                converted_chunks.append(converted_chunk)
-                logger.info(f"Successfully processed chunk {i}/{total_chunks}")
-            except Exception as chunk_error:
-                logger.error(f"Failed to process chunk {i} after all retries: {str(chunk_error)}")
-                raise
-
-        combined_code = "\n\n".join(converted_chunks)
-        
-        logger.info("Performing final pass to ensure code consistency...")
-        final_prompt = f"""You are an expert Python developer. 
-        The following Python code was converted from PL/SQL in chunks. 
-        Please review and ensure all the code is properly integrated, 
-        remove any duplicates, and ensure consistent naming and structure.
-        Return only the final, cleaned-up Python code:
-
-        {combined_code}"""
-        
-        final_body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 100000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": final_prompt
-                }
-            ]
-        })
-        
-        final_response = call_bedrock_with_retry(bedrock_client, final_body)
-        final_response_body = json.loads(final_response['body'].read())
+        # With prompt caching, every chunk request carries the whole spec in its cached prefix
+        chunk_model = get_model_router().primary_model('source.chunk')
+        package_spec = pks_code if bedrock.prompt_caching_supported(chunk_model) else None
+        converted_chunks = convert_chunks_concurrently(bedrock_client, chunks, file_label=file_label,
+                                                       checkpoint=checkpoint, package_spec=package_spec,
+                                                       dependency_context=dependency_context)
+
+        final_code = consolidate_chunks(bedrock_client, converted_chunks, file_label=file_label,
+                                        checkpoint=checkpoint)
         logger.info("Chunk combination and final cleanup successful")
-        return final_response_body['content'][0]['text']
+        return final_code
     
     except Exception as e:
         logger.error(f"Error in conversion: {str(e)}")
         raise
 
+def analyze_package_dependencies(s3_client, bucket_name: str, source_prefix: str,
+                                 base_names: List[str]) -> PackageGraph:
+    """
+    Build the package call graph used to order conversions.
+
+    Specs are read whole, since their summaries go into prompts; bodies are streamed
+    into the unit scanner one at a time, so no body is ever held in memory in full.
+    """
+    sources = {}
+    for base_name in base_names:
+        sources[base_name] = (read_file_from_s3(s3_client, bucket_name, f"{source_prefix}/{base_name}.pks"),
+                              iter_file_lines_from_s3(s3_client, bucket_name, f"{source_prefix}/{base_name}.pkb"))
+    return build_package_graph(sources)
+
+def load_dependency_context(s3_client, bucket_name: str, base_name: str, output_prefix: str,
+                            package_graph: Optional[PackageGraph]) -> Optional[str]:
+    """Signature summaries of the packages `base_name` calls, with the Python API of those already converted."""
+    if package_graph is None:
+        return None
+    python_sources = {}
+    output_sink = get_output_sink()
+    for dependency in package_graph.upstream(base_name):
+        output_key = f"{output_prefix}/{dependency}.py"
+        # A dependency converted moments ago may still be uploading
+        python_code = output_sink.pending_text(bucket_name, output_key)
+        python_sources[dependency] = python_code if python_code is not None else \
+            read_file_from_s3(s3_client, bucket_name, output_key)
+    dependency_context = package_graph.dependency_context(base_name, python_sources)
+    if dependency_context:
+        logger.info(f"Attaching interfaces of {', '.join(package_graph.dependencies(base_name))} to {base_name}")
+    return dependency_context
+
 def process_single_file(s3_client, bedrock_client, bucket_name: str, base_name: str, 
-                       source_prefix: str, output_prefix: str) -> None:
+                       source_prefix: str, output_prefix: str,
+                       package_graph: Optional[PackageGraph] = None) -> None:
     try:
         pks_path = f"{source_prefix}/{base_name}.pks"
         pkb_path = f"{source_prefix}/{base_name}.pkb"
@@ -373,12 +578,19 @@ def process_single_file(s3_client, bedrock_client, bucket_name: str, base_name:
         pks_code = read_file_from_s3(s3_client, bucket_name, pks_path)
         pkb_code = read_file_from_s3(s3_client, bucket_name, pkb_path)
         
-        python_code = convert_plsql_to_python(bedrock_client, pks_code, pkb_code)
+        dependency_context = load_dependency_context(s3_client, bucket_name, base_name, output_prefix,
+                                                     package_graph)
+        # Chunked conversions are checkpointed so a restarted run resumes from the first missing chunk
+        checkpoint = ConversionCheckpoint.for_package(base_name, pks_code, pkb_code, PROMPT_VERSION,
+                                                      dependency_context=dependency_context)
+        python_code = convert_plsql_to_python(bedrock_client, pks_code, pkb_code, base_name, checkpoint,
+                                              dependency_context)
         
         if python_code:
             output_key = f"{output_prefix}/{base_name}.py"
-            if write_file_to_s3(s3_client, bucket_name, output_key, python_code):
-                logger.info(f"Successfully converted and saved: {output_key}")
+            # The checkpoint is only cleared once the converted code is stored
+            if write_file_to_s3(s3_client, bucket_name, output_key, python_code, checkpoint.clear):
+                logger.info(f"Successfully converted: {output_key}")
             else:
                 logger.error(f"Failed to save converted code for {base_name}")
                 raise Exception("Failed to save converted code")
@@ -391,37 +603,122 @@ def process_single_file(s3_client, bedrock_client, bucket_name: str, base_name:
         raise
 
 
+def source_version_keys(source_prefix: str, base_name: str,
+                        package_graph: Optional[PackageGraph] = None) -> List[str]:
+    """
+    Source objects whose versions decide whether `base_name` must be converted again.
+
+    Besides its own .pks/.pkb pair, these are the pairs of every package it calls,
+    directly or through others: their specs are summarized in its prompt, and their
+    converted Python API, which it calls into, changes whenever they are converted again.
+    """
+    base_names = [base_name]
+    if package_graph is not None:
+        base_names += package_graph.transitive_dependencies(base_name)
+    return [f"{source_prefix}/{name}{extension}" for name in base_names for extension in ('.pks', '.pkb')]
+
+def get_source_etag(object_info: dict, version_keys: List[str]) -> str:
+    return combine_etags(*(object_info.get(key, {}).get('etag', '') for key in version_keys))
+
+def process_files_concurrently(s3_client, bedrock_client, bucket_name: str, plsql_files: List[str],
+                               source_prefix: str, output_prefix: str, max_workers: int,
+                               manifest: Optional[StageManifest] = None,
+                               etags: Optional[dict] = None,
+                               package_graph: Optional[PackageGraph] = None) -> Tuple[List[str], List[str]]:
+    """
+    Convert `plsql_files` with up to `max_workers` in flight.
+
+    With a `package_graph`, a file starts only once the files it depends on in this
+    run have finished (converted or failed), so its prompt can carry their converted
+    Python API. Files in a dependency cycle do not wait for each other.
+    """
+    total_files = len(plsql_files)
+    succeeded = []
+    failed = []
+
+    if package_graph is not None:
+        queued = package_graph.conversion_order(plsql_files)
+        waiting_on = {base_name: set(package_graph.upstream(base_name)) & set(plsql_files)
+                      for base_name in queued}
+    else:
+        queued = list(plsql_files)
+        waiting_on = {base_name: set() for base_name in queued}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="convert") as executor:
+        futures = {}
+
+        def submit_ready() -> None:
+            for base_name in [name for name in queued if not waiting_on[name]]:
+                queued.remove(base_name)
+                futures[executor.submit(process_single_file, s3_client, bedrock_client, bucket_name, base_name,
+                                        source_prefix, output_prefix, package_graph)] = base_name
+
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                base_name = futures.pop(future)
+                try:
+                    future.result()
+                    succeeded.append(base_name)
+                    if manifest is not None:
+                        manifest.record(base_name, etags.get(base_name, ''), [f"{output_prefix}/{base_name}.py"])
+                        manifest.save()
+                    logger.info(f"Completed processing file {len(succeeded) + len(failed)}/{total_files}: {base_name}")
+                except Exception as e:
+                    failed.append(base_name)
+                    logger.error(f"Failed to process file {base_name} "
+                                 f"({len(succeeded) + len(failed)}/{total_files}): {str(e)}")
+                    logger.info("Continuing with remaining files...")
+                for dependencies in waiting_on.values():
+                    dependencies.discard(base_name)
+            submit_ready()
+
+    return succeeded, failed
+
 def main():
     try:
-        BUCKET_NAME = 's3-genai-coffee-and-innovate'
+        BUCKET_NAME = get_bucket_name()
         SOURCE_PREFIX = 'source/PL-SQL-Chess-master/src'
-        OUTPUT_PREFIX = 'target'
+        OUTPUT_PREFIX = 'target/src'
+        MAX_WORKERS = int(os.environ.get('PIPELINE_SOURCE_MAX_WORKERS', '4'))
+        
+        s3_client = get_client('s3')
+        bedrock_client = get_client('bedrock-runtime')
         
-        s3_client = boto3.client('s3')
-        bedrock_client = boto3.client('bedrock-runtime')
+        object_info = {}
+        plsql_files = list_plsql_files(s3_client, BUCKET_NAME, SOURCE_PREFIX, object_info)
         
-        plsql_files = list_plsql_files(s3_client, BUCKET_NAME, SOURCE_PREFIX)
+        manifest = StageManifest(BUCKET_NAME, 'app_src_code_generator', PROMPT_VERSION, s3_client).load()
+        # The graph covers every package, so unchanged ones still contribute their interfaces
+        package_graph = analyze_package_dependencies(s3_client, BUCKET_NAME, SOURCE_PREFIX, plsql_files)
+        etags = {base_name: get_source_etag(object_info, source_version_keys(SOURCE_PREFIX, base_name,
+                                                                             package_graph))
+                 for base_name in plsql_files}
+        plsql_files = manifest.filter_pending(plsql_files, etags)
         total_files = len(plsql_files)
         
-        logger.info(f"Starting batch conversion process for {total_files} files")
+        logger.info(f"Starting batch conversion process for {total_files} files with {MAX_WORKERS} workers")
         
-        for index, base_name in enumerate(plsql_files, 1):
-            try:
-                logger.info(f"Processing file {index}/{total_files}: {base_name}")
-                process_single_file(s3_client, bedrock_client, BUCKET_NAME, base_name, 
-                                 SOURCE_PREFIX, OUTPUT_PREFIX)
-                logger.info(f"Completed processing file {index}/{total_files}")
-            except Exception as e:
-                logger.error(f"Failed to process file {base_name}: {str(e)}")
-                logger.info("Continuing with next file...")
-                continue
+        succeeded, failed = process_files_concurrently(s3_client, bedrock_client, BUCKET_NAME, plsql_files,
+                                                       SOURCE_PREFIX, OUTPUT_PREFIX, MAX_WORKERS,
+                                                       manifest, etags, package_graph)
+        
+        # Wait for outputs still uploading; the manifest then also records the packages that produced them
+        flush_outputs()
+        manifest.save()
         
-        logger.info("Batch conversion process completed")
+        if failed:
+            logger.warning(f"Failed to convert {len(failed)} file(s): {', '.join(sorted(failed))}")
+        logger.info(f"Batch conversion process completed. {len(succeeded)}/{total_files} files converted")
         
     except Exception as e:
         logger.error(f"Error in batch conversion process: {str(e)}")
         raise
     finally:
+        flush_outputs()
+        log_route_summary()
+        log_metrics_summary()
         upload_log_to_s3(BUCKET_NAME, log_filename)
 
 if __name__ == "__main__":
@@ -0,0 +1,444 @@
+import argparse
+import json
+import logging
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pipeline.aio
+from pipeline.clients import ClientRegistry, use_client_registry
+from pipeline.manifest import get_manifest_key
+from pipeline.metrics import get_metrics, percentile
+from pipeline.simulator import SimulatedSession, SimulatorConfig
+from pipeline.storage import storage_from_env
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BUCKET_NAME = "s3-genai-coffee-and-innovate"
+KB_SOURCE_PREFIX = "source/PL-SQL-Chess-master"
+PLSQL_SOURCE_PREFIX = "source/PL-SQL-Chess-master/src"
+
+# Stage name (as in CodeGenerator.py and the route names) -> script; order is the dependency order
+STAGE_SCRIPTS = [
+    ("knowledge_base", "app_knowledge_base"),
+    ("source", "app_src_code_generator"),
+    ("docs", "app_docs"),
+    ("epics", "app_epics_features_generator"),
+    ("unit_tests", "app_unit_functional_code"),
+    ("gherkin", "app_gherkin_generator"),
+]
+
+# Simulator settings and environment defaults; scenarios override either
+PROFILES = {
+    # Fast enough for every CI run: millisecond latencies with a few injected throttles
+    "ci": {
+        "simulator": {
+            "seed": 1,
+            "first_token_latency": "uniform:0.01:0.03",
+            "seconds_per_output_token": 0.00002,
+            "output_tokens": "uniform:150:600",
+            "throttle_rate": 0.02,
+            "too_many_tokens_rate": 0.01,
+            "s3_latency": "0.001",
+        },
+        "env": {
+            "BEDROCK_MAX_REQUESTS_PER_SECOND": "50",
+            "BEDROCK_MAX_IN_FLIGHT": "16",
+        },
+    },
+    # Latencies, output lengths and quotas in the range of a real on-demand account
+    "bedrock": {
+        "simulator": {
+            "seed": 1,
+            "first_token_latency": "lognormal:1.2:0.4",
+            "seconds_per_output_token": 0.02,
+            "seconds_per_input_token": 0.00005,
+            "output_tokens": "lognormal:1500:0.5",
+            "throttle_rate": 0.03,
+            "too_many_tokens_rate": 0.02,
+            "requests_per_minute": 50,
+            "tokens_per_minute": 400000,
+            "s3_latency": "lognormal:0.02:0.5",
+            "batch_job_seconds": 30,
+        },
+        "env": {},
+    },
+}
+
+# Set for every scenario so runs never touch the user's caches or state
+ISOLATED_ENV = {
+    "BEDROCK_CACHE_DISABLED": "1",
+    "BEDROCK_BATCH_ROLE_ARN": "arn:aws:iam::000000000000:role/benchmark",
+    "BEDROCK_BATCH_POLL_SECONDS": "0.2",
+    "PIPELINE_FULL_RUN": "1",
+    # Simulated S3 and its bucket unless a scenario selects another storage backend
+    "PIPELINE_BUCKET": BUCKET_NAME,
+    "PIPELINE_STORAGE": "s3",
+}
+
+# Stages shorter than this in the baseline are too quick for a stable files/hour comparison
+MIN_COMPARED_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+def setup_logging() -> logging.Logger:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    return logger
+
+def synthetic_sources(packages: int, procedures: int) -> Dict[str, str]:
+    """
+    A PL/SQL corpus of `packages` packages with `procedures` procedures each, plus a README.
+
+    Each package calls the package before it, so source conversion has a dependency
+    chain to schedule. The corpus depends only on its size, so runs are comparable.
+    """
+    files = {f"{KB_SOURCE_PREFIX}/README.md":
+             f"# Benchmark corpus\n\n{packages} synthetic packages with {procedures} procedures each.\n"}
+    for index in range(packages):
+        name = f"BENCH_PKG_{index:03d}"
+        upstream = f"BENCH_PKG_{index - 1:03d}" if index else None
+        spec = [f"CREATE OR REPLACE PACKAGE {name} AS"]
+        body = [f"CREATE OR REPLACE PACKAGE BODY {name} AS"]
+        for number in range(procedures):
+            spec.append(f"  PROCEDURE step_{number}(p_value IN NUMBER, p_result OUT NUMBER);")
+            call = f"    {upstream}.step_{number}(v_total, v_total);\n" if upstream else ""
+            body.append(
+                f"  PROCEDURE step_{number}(p_value IN NUMBER, p_result OUT NUMBER) IS\n"
+                f"    v_total NUMBER := 0;\n"
+                f"  BEGIN\n"
+                f"    FOR i IN 1 .. p_value LOOP\n"
+                f"      IF MOD(i, {number + 2}) = 0 THEN\n"
+                f"        v_total := v_total + i * {number + 1};\n"
+                f"      ELSE\n"
+                f"        v_total := v_total - {index + 1};\n"
+                f"      END IF;\n"
+                f"    END LOOP;\n"
+                f"{call}"
+                f"    p_result := v_total;\n"
+                f"  END step_{number};\n")
+        spec.append(f"END {name};\n/")
+        body.append(f"END {name};\n/")
+        base_name = name.lower()
+        files[f"{PLSQL_SOURCE_PREFIX}/{base_name}.pks"] = '\n'.join(spec) + '\n'
+        files[f"{PLSQL_SOURCE_PREFIX}/{base_name}.pkb"] = '\n'.join(body) + '\n'
+    return files
+
+def directory_sources(source_dir: str) -> Dict[str, str]:
+    """.pks/.pkb files of `source_dir` under the source prefix, anything else under the knowledge base prefix."""
+    files = {}
+    for name in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'r', encoding='utf-8', errors='replace') as source:
+            text = source.read()
+        prefix = PLSQL_SOURCE_PREFIX if name.endswith(('.pks', '.pkb')) else KB_SOURCE_PREFIX
+        files[f"{prefix}/{name}"] = text
+    return files
+
+def manifest_inputs(session: SimulatedSession, manifest_name: str) -> int:
+    text = session.get_text(BUCKET_NAME, get_manifest_key(manifest_name))
+    return len(json.loads(text).get('inputs', {})) if text else 0
+
+def remove_log_handlers() -> None:
+    """Detach what a script's setup_logging added, so the next script does not log everything twice."""
+    names = ['__main__', 'pipeline', 'CodeGenerator'] + [script for _, script in STAGE_SCRIPTS]
+    for name in names:
+        stage_logger = logging.getLogger(name)
+        for handler in list(stage_logger.handlers):
+            stage_logger.removeHandler(handler)
+            handler.close()
+
+def run_script(script: str, argv: Optional[List[str]] = None) -> Tuple[float, int]:
+    """Run a stage script as __main__ in this process; returns (seconds, exit code)."""
+    path = os.path.join(SCRIPT_DIR, f"{script}.py")
+    saved_argv = sys.argv
+    sys.argv = [path] + (argv or [])
+    started = time.monotonic()
+    exit_code = 0
+    try:
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    finally:
+        sys.argv = saved_argv
+        remove_log_handlers()
+    return time.monotonic() - started, exit_code
+
+def route_stage(labels: Tuple[Tuple[str, str], ...]) -> Optional[str]:
+    route = dict(labels).get('route')
+    return route.split('.')[0] if route else None
+
+def stage_metrics(stage: str) -> dict:
+    """Bedrock calls, retries, throttles, tokens and latency of the routes belonging to `stage`."""
+    metrics = get_metrics()
+    with metrics.lock:
+        samples = []
+        calls = 0
+        for labels, series in metrics.spans.get('bedrock_invoke', {}).items():
+            if route_stage(labels) == stage:
+                calls += series.count
+                samples.extend(series.samples)
+
+        def total(counter: str, **match) -> float:
+            return sum(value for labels, value in metrics.counters.get(counter, {}).items()
+                       if route_stage(labels) == stage
+                       and all(dict(labels).get(name) == wanted for name, wanted in match.items()))
+
+        result = {
+            'bedrock_calls': calls,
+            'retries': int(total('bedrock_retries_total')),
+            'throttles': int(total('bedrock_throttles_total')),
+            'input_tokens': int(total('bedrock_tokens_total', kind='input')),
+            'output_tokens': int(total('bedrock_tokens_total', kind='output')),
+        }
+    samples.sort()
+    result['p50_seconds'] = round(percentile(samples, 0.5), 3)
+    result['p95_seconds'] = round(percentile(samples, 0.95), 3)
+    return result
+
+def orchestrator_stage_seconds() -> Dict[str, float]:
+    """Wall time of each stage in a CodeGenerator.py run: first task start to last task end."""
+    metrics = get_metrics()
+    windows = {}
+    with metrics.lock:
+        for labels, series in metrics.spans.get('stage', {}).items():
+            stage = dict(labels).get('stage')
+            if series.first_start is None:
+                continue
+            start, end = windows.get(stage, (series.first_start, series.last_end))
+            windows[stage] = (min(start, series.first_start), max(end, series.last_end))
+    return {stage: end - start for stage, (start, end) in windows.items()}
+
+def run_child(spec: dict) -> dict:
+    """Run one scenario in this process against a fresh simulator and return its report."""
+    work_dir = tempfile.mkdtemp(prefix=f"benchmark-{spec['name']}-")
+    os.environ.update({
+        'PIPELINE_STATE_URI': os.path.join(work_dir, 'state'),
+        'BEDROCK_CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'BEDROCK_STREAM_SPOOL_DIR': os.path.join(work_dir, 'spool'),
+        'BEDROCK_TOKEN_CALIBRATION_FILE': os.path.join(work_dir, 'token_calibration.json'),
+    })
+    os.environ.update(ISOLATED_ENV)
+    os.environ.update(spec['env'])
+    # Stage logs go to the scenario's work directory
+    os.chdir(work_dir)
+
+    # With PIPELINE_STORAGE=local or memory the stages use that backend directly, without simulated S3 latency
+    storage = storage_from_env()
+    session = SimulatedSession(SimulatorConfig.from_dict(spec['simulator']), storage)
+    use_client_registry(ClientRegistry(session=session, storage=storage))
+    # aiobotocore would create real clients; the async mode falls back to the shared registry without it
+    pipeline.aio.get_session = None
+
+    sources = (directory_sources(spec['source_dir']) if spec.get('source_dir')
+               else synthetic_sources(spec['packages'], spec['procedures']))
+    for key, text in sources.items():
+        session.put_text(BUCKET_NAME, key, text)
+
+    stages = []
+    started = time.monotonic()
+    if spec['mode'] == 'orchestrator':
+        seconds, exit_code = run_script('CodeGenerator', ['--max-workers', str(spec['max_workers'])])
+        stage_seconds = orchestrator_stage_seconds()
+        for stage, script in STAGE_SCRIPTS:
+            stages.append({'stage': stage, 'wall_seconds': round(stage_seconds.get(stage, 0.0), 3),
+                           'exit_code': exit_code, 'files': manifest_inputs(session, script)})
+    else:
+        for stage, script in STAGE_SCRIPTS:
+            seconds, exit_code = run_script(script)
+            stages.append({'stage': stage, 'wall_seconds': round(seconds, 3), 'exit_code': exit_code,
+                           'files': manifest_inputs(session, script)})
+    wall_seconds = time.monotonic() - started
+
+    for entry in stages:
+        entry['files_per_hour'] = (round(entry['files'] * 3600 / entry['wall_seconds'], 1)
+                                   if entry['wall_seconds'] > 0 else None)
+        entry.update(stage_metrics(entry['stage']))
+
+    return {
+        'name': spec['name'],
+        'mode': spec['mode'],
+        'simulator': spec['simulator'],
+        'env': spec['env'],
+        'source_files': len(sources),
+        'wall_seconds': round(wall_seconds, 3),
+        'stages': stages,
+        'totals': {
+            'files': sum(entry['files'] for entry in stages),
+            'bedrock_calls': sum(entry['bedrock_calls'] for entry in stages),
+            'retries': sum(entry['retries'] for entry in stages),
+            'throttles': sum(entry['throttles'] for entry in stages),
+            'failed_stages': [entry['stage'] for entry in stages if entry['exit_code']],
+        },
+        'injected': session.stats.as_dict(),
+        'work_dir': work_dir,
+    }
+
+def parse_assignments(text: str) -> Tuple[dict, dict]:
+    """Split "throttle_rate=0.1,BEDROCK_MAX_IN_FLIGHT=4" into simulator settings and environment variables."""
+    simulator = {}
+    env = {}
+    for assignment in filter(None, (part.strip() for part in text.split(','))):
+        name, _, value = assignment.partition('=')
+        if name.isupper():
+            env[name] = value
+        else:
+            try:
+                simulator[name] = json.loads(value)
+            except ValueError:
+                simulator[name] = value
+    return simulator, env
+
+def build_specs(args: argparse.Namespace) -> List[dict]:
+    profile = PROFILES[args.profile]
+    base_simulator = dict(profile['simulator'])
+    for name in ('seed', 'throttle_rate', 'too_many_tokens_rate', 'max_input_tokens'):
+        value = getattr(args, name)
+        if value is not None:
+            base_simulator[name] = value
+    if args.latency:
+        base_simulator['first_token_latency'] = args.latency
+
+    scenarios = args.scenario or ['baseline:']
+    specs = []
+    for scenario in scenarios:
+        name, _, assignments = scenario.partition(':')
+        simulator, env = parse_assignments(assignments)
+        spec = {
+            'name': name,
+            'mode': args.mode,
+            'simulator': {**base_simulator, **simulator},
+            'env': {**profile['env'], **env},
+            'packages': args.packages,
+            'procedures': args.procedures,
+            'source_dir': os.path.abspath(args.source_dir) if args.source_dir else None,
+            'max_workers': args.max_workers,
+        }
+        # Fails here rather than in the child on a misspelt setting
+        SimulatorConfig.from_dict(spec['simulator'])
+        specs.append(spec)
+    return specs
+
+def run_scenario(spec: dict, output_dir: str) -> dict:
+    """Run a scenario in a child process, so each one starts with fresh clients, limiters and metrics."""
+    spec_path = os.path.join(output_dir, f"{spec['name']}.spec.json")
+    report_path = os.path.join(output_dir, f"{spec['name']}.report.json")
+    log_path = os.path.join(output_dir, f"{spec['name']}.log")
+    with open(spec_path, 'w', encoding='utf-8') as spec_file:
+        json.dump(spec, spec_file)
+
+    logger.info(f"Running scenario {spec['name']} ({spec['mode']} mode); output in {log_path}")
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', spec_path,
+                                    '--child-report', report_path],
+                                   stdout=log_file, stderr=subprocess.STDOUT, cwd=SCRIPT_DIR)
+    if completed.returncode != 0 or not os.path.exists(report_path):
+        raise RuntimeError(f"Scenario {spec['name']} failed with exit code {completed.returncode}; see {log_path}")
+    with open(report_path, 'r', encoding='utf-8') as report_file:
+        return json.load(report_file)
+
+def log_report(reports: List[dict]) -> None:
+    logger.info(f"{'scenario':<16} {'stage':<15} {'wall s':>8} {'files':>6} {'files/h':>9} {'calls':>6} "
+                f"{'retries':>7} {'throttles':>9} {'p50 s':>7} {'p95 s':>7}")
+    for report in reports:
+        for entry in report['stages']:
+            files_per_hour = f"{entry['files_per_hour']:.0f}" if entry['files_per_hour'] is not None else '-'
+            failed = ' FAILED' if entry['exit_code'] else ''
+            logger.info(f"{report['name']:<16} {entry['stage']:<15} {entry['wall_seconds']:>8.1f} "
+                        f"{entry['files']:>6} {files_per_hour:>9} {entry['bedrock_calls']:>6} "
+                        f"{entry['retries']:>7} {entry['throttles']:>9} {entry['p50_seconds']:>7.2f} "
+                        f"{entry['p95_seconds']:>7.2f}{failed}")
+        totals = report['totals']
+        injected = ', '.join(f"{name}={count}" for name, count in report['injected'].items())
+        logger.info(f"{report['name']:<16} {'total':<15} {report['wall_seconds']:>8.1f} {totals['files']:>6} "
+                    f"{'':>9} {totals['bedrock_calls']:>6} {totals['retries']:>7} {totals['throttles']:>9}")
+        logger.info(f"{report['name']}: simulator {injected}")
+
+def compare_with_baseline(reports: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Regressions against a saved report: a stage's files/hour or its files below the baseline."""
+    with open(baseline_path, 'r', encoding='utf-8') as baseline_file:
+        baseline = {report['name']: report for report in json.load(baseline_file)['scenarios']}
+
+    regressions = []
+    for report in reports:
+        previous = baseline.get(report['name'])
+        if previous is None:
+            logger.info(f"Scenario {report['name']} is not in the baseline; nothing to compare")
+            continue
+        previous_stages = {entry['stage']: entry for entry in previous['stages']}
+        for entry in report['stages']:
+            before = previous_stages.get(entry['stage'])
+            if before is None:
+                continue
+            if entry['files'] < before['files']:
+                regressions.append(f"{report['name']}/{entry['stage']}: {entry['files']} files, "
+                                   f"baseline {before['files']}")
+            if before['wall_seconds'] < MIN_COMPARED_SECONDS or not before['files_per_hour']:
+                continue
+            if (entry['files_per_hour'] or 0) < before['files_per_hour'] * (1 - tolerance):
+                regressions.append(f"{report['name']}/{entry['stage']}: {entry['files_per_hour'] or 0:.0f} files/h, "
+                                   f"baseline {before['files_per_hour']:.0f}")
+    return regressions
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline offline against a simulated S3 and Bedrock")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="ci",
+                        help="Simulator latencies, fault rates and quotas to start from (default: ci)")
+    parser.add_argument("--mode", choices=["scripts", "orchestrator"], default="scripts",
+                        help="Run the six stage scripts one after another, or CodeGenerator.py")
+    parser.add_argument("--scenario", action="append",
+                        help="NAME:setting=value,... to run, repeatable; lower-case settings configure the "
+                             "simulator, upper-case ones are environment variables "
+                             "(e.g. 'async:PIPELINE_ASYNC_CONCURRENCY=16')")
+    parser.add_argument("--packages", type=int, default=4, help="Packages in the synthetic corpus")
+    parser.add_argument("--procedures", type=int, default=6, help="Procedures per synthetic package")
+    parser.add_argument("--source-dir", help="Benchmark these .pks/.pkb files (and README) instead")
+    parser.add_argument("--seed", type=int, help="Simulator seed")
+    parser.add_argument("--latency", help="Time to first token, e.g. 0.5, uniform:0.2:1, lognormal:1.2:0.4")
+    parser.add_argument("--throttle-rate", type=float, help="Share of calls answered 'Too many requests'")
+    parser.add_argument("--too-many-tokens-rate", type=float, help="Share of calls answered 'Too many tokens'")
+    parser.add_argument("--max-input-tokens", type=int, help="Input size above which calls fail validation")
+    parser.add_argument("--max-workers", type=int, default=8, help="Stage tasks in parallel in orchestrator mode")
+    parser.add_argument("--output", default="benchmark_report.json", help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="Earlier report to compare with; exits 2 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed drop in files/hour against the baseline (default: 0.25)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-report", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.child:
+        with open(args.child, 'r', encoding='utf-8') as spec_file:
+            child_report = run_child(json.load(spec_file))
+        with open(args.child_report, 'w', encoding='utf-8') as report_file:
+            json.dump(child_report, report_file, indent=2)
+        sys.exit(0)
+
+    logger = setup_logging()
+    try:
+        output_dir = tempfile.mkdtemp(prefix="benchmark-")
+        reports = [run_scenario(spec, output_dir) for spec in build_specs(args)]
+        log_report(reports)
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump({'profile': args.profile, 'scenarios': reports}, output, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+        if args.baseline:
+            regressions = compare_with_baseline(reports, args.baseline, args.tolerance)
+            for regression in regressions:
+                logger.error(f"Regression: {regression}")
+            if regressions:
+                sys.exit(2)
+            logger.info(f"No regressions against {args.baseline}")
+    except Exception as e:
+        logger.error("Benchmark failed with error:", exc_info=True)
+        exit(1)
@@ -0,0 +1 @@
+"""Shared infrastructure for the ModernITCodeGeneratorTool stage scripts."""
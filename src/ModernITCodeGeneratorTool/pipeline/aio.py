@@ -0,0 +1,318 @@
+import asyncio
+import inspect
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+from pipeline.bedrock import (DEFAULT_MODEL_ID, estimate_body_tokens, get_output_token_count,
+                              get_prompt_token_count, prepare_body, record_input_tokens)
+from pipeline.cache import get_response_cache, make_cache_key
+from pipeline.clients import client_region, get_client, get_client_registry
+from pipeline.metrics import get_metrics, inc, instrument_client
+from pipeline.rate_limiter import get_rate_limiter
+from pipeline.routing import TokenUsage, get_model_router
+from pipeline.text import STREAM_CHUNK_BYTES, IncrementalSourceDecoder
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    AioConfig = None
+    get_session = None
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    'ThrottlingException',
+    'InternalServerError',
+    'ServiceUnavailable',
+    'ModelStreamLimitExceeded',
+    'ValidationException',
+    'ModelTimeoutException'
+)
+
+class BedrockRetryException(Exception):
+    pass
+
+def exponential_backoff(attempt: int, max_delay: int = 32) -> float:
+    return min(max_delay, (2 ** (attempt - 1))) + random.uniform(0, 0.1)
+
+class AsyncAWS:
+    """
+    Async S3 and bedrock-runtime access for the stage scripts.
+
+    With aiobotocore installed, requests are sent on native async clients, so hundreds
+    of model calls can be in flight from one event loop without a thread each. Without
+    it, the regular boto3 clients run on a fixed-size thread pool. Clients can also be
+    injected: methods may be coroutine functions (a local stub) or plain functions (a
+    moto-style fake), and `endpoint_url` can point both services at a local stub server.
+
+    Usage:
+        async with AsyncAWS() as aws:
+            text = await aws.get_object_text(bucket, key)
+    """
+
+    def __init__(self, s3_client=None, bedrock_client=None, endpoint_url: Optional[str] = None,
+                 max_in_flight: Optional[int] = None, executor_workers: int = 32):
+        self.s3_client = s3_client
+        self.bedrock_client = bedrock_client
+        self.endpoint_url = endpoint_url or os.environ.get('PIPELINE_AWS_ENDPOINT_URL')
+        self.max_in_flight = max_in_flight or int(os.environ.get('BEDROCK_MAX_IN_FLIGHT_ASYNC', '256'))
+        self.executor_workers = executor_workers
+        self.executor = None
+        self.exit_stack = None
+        self.in_flight = None
+        self.session = None
+        self.client_kwargs = {}
+        self.region_clients = {}
+
+    async def __aenter__(self) -> "AsyncAWS":
+        self.exit_stack = AsyncExitStack()
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        client_kwargs = {'endpoint_url': self.endpoint_url} if self.endpoint_url else {}
+        self.client_kwargs = client_kwargs
+        if self.s3_client is None and get_client_registry().storage is not None:
+            # A local or in-memory backend stands in for S3; its calls run on the executor
+            self.s3_client = get_client('s3')
+
+        if get_session is not None:
+            session = self.session = get_session()
+            if self.s3_client is None:
+                self.s3_client = await self.exit_stack.enter_async_context(
+                    session.create_client('s3', config=self.client_config('s3'), **client_kwargs))
+                instrument_client(self.s3_client)
+            if self.bedrock_client is None:
+                self.bedrock_client = await self.exit_stack.enter_async_context(
+                    session.create_client('bedrock-runtime', config=self.client_config('bedrock-runtime'),
+                                          **client_kwargs))
+                instrument_client(self.bedrock_client)
+        else:
+            logger.info("aiobotocore not installed; running boto3 clients on a bounded thread pool")
+            # The shared registry clients already point at PIPELINE_AWS_ENDPOINT_URL when it is set
+            make_client = get_client if self.endpoint_url == os.environ.get('PIPELINE_AWS_ENDPOINT_URL') \
+                else self.make_boto3_client
+            self.s3_client = self.s3_client or make_client('s3')
+            self.bedrock_client = self.bedrock_client or make_client('bedrock-runtime')
+
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="aio")
+        return self
+
+    def client_config(self, service_name: str):
+        """
+        AioConfig with a connection for every request allowed in flight.
+
+        Retries follow the shared registry: none for bedrock-runtime, so each throttle
+        reaches invoke_model_with_retry and the rate limiter instead of botocore.
+        """
+        return AioConfig(**get_client_registry().config_options(service_name, self.max_in_flight))
+
+    def make_boto3_client(self, service_name: str, region_name: Optional[str] = None):
+        """A boto3 client for `endpoint_url`, configured like the registry's, with a connection per executor thread."""
+        registry = get_client_registry()
+        config = registry.build_config(service_name, max(self.executor_workers, registry.max_pool_connections))
+        kwargs = dict(self.client_kwargs, region_name=region_name) if region_name else self.client_kwargs
+        return boto3.client(service_name, config=config, **kwargs)
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.exit_stack.aclose()
+        self.executor.shutdown(wait=False)
+
+    async def _call(self, client, method: str, **kwargs):
+        function = getattr(client, method)
+        if inspect.iscoroutinefunction(function):
+            return await function(**kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(function, **kwargs))
+
+    async def bedrock_client_for(self, region_name: Optional[str]):
+        """The bedrock-runtime client for a routing candidate's region (the default client when unset)."""
+        if region_name is None or region_name == client_region(self.bedrock_client):
+            return self.bedrock_client
+        if region_name not in self.region_clients:
+            if self.session is not None:
+                self.region_clients[region_name] = await self.exit_stack.enter_async_context(
+                    self.session.create_client('bedrock-runtime', region_name=region_name,
+                                               config=self.client_config('bedrock-runtime'), **self.client_kwargs))
+                instrument_client(self.region_clients[region_name])
+            elif self.endpoint_url == os.environ.get('PIPELINE_AWS_ENDPOINT_URL'):
+                self.region_clients[region_name] = get_client('bedrock-runtime', region_name)
+            else:
+                self.region_clients[region_name] = self.make_boto3_client('bedrock-runtime', region_name)
+        return self.region_clients[region_name]
+
+    async def _read_body(self, body, size: Optional[int] = None) -> bytes:
+        read = body.read if size is None else partial(body.read, size)
+        if inspect.iscoroutinefunction(body.read):
+            return await read()
+        # A boto3 body reads from the network, so it runs on the thread pool like the client calls
+        data = await asyncio.get_running_loop().run_in_executor(self.executor, read)
+        if inspect.isawaitable(data):
+            data = await data
+        return data
+
+    async def iter_object_chunks(self, bucket_name: str, key: str,
+                                 chunk_size: int = STREAM_CHUNK_BYTES) -> AsyncIterator[bytes]:
+        """Raw pieces of an S3 object as they arrive (see iter_body_chunks); the body is closed at the end."""
+        response = await self._call(self.s3_client, 'get_object', Bucket=bucket_name, Key=key)
+        body = response['Body']
+        try:
+            while True:
+                data = await self._read_body(body, chunk_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            if hasattr(body, 'close'):
+                closed = body.close()
+                if inspect.isawaitable(closed):
+                    await closed
+
+    async def get_object_text(self, bucket_name: str, key: str, chunk_size: int = STREAM_CHUNK_BYTES) -> str:
+        """Whole text of an S3 object, decoded incrementally while it streams in, like read_object_text."""
+        decoder = IncrementalSourceDecoder(key)
+        pieces = [decoder.decode(data) async for data in self.iter_object_chunks(bucket_name, key, chunk_size)]
+        pieces.append(decoder.decode(b'', final=True))
+        return ''.join(pieces)
+
+    async def put_object_text(self, bucket_name: str, key: str, content: str) -> None:
+        await self._call(self.s3_client, 'put_object', Bucket=bucket_name, Key=key, Body=content.encode('utf-8'))
+        logger.info(f"Successfully wrote to S3: {key}")
+
+    async def list_objects(self, bucket_name: str, prefix: str,
+                           suffixes: Optional[Tuple[str, ...]] = None) -> AsyncIterator[dict]:
+        """Yield list_objects_v2 entries page by page, optionally filtered by key suffix."""
+        kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+        while True:
+            page = await self._call(self.s3_client, 'list_objects_v2', **kwargs)
+            for obj in page.get('Contents', []):
+                if suffixes is None or obj['Key'].endswith(suffixes):
+                    yield obj
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    async def invoke_model(self, body: str, model_id: str = DEFAULT_MODEL_ID, bedrock_client=None) -> dict:
+        """
+        Async counterpart of pipeline.bedrock.invoke_model; returns the decoded response body.
+
+        Shares the response cache and the rate limiter's request/token budget with the
+        synchronous callers. Errors are re-raised for invoke_model_with_retry to handle.
+        """
+        return (await self._invoke_model(body, model_id, bedrock_client))[0]
+
+    async def _invoke_model(self, body: str, model_id: str, bedrock_client=None) -> Tuple[dict, bool]:
+        """invoke_model, also returning whether the response came from the cache."""
+        bedrock_client = bedrock_client or self.bedrock_client
+        body = prepare_body(body, model_id)
+        cache = get_response_cache()
+        cache_key = make_cache_key(model_id, body)
+        if cache is not None:
+            cached_body = cache.get(cache_key)
+            if cached_body is not None:
+                logger.info(f"Bedrock response served from cache ({cache_key[:12]})")
+                return json.loads(cached_body), True
+
+        limiter = get_rate_limiter(model_id, client_region(bedrock_client))
+        started, waiting = time.time(), time.monotonic()
+        async with self.in_flight:
+            await limiter.acquire_async(estimate_body_tokens(body, model_id))
+            get_metrics().record_span('rate_limit_wait', started, time.monotonic() - waiting,
+                                      labels={'limiter': limiter.name})
+            try:
+                response = await self._call(bedrock_client, 'invoke_model', modelId=model_id, body=body)
+                body_bytes = await self._read_body(response['body'])
+            except ClientError as e:
+                if e.response['Error'].get('Code') == 'ThrottlingException':
+                    limiter.record_throttle()
+                raise
+
+        limiter.record_success(get_output_token_count(response))
+        record_input_tokens(body, get_prompt_token_count(response), model_id)
+        if cache is not None:
+            cache.put(cache_key, body_bytes)
+        return json.loads(body_bytes), False
+
+    async def invoke_routed(self, body: str, route: str) -> dict:
+        """Async counterpart of pipeline.routing.invoke_routed; returns the decoded response body."""
+        router = get_model_router()
+        candidates = router.candidates(route)
+        for index, candidate in enumerate(candidates):
+            started = time.monotonic()
+            try:
+                with get_metrics().span('bedrock_invoke', route=route, model=candidate.model_id) as span:
+                    bedrock_client = await self.bedrock_client_for(candidate.region_name)
+                    response_body, cache_hit = await self._invoke_model(body, candidate.model_id, bedrock_client)
+                    span.set(cache='hit' if cache_hit else 'miss')
+            except ClientError as e:
+                router.handle_error(route, candidates, index, e)
+                continue
+            router.record_success(route, candidate, time.monotonic() - started, TokenUsage.from_body(response_body),
+                                  cache_hit)
+            return response_body
+
+    async def invoke_model_with_retry(self, body: str, max_retries: int = 10,
+                                      model_id: str = DEFAULT_MODEL_ID, route: Optional[str] = None) -> dict:
+        """invoke_model with retry and backoff; with `route`, the model comes from the route's tier."""
+        for attempt in range(1, max_retries + 1):
+            try:
+                if route is not None:
+                    response_body = await self.invoke_routed(body, route)
+                else:
+                    response_body = await self.invoke_model(body, model_id)
+                logger.info(f"Bedrock API call successful on attempt {attempt}")
+                return response_body
+
+            except ClientError as e:
+                error_code = e.response['Error'].get('Code', 'Unknown')
+                error_message = e.response['Error'].get('Message', 'No message available')
+                logger.warning(f"Bedrock API Error (Attempt {attempt}/{max_retries}): {error_code} - {error_message}")
+
+                if error_code in RETRYABLE_ERRORS and attempt < max_retries:
+                    if "Too many tokens" in error_message:
+                        raise BedrockRetryException("Too many tokens")
+                    inc('bedrock_retries_total', route=route, code=error_code)
+                    if error_code == 'ThrottlingException':
+                        continue
+                    delay = exponential_backoff(attempt)
+                    logger.info(f"Retrying in {delay:.2f} seconds...")
+                    await asyncio.sleep(delay)
+                    continue
+
+                if attempt == max_retries:
+                    raise BedrockRetryException(f"Failed after {max_retries} attempts. Last error: {error_message}")
+                raise
+
+async def run_bounded(items: Iterable, worker: Callable[[object], Awaitable], limit: int,
+                      description: str = "item") -> Tuple[list, list]:
+    """
+    Run `worker` over `items` with at most `limit` running at once.
+
+    Mirrors the scripts' continue-on-error loops: failures are logged and collected
+    instead of cancelling the other items. Returns (succeeded, failed) item lists.
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(limit)
+    succeeded = []
+    failed = []
+
+    async def run_one(item) -> None:
+        async with semaphore:
+            try:
+                await worker(item)
+                succeeded.append(item)
+                logger.info(f"Completed {description} {len(succeeded) + len(failed)}/{len(items)}: {item}")
+            except Exception as e:
+                failed.append(item)
+                logger.error(f"Failed to process {description} {item}: {str(e)}")
+
+    await asyncio.gather(*(run_one(item) for item in items))
+    return succeeded, failed
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from pipeline import bedrock
+from pipeline.clients import get_client
+from pipeline.outputs import OutputWriteError, get_output_sink
+from pipeline.text import iter_object_lines
+
+logger = logging.getLogger(__name__)
+
+BATCH_PREFIX = 'target/batch'
+FINISHED_STATUSES = ('Completed', 'PartiallyCompleted', 'Failed', 'Stopped', 'Expired')
+
+class BatchRequest:
+    """One model call in a batch job and the S3 key its text output is written to."""
+
+    def __init__(self, input_key: str, body: str, output_key: str):
+        self.input_key = input_key
+        self.body = body
+        self.output_key = output_key
+        self.record_id = None
+
+class BedrockBatchBackend:
+    """Submits jobs to Bedrock batch inference (create_model_invocation_job)."""
+
+    def __init__(self, role_arn: str, model_id: str = bedrock.DEFAULT_MODEL_ID, poll_seconds: float = 60):
+        self.role_arn = role_arn
+        self.model_id = model_id
+        self.poll_seconds = poll_seconds
+        self.client = get_client('bedrock')
+
+    def submit(self, job_name: str, input_uri: str, output_uri: str) -> str:
+        response = self.client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=self.model_id,
+            inputDataConfig={'s3InputDataConfig': {'s3Uri': input_uri, 's3InputFormat': 'JSONL'}},
+            outputDataConfig={'s3OutputDataConfig': {'s3Uri': output_uri}}
+        )
+        return response['jobArn']
+
+    def wait(self, job_id: str) -> str:
+        while True:
+            job = self.client.get_model_invocation_job(jobIdentifier=job_id)
+            status = job['status']
+            if status in FINISHED_STATUSES:
+                if job.get('message'):
+                    logger.info(f"Batch job {job_id} finished with status {status}: {job['message']}")
+                return status
+            logger.info(f"Batch job {job_id} is {status}; checking again in {self.poll_seconds:.0f} seconds")
+            time.sleep(self.poll_seconds)
+
+    @classmethod
+    def from_env(cls, model_id: str = bedrock.DEFAULT_MODEL_ID) -> "BedrockBatchBackend":
+        role_arn = os.environ.get('BEDROCK_BATCH_ROLE_ARN')
+        if not role_arn:
+            raise ValueError("BEDROCK_BATCH_ROLE_ARN must be set to submit Bedrock batch inference jobs")
+        return cls(role_arn, model_id, poll_seconds=float(os.environ.get('BEDROCK_BATCH_POLL_SECONDS', '60')))
+
+class LocalBatchBackend:
+    """
+    Stand-in for the batch service for local runs and tests.
+
+    Reads the job's JSONL input from S3, answers each record with `invoke`
+    (by default a normal on-demand call through pipeline.bedrock), and writes
+    the results in Bedrock's batch output format to the job's output prefix.
+    """
+
+    def __init__(self, invoke: Optional[Callable[[str], dict]] = None, s3_client=None,
+                 model_id: str = bedrock.DEFAULT_MODEL_ID):
+        self.s3_client = s3_client or get_client('s3')
+        self.model_id = model_id
+        self.invoke = invoke or self.invoke_on_demand
+        self.bedrock_client = None
+        self.statuses: Dict[str, str] = {}
+
+    def invoke_on_demand(self, body: str) -> dict:
+        if self.bedrock_client is None:
+            self.bedrock_client = get_client('bedrock-runtime')
+        response = bedrock.invoke_model(self.bedrock_client, body, self.model_id)
+        return json.loads(response['body'].read())
+
+    def submit(self, job_name: str, input_uri: str, output_uri: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        bucket_name, input_key = split_s3_uri(input_uri)
+        _, output_prefix = split_s3_uri(output_uri)
+
+        output_lines = []
+        failures = 0
+        for line in iter_object_lines(self.s3_client, bucket_name, input_key):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                record['modelOutput'] = self.invoke(json.dumps(record['modelInput']))
+            except Exception as e:
+                failures += 1
+                record['error'] = {'errorCode': 500, 'errorMessage': str(e)}
+            output_lines.append(json.dumps(record))
+
+        output_key = f"{output_prefix.rstrip('/')}/{job_id}/{os.path.basename(input_key)}.out"
+        self.s3_client.put_object(Bucket=bucket_name, Key=output_key,
+                                  Body='\n'.join(output_lines).encode('utf-8'))
+        self.statuses[job_id] = 'PartiallyCompleted' if failures else 'Completed'
+        return job_id
+
+    def wait(self, job_id: str) -> str:
+        return self.statuses[job_id]
+
+def split_s3_uri(uri: str) -> tuple:
+    bucket_name, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket_name, key
+
+def get_batch_backend(mode: str, model_id: str = bedrock.DEFAULT_MODEL_ID):
+    """Batch backend for PIPELINE_BATCH_MODE; a job runs every record on `model_id`."""
+    if mode == 'bedrock':
+        return BedrockBatchBackend.from_env(model_id)
+    if mode == 'local':
+        return LocalBatchBackend(model_id=model_id)
+    raise ValueError(f"Unknown batch mode: {mode}")
+
+def run_batch(bucket_name: str, stage_name: str, requests: List[BatchRequest], backend,
+              s3_client=None) -> Dict[str, List[str]]:
+    """
+    Run all of a stage's prompts as one batch job and fan the results out to their output keys.
+
+    The requests are written as a JSONL job input under target/batch/<stage>/<run>/,
+    submitted as one job, and each result's text is written to its request's output
+    key. The job input and the results go through the output sink, so the results are
+    uploaded concurrently and a large job input in parts. Returns the output keys of
+    every input whose requests all succeeded and were written, so the caller can
+    record those inputs in its manifest.
+    """
+    s3_client = s3_client or get_client('s3')
+    if not requests:
+        logger.info(f"No requests to batch for {stage_name}")
+        return {}
+
+    run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+    job_prefix = f"{BATCH_PREFIX}/{stage_name}/{run_id}"
+    input_key = f"{job_prefix}/input/{stage_name}.jsonl"
+    output_prefix = f"{job_prefix}/output/"
+
+    records = []
+    for index, request in enumerate(requests, 1):
+        request.record_id = f"REC{index:08d}"
+        # Batch inference does not use the prompt cache
+        model_input = json.loads(bedrock.strip_cache_points(request.body))
+        records.append(json.dumps({'recordId': request.record_id, 'modelInput': model_input}))
+    output_sink = get_output_sink()
+    output_sink.write(bucket_name, input_key, '\n'.join(records))
+    output_sink.wait_for(bucket_name, [input_key])
+    logger.info(f"Wrote {len(records)} batch records to s3://{bucket_name}/{input_key}")
+
+    job_id = backend.submit(f"{stage_name.replace('_', '-')}-{run_id.replace('_', '-')}",
+                            f"s3://{bucket_name}/{input_key}", f"s3://{bucket_name}/{output_prefix}")
+    logger.info(f"Submitted batch job {job_id} for {stage_name}")
+    status = backend.wait(job_id)
+    if status not in ('Completed', 'PartiallyCompleted'):
+        raise RuntimeError(f"Batch job {job_id} for {stage_name} ended with status {status}")
+
+    results = read_batch_results(s3_client, bucket_name, output_prefix)
+    requests_by_id = {request.record_id: request for request in requests}
+    failed_inputs = set()
+    written: Dict[str, List[str]] = {}
+
+    for record_id, request in requests_by_id.items():
+        record = results.get(record_id)
+        if record is None or 'modelOutput' not in record:
+            error = record.get('error') if record else 'missing from job output'
+            logger.error(f"Batch record {record_id} for {request.input_key} failed: {error}")
+            failed_inputs.add(request.input_key)
+            continue
+        content = record['modelOutput']['content'][0]['text']
+        output_sink.write(bucket_name, request.output_key, content)
+        written.setdefault(request.input_key, []).append(request.output_key)
+
+    for input_key, output_keys in written.items():
+        try:
+            output_sink.wait_for(bucket_name, output_keys)
+        except OutputWriteError as e:
+            logger.error(f"Batch results for {input_key} were not written: {e}")
+            failed_inputs.add(input_key)
+
+    logger.info(f"Batch job {job_id} finished with status {status}: "
+                f"{sum(len(keys) for keys in written.values())} outputs written, "
+                f"{len(failed_inputs)} input(s) with failed records or writes")
+    return {input_key: output_keys for input_key, output_keys in written.items() if input_key not in failed_inputs}
+
+def read_batch_results(s3_client, bucket_name: str, output_prefix: str) -> Dict[str, dict]:
+    results = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=output_prefix):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('.jsonl.out'):
+                continue
+            # Streamed line by line; a job's output can be far larger than any one record
+            try:
+                for line in iter_object_lines(s3_client, bucket_name, obj['Key']):
+                    if line.strip():
+                        record = json.loads(line)
+                        results[record['recordId']] = record
+            except ClientError as e:
+                logger.error(f"Error reading batch output {obj['Key']}: {e}")
+    return results
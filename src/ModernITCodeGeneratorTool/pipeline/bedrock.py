@@ -0,0 +1,193 @@
+import io
+import json
+import logging
+import os
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from pipeline.cache import get_response_cache, make_cache_key
+from pipeline.clients import client_region
+from pipeline.rate_limiter import get_rate_limiter
+from pipeline.tokens import get_token_estimator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+
+CACHE_POINT = {'type': 'ephemeral'}
+
+# Models that accept cache_control on Bedrock, matched against the model id after any
+# cross-region inference profile prefix; extend with BEDROCK_PROMPT_CACHING_MODELS
+PROMPT_CACHING_MODELS = (
+    'anthropic.claude-3-5-haiku-20241022',
+    'anthropic.claude-3-7-sonnet-20250219',
+    'anthropic.claude-sonnet-4',
+    'anthropic.claude-opus-4',
+)
+
+def prompt_caching_supported(model_id: str) -> bool:
+    if os.environ.get('BEDROCK_PROMPT_CACHING', '1').lower() in ('0', 'false', 'no'):
+        return False
+    extra_models = tuple(model.strip() for model in os.environ.get('BEDROCK_PROMPT_CACHING_MODELS', '').split(',')
+                         if model.strip())
+    return any(model in model_id for model in PROMPT_CACHING_MODELS + extra_models)
+
+def build_messages_body(instructions: str, content: str, max_tokens: int, context: Optional[str] = None) -> str:
+    """
+    Anthropic messages body with a stable, cacheable prefix and a variable suffix.
+
+    `instructions` become the system prompt and `context` (material shared by many
+    requests, e.g. a package spec) opens the user turn. Both end in a cache point, so
+    a model with prompt caching reads them from its cache on every later request with
+    the same prefix. `content` is the part that changes from request to request.
+    """
+    user_blocks = []
+    if context:
+        user_blocks.append({'type': 'text', 'text': context, 'cache_control': CACHE_POINT})
+    user_blocks.append({'type': 'text', 'text': content})
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "system": [{'type': 'text', 'text': instructions, 'cache_control': CACHE_POINT}],
+        "messages": [
+            {
+                "role": "user",
+                "content": user_blocks
+            }
+        ]
+    })
+
+# Shared by every stage that works on a converted Python module, so their requests for the
+# same module start with the same prefix
+PYTHON_MODULE_SYSTEM_PROMPT = ("You are an expert Python developer and analyst. The user message contains a "
+                               "Python module converted from PL/SQL, followed by a task about that module.")
+
+def build_module_task_body(code_content: str, task: str, max_tokens: int = 4096) -> str:
+    """
+    Body for a task about one Python module, with the module in the cacheable prefix.
+
+    The documentation, requirements and test stages all use this, so their requests
+    for the same module (often sent within minutes of each other by CodeGenerator.py)
+    share one cached prefix and differ only in the task.
+    """
+    return build_messages_body(PYTHON_MODULE_SYSTEM_PROMPT, task, max_tokens,
+                               context=f"Here's the code:\n\n{code_content}")
+
+def strip_cache_points(body: str) -> str:
+    """`body` without cache_control markers, for models and batch jobs without prompt caching."""
+    if '"cache_control"' not in body:
+        return body
+    request = json.loads(body)
+    for block in request.get('system', []) if isinstance(request.get('system'), list) else []:
+        block.pop('cache_control', None)
+    for message in request.get('messages', []):
+        if isinstance(message.get('content'), list):
+            for block in message['content']:
+                block.pop('cache_control', None)
+    return json.dumps(request)
+
+def prepare_body(body: str, model_id: str) -> str:
+    """The body as sent to `model_id`: cache points are kept only where prompt caching is supported."""
+    return body if prompt_caching_supported(model_id) else strip_cache_points(body)
+
+def estimate_text_tokens(text: str, model_id: str = DEFAULT_MODEL_ID) -> int:
+    """Input token estimate for model text, calibrated against the counts Bedrock has reported."""
+    return get_token_estimator().estimate(text, model_id)
+
+def get_content_text(content) -> str:
+    if isinstance(content, list):
+        return ''.join(block.get('text', '') for block in content if isinstance(block, dict))
+    return str(content)
+
+def get_body_text(body: str) -> str:
+    """The system and message text of an Anthropic messages body, i.e. what the input token count mostly measures."""
+    try:
+        request = json.loads(body)
+        messages = request.get('messages', [])
+        return get_content_text(request.get('system', '')) + \
+            ''.join(get_content_text(message.get('content', '')) for message in messages)
+    except (ValueError, AttributeError):
+        return body
+
+def estimate_body_tokens(body: str, model_id: str = DEFAULT_MODEL_ID) -> int:
+    return max(1, estimate_text_tokens(get_body_text(body), model_id))
+
+def record_input_tokens(body: str, input_tokens: int, model_id: str = DEFAULT_MODEL_ID) -> None:
+    """Calibrate the token estimator with the input token count Bedrock reported for `body`."""
+    get_token_estimator().record(model_id, get_body_text(body), input_tokens)
+
+def get_header_token_count(response: dict, header: str) -> int:
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    try:
+        return int(headers.get(header, 0))
+    except (TypeError, ValueError):
+        return 0
+
+def get_output_token_count(response: dict) -> int:
+    return get_header_token_count(response, 'x-amzn-bedrock-output-token-count')
+
+def get_input_token_count(response: dict) -> int:
+    """Input tokens billed at the full rate, i.e. not read from or written to the prompt cache."""
+    return get_header_token_count(response, 'x-amzn-bedrock-input-token-count')
+
+def get_cache_read_token_count(response: dict) -> int:
+    return get_header_token_count(response, 'x-amzn-bedrock-cache-read-input-token-count')
+
+def get_cache_write_token_count(response: dict) -> int:
+    return get_header_token_count(response, 'x-amzn-bedrock-cache-write-input-token-count')
+
+def get_prompt_token_count(response: dict) -> int:
+    """All input tokens of the request, whether billed in full or served from the prompt cache."""
+    return get_input_token_count(response) + get_cache_read_token_count(response) + \
+        get_cache_write_token_count(response)
+
+def cached_response(body_bytes: bytes) -> dict:
+    """Response shaped like invoke_model's, served from the response cache."""
+    return {
+        'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': {}, 'CacheHit': True},
+        'contentType': 'application/json',
+        'body': io.BytesIO(body_bytes),
+    }
+
+def invoke_model(bedrock_client, body: str, model_id: str = DEFAULT_MODEL_ID) -> dict:
+    """
+    Call bedrock_client.invoke_model through the response cache and the shared rate limiter.
+
+    A request whose model id and body were answered before is served from the cache
+    without calling Bedrock. Otherwise the call waits for an in-flight slot and
+    request/token budget, reports ThrottlingException to the limiter so it can slow
+    down, charges the output tokens reported in the response headers, and stores the
+    response body in the cache. Errors are re-raised unchanged so each script's retry
+    loop keeps working as before. Prompt cache points are removed from the body for
+    models without prompt caching.
+    """
+    body = prepare_body(body, model_id)
+    cache = get_response_cache()
+    cache_key = make_cache_key(model_id, body)
+    if cache is not None:
+        cached_body = cache.get(cache_key)
+        if cached_body is not None:
+            logger.info(f"Bedrock response served from cache ({cache_key[:12]})")
+            return cached_response(cached_body)
+
+    limiter = get_rate_limiter(model_id, client_region(bedrock_client))
+
+    with limiter.slot(estimate_body_tokens(body, model_id)):
+        try:
+            response = bedrock_client.invoke_model(modelId=model_id, body=body)
+        except ClientError as e:
+            if e.response['Error'].get('Code') == 'ThrottlingException':
+                limiter.record_throttle()
+            raise
+
+    limiter.record_success(get_output_token_count(response))
+    record_input_tokens(body, get_prompt_token_count(response), model_id)
+
+    if cache is not None:
+        # The streaming body can only be read once, so buffer it for both the cache and the caller
+        body_bytes = response['body'].read()
+        cache.put(cache_key, body_bytes)
+        response['body'] = io.BytesIO(body_bytes)
+
+    return response
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from pipeline.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Prefix of a cache file while it is being written
+TEMP_FILE_PREFIX = '.tmp-'
+
+def make_cache_key(model_id: str, body: str) -> str:
+    """
+    Content address for a model call.
+
+    The request body holds the rendered prompt (prompt template plus input content)
+    and the inference parameters, so hashing it together with the model id means any
+    change to the model, the template or the input produces a different key.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_id.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(body.encode('utf-8'))
+    return digest.hexdigest()
+
+class LocalDiskCache:
+    """On-disk cache bounded by total size; least recently used entries are evicted first."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self) -> list:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                # Writes still in progress are neither cache entries nor eviction candidates
+                if name.startswith(TEMP_FILE_PREFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                value = cache_file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # mtime doubles as the last-used timestamp for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since it was read; the value is still good
+            pass
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=TEMP_FILE_PREFIX)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(value)
+        with self.lock:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self.total_bytes += len(value) - previous_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.total_bytes -= size
+            except FileNotFoundError:
+                continue
+        logger.info(f"Evicted response cache entries; cache now holds {self.total_bytes} bytes")
+
+class S3PrefixCache:
+    """Cache stored as one object per key under an S3 prefix, shared between machines."""
+
+    def __init__(self, bucket_name: str, prefix: str, s3_client=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+        self.s3_client = s3_client or get_client('s3')
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}")
+            return response['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                logger.warning(f"Error reading response cache entry {key}: {e}")
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        try:
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}", Body=value)
+        except ClientError as e:
+            logger.warning(f"Error writing response cache entry {key}: {e}")
+
+class ResponseCache:
+    """Local cache in front of an optional S3 cache; S3 hits are copied to the local cache."""
+
+    def __init__(self, local: LocalDiskCache, remote: Optional[S3PrefixCache] = None):
+        self.local = local
+        self.remote = remote
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.local.get(key)
+        if value is None and self.remote is not None:
+            value = self.remote.get(key)
+            if value is not None:
+                self.local.put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        self.local.put(key, value)
+        if self.remote is not None:
+            self.remote.put(key, value)
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        if os.environ.get('BEDROCK_CACHE_DISABLED', '').lower() in ('1', 'true', 'yes'):
+            return None
+
+        directory = os.environ.get(
+            'BEDROCK_CACHE_DIR',
+            os.path.join(os.path.expanduser('~'), '.cache', 'modernit_codegen', 'bedrock')
+        )
+        max_bytes = int(float(os.environ.get('BEDROCK_CACHE_MAX_MB', '1024')) * 1024 * 1024)
+        local = LocalDiskCache(directory, max_bytes)
+
+        remote = None
+        s3_uri = os.environ.get('BEDROCK_CACHE_S3_URI')
+        if s3_uri:
+            bucket_name, _, prefix = s3_uri.replace('s3://', '', 1).partition('/')
+            remote = S3PrefixCache(bucket_name, prefix or 'bedrock-cache')
+
+        return cls(local, remote)
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_loaded = False
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None when caching is disabled."""
+    global _response_cache, _response_cache_loaded
+    with _response_cache_lock:
+        if not _response_cache_loaded:
+            _response_cache = ResponseCache.from_env()
+            _response_cache_loaded = True
+        return _response_cache
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from pipeline.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+class LocalStateStore:
+    """Durable text state under a local directory; writes are atomic renames."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get_text(self, key: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.directory, key), 'r', encoding='utf-8') as state_file:
+                return state_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put_text(self, key: str, text: str) -> None:
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_path, path)
+
+    def delete_prefix(self, prefix: str) -> None:
+        shutil.rmtree(os.path.join(self.directory, prefix), ignore_errors=True)
+
+class S3StateStore:
+    """Durable text state stored as objects under an S3 prefix, so another machine can resume."""
+
+    def __init__(self, bucket_name: str, prefix: str, s3_client=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip('/')
+        self.s3_client = s3_client or get_client('s3')
+
+    def get_text(self, key: str) -> Optional[str]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}")
+            return response['Body'].read().decode('utf-8')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            return None
+
+    def put_text(self, key: str, text: str) -> None:
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{key}", Body=text.encode('utf-8'))
+
+    def delete_prefix(self, prefix: str) -> None:
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}/{prefix}/"):
+            for obj in page.get('Contents', []):
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=obj['Key'])
+
+def get_state_store():
+    """
+    State store named by PIPELINE_STATE_URI: an s3://bucket/prefix URI or a local directory.
+
+    Defaults to ~/.cache/modernit_codegen/state. Use an S3 URI when a crashed run may be
+    resumed from a different machine.
+    """
+    uri = os.environ.get('PIPELINE_STATE_URI', os.path.join('~', '.cache', 'modernit_codegen', 'state'))
+    if uri.startswith('s3://'):
+        bucket_name, _, prefix = uri.replace('s3://', '', 1).partition('/')
+        return S3StateStore(bucket_name, prefix or 'state')
+    return LocalStateStore(os.path.expanduser(uri))
+
+def text_digest(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+class ConversionCheckpoint:
+    """
+    Durable progress of one package's chunked conversion.
+
+    The job is identified by a hash of the package source, the prompt version and the
+    dependency interfaces in the prompt, so a changed package, or a package whose
+    dependencies changed, never reuses stale chunks. The chunk plan is stored on first use and
+    reused on restart (the chunker's token estimates may have been recalibrated since),
+    converted chunks are stored by number, and consolidation merges by a hash of their
+    inputs. The job is cleared once the converted file has been written.
+    """
+
+    def __init__(self, store, job_id: str, label: str):
+        self.store = store
+        self.job_id = job_id
+        self.label = label
+
+    @classmethod
+    def for_package(cls, label: str, pks_code: str, pkb_code: str, prompt_version: str,
+                    store=None, dependency_context: Optional[str] = None) -> "ConversionCheckpoint":
+        digest = text_digest(prompt_version, pks_code, pkb_code, dependency_context or '')
+        job_id = f"conversions/{label}-{digest[:16]}"
+        return cls(store or get_state_store(), job_id, label)
+
+    def _get(self, name: str) -> Optional[str]:
+        try:
+            return self.store.get_text(f"{self.job_id}/{name}")
+        except Exception as e:
+            logger.warning(f"Could not read checkpoint {self.job_id}/{name}: {str(e)}")
+            return None
+
+    def _put(self, name: str, text: str) -> None:
+        try:
+            self.store.put_text(f"{self.job_id}/{name}", text)
+        except Exception as e:
+            logger.warning(f"Could not write checkpoint {self.job_id}/{name}: {str(e)}")
+
+    def load_plan(self) -> Optional[List[Tuple[str, str]]]:
+        plan = self._get('plan.json')
+        if plan is None:
+            return None
+        chunks = [tuple(chunk) for chunk in json.loads(plan)]
+        logger.info(f"Resuming conversion of {self.label} with its checkpointed plan of {len(chunks)} chunks")
+        return chunks
+
+    def save_plan(self, chunks: List[Tuple[str, str]]) -> None:
+        self._put('plan.json', json.dumps(chunks))
+
+    def get_chunk(self, chunk_number: int) -> Optional[str]:
+        return self._get(f"chunks/{chunk_number:05d}.py")
+
+    def put_chunk(self, chunk_number: int, code: str) -> None:
+        self._put(f"chunks/{chunk_number:05d}.py", code)
+
+    def get_merge(self, parts: Iterable[str], final: bool) -> Optional[str]:
+        return self._get(f"merges/{text_digest(str(final), *parts)}.py")
+
+    def put_merge(self, parts: Iterable[str], final: bool, code: str) -> None:
+        self._put(f"merges/{text_digest(str(final), *parts)}.py", code)
+
+    def clear(self) -> None:
+        try:
+            self.store.delete_prefix(self.job_id)
+        except Exception as e:
+            logger.warning(f"Could not clear checkpoint {self.job_id}: {str(e)}")
+
+class PipelineRunState:
+    """
+    Which tasks of the latest pipeline run have finished, kept so `--resume` can continue it.
+
+    Stored per bucket in the state store. Finished tasks are collected in memory and
+    written at most every `save_interval` seconds, and always when the run finishes,
+    so an estate-wide run does not rewrite the growing list after every task. A crash
+    loses at most the last interval's tasks, which a resumed run finds unchanged in
+    the stage manifests. The run is marked "completed" only when every task succeeded.
+    """
+
+    def __init__(self, bucket_name: str, store=None, save_interval: float = 5.0):
+        self.store = store or get_state_store()
+        self.key = f"runs/CodeGenerator-{bucket_name}.json"
+        self.save_interval = save_interval
+        self.state: dict = {}
+        self.lock = threading.Lock()
+        self.last_saved = 0.0
+        self.unsaved = False
+
+    def load(self) -> Optional[dict]:
+        text = self.store.get_text(self.key)
+        return json.loads(text) if text else None
+
+    def start(self, stages: List[str]) -> None:
+        self.state = {
+            'started': datetime.now().isoformat(),
+            'stages': stages,
+            'status': 'running',
+            'completed': [],
+        }
+        self.save()
+
+    def resume(self, previous: dict) -> None:
+        self.state = dict(previous, status='running', resumed=datetime.now().isoformat())
+        self.save()
+
+    def completed_tasks(self) -> List[Tuple[str, str]]:
+        return [tuple(task_id) for task_id in self.state.get('completed', [])]
+
+    def mark_completed(self, task_id: Tuple[str, str]) -> None:
+        with self.lock:
+            self.state['completed'].append(list(task_id))
+            self.unsaved = True
+            if time.monotonic() - self.last_saved >= self.save_interval:
+                self.save()
+
+    def flush(self) -> None:
+        """Write tasks completed since the last save."""
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+    def finish(self, status: str) -> None:
+        with self.lock:
+            self.state['status'] = status
+            self.state['finished'] = datetime.now().isoformat()
+            self.save()
+
+    def save(self) -> None:
+        self.last_saved = time.monotonic()
+        try:
+            self.store.put_text(self.key, json.dumps(self.state, indent=2))
+            self.unsaved = False
+        except Exception as e:
+            logger.warning(f"Could not write run state {self.key}: {str(e)}")
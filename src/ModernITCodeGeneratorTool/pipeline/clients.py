@@ -0,0 +1,108 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from pipeline.metrics import instrument_client
+from pipeline.storage import storage_from_env
+
+logger = logging.getLogger(__name__)
+
+# Model calls can stream for minutes; S3 requests should fail fast and be retried
+READ_TIMEOUTS = {'bedrock-runtime': 900, 'bedrock': 60, 's3': 60}
+
+# Bedrock retries are handled by call_bedrock_with_retry so every throttle reaches the
+# rate limiter; botocore retrying them silently would hide the signal it adapts on.
+MAX_ATTEMPTS = {'bedrock-runtime': 1}
+
+class ClientRegistry:
+    """
+    One boto3 client per AWS service, shared by every stage and thread in the process.
+
+    boto3 clients are thread-safe, but creating one re-resolves credentials and builds a
+    new HTTPS connection pool. Clients are created once from a private session (the
+    default session is not thread-safe) with a connection pool sized for the stage
+    thread pools, TCP keep-alive and standard-mode retries.
+
+    With `storage` (a pipeline.storage backend) that backend is handed out as the 's3'
+    client, so the whole pipeline reads and writes local files or memory instead.
+    """
+
+    def __init__(self, max_pool_connections: int = 64, max_attempts: int = 5,
+                 endpoint_url: Optional[str] = None, session=None, storage=None):
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self.endpoint_url = endpoint_url
+        # Anything with boto3's Session.client signature, e.g. pipeline.simulator.SimulatedSession
+        self.session = session or boto3.session.Session()
+        self.storage = storage
+        self.clients: Dict[tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def config_options(self, service_name: str, max_pool_connections: Optional[int] = None) -> dict:
+        """botocore Config arguments for `service_name`; also used for the async clients' AioConfig."""
+        return {
+            'max_pool_connections': max_pool_connections or self.max_pool_connections,
+            'tcp_keepalive': True,
+            'connect_timeout': 10,
+            'read_timeout': READ_TIMEOUTS.get(service_name, 60),
+            'retries': {'mode': 'standard', 'total_max_attempts': MAX_ATTEMPTS.get(service_name, self.max_attempts)},
+        }
+
+    def build_config(self, service_name: str, max_pool_connections: Optional[int] = None) -> Config:
+        return Config(**self.config_options(service_name, max_pool_connections))
+
+    def get(self, service_name: str, region_name: Optional[str] = None):
+        if service_name == 's3' and self.storage is not None:
+            return self.storage
+        with self.lock:
+            client = self.clients.get((service_name, region_name))
+            if client is None:
+                kwargs = {'config': self.build_config(service_name)}
+                if self.endpoint_url:
+                    kwargs['endpoint_url'] = self.endpoint_url
+                if region_name:
+                    kwargs['region_name'] = region_name
+                client = self.session.client(service_name, **kwargs)
+                instrument_client(client)
+                self.clients[(service_name, region_name)] = client
+                logger.info(f"Created shared {service_name} client{f' for {region_name}' if region_name else ''} "
+                            f"(max_pool_connections={self.max_pool_connections})")
+            return client
+
+    @classmethod
+    def from_env(cls) -> "ClientRegistry":
+        return cls(
+            max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '64')),
+            max_attempts=int(os.environ.get('AWS_CLIENT_MAX_ATTEMPTS', '5')),
+            endpoint_url=os.environ.get('PIPELINE_AWS_ENDPOINT_URL'),
+            storage=storage_from_env(),
+        )
+
+_client_registry: Optional[ClientRegistry] = None
+_client_registry_lock = threading.Lock()
+
+def get_client_registry() -> ClientRegistry:
+    """Return the process-wide registry, creating it from the environment on first use."""
+    global _client_registry
+    with _client_registry_lock:
+        if _client_registry is None:
+            _client_registry = ClientRegistry.from_env()
+        return _client_registry
+
+def use_client_registry(registry: ClientRegistry) -> None:
+    """Replace the process-wide registry, e.g. with one whose session creates simulated clients."""
+    global _client_registry
+    with _client_registry_lock:
+        _client_registry = registry
+
+def get_client(service_name: str, region_name: Optional[str] = None):
+    """Shared, connection-pooled client for `service_name` (e.g. 's3', 'bedrock-runtime'), optionally in another region."""
+    return get_client_registry().get(service_name, region_name)
+
+def client_region(client) -> Optional[str]:
+    """Region a boto3 client sends its requests to, or None for clients that do not say (e.g. test fakes)."""
+    return getattr(getattr(client, 'meta', None), 'region_name', None)
@@ -0,0 +1,238 @@
+import ast
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pipeline.bedrock import estimate_text_tokens
+from pipeline.plsql import iter_lines, iter_plsql_units, package_name, package_references, spec_signature_summary
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for the dependency summaries attached to one conversion prompt
+DEPENDENCY_CONTEXT_TOKEN_BUDGET = 4000
+
+FENCE_PATTERN = re.compile(r"^\s*```[A-Za-z0-9_+-]*\s*$", re.MULTILINE)
+
+class PackageGraph:
+    """
+    Which packages call which, keyed by source base name (the file name without .pks/.pkb).
+
+    `references[a][b]` holds the members of package `b` that package `a` uses as
+    B.MEMBER. Packages that reference each other, directly or through others, form one
+    strongly connected component; they are converted side by side with each other's
+    spec summaries rather than in an order, so no package is ever converted twice.
+    """
+
+    def __init__(self, packages: Dict[str, str], specs: Dict[str, str],
+                 references: Dict[str, Dict[str, Set[str]]]):
+        self.packages = packages
+        self.specs = specs
+        self.references = references
+        self._components = None
+
+    def dependencies(self, base_name: str) -> List[str]:
+        return sorted(self.references.get(base_name, {}))
+
+    def components(self) -> List[List[str]]:
+        """Strongly connected components (Tarjan), each listed after every component it depends on."""
+        if self._components is not None:
+            return self._components
+
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        def enter(node: str) -> None:
+            index[node] = lowlink[node] = len(index)
+            stack.append(node)
+            on_stack.add(node)
+            path.append((node, iter(self.dependencies(node))))
+
+        # Iterative so long call chains cannot hit the interpreter's recursion limit;
+        # `path` holds the nodes being visited, each with its remaining dependencies
+        path = []
+        for root in sorted(self.packages):
+            if root in index:
+                continue
+            enter(root)
+            while path:
+                node, pending = path[-1]
+                dependency = next(pending, None)
+                if dependency is not None:
+                    if dependency not in index:
+                        enter(dependency)
+                    elif dependency in on_stack:
+                        lowlink[node] = min(lowlink[node], index[dependency])
+                    continue
+
+                path.pop()
+                if path:
+                    caller = path[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+
+        self._components = components
+        return components
+
+    def component_of(self, base_name: str) -> List[str]:
+        for component in self.components():
+            if base_name in component:
+                return component
+        return [base_name]
+
+    def cycles(self) -> List[List[str]]:
+        return [component for component in self.components() if len(component) > 1]
+
+    def conversion_order(self, base_names: Optional[Iterable[str]] = None) -> List[str]:
+        """`base_names` (default: all packages) ordered so dependencies come before their callers."""
+        order = [name for component in self.components() for name in component]
+        if base_names is None:
+            return order
+        wanted = set(base_names)
+        # Names the graph does not know go last; they have no known dependencies either way
+        return [name for name in order if name in wanted] + sorted(wanted - set(order))
+
+    def upstream(self, base_name: str) -> List[str]:
+        """Dependencies of `base_name` to convert before it, i.e. outside its own cycle."""
+        component = self.component_of(base_name)
+        return [dependency for dependency in self.dependencies(base_name) if dependency not in component]
+
+    def transitive_dependencies(self, base_name: str) -> List[str]:
+        """Every package `base_name` calls, directly or through others, excluding itself."""
+        seen = set()
+        pending = [base_name]
+        while pending:
+            for dependency in self.dependencies(pending.pop()):
+                if dependency not in seen:
+                    seen.add(dependency)
+                    pending.append(dependency)
+        seen.discard(base_name)
+        return sorted(seen)
+
+    def dependency_context(self, base_name: str, python_sources: Optional[Dict[str, str]] = None,
+                           token_budget: int = DEPENDENCY_CONTEXT_TOKEN_BUDGET) -> Optional[str]:
+        """
+        Prompt section with the interfaces `base_name` calls in other packages, or None.
+
+        Each dependency contributes the spec declarations of the members it uses and,
+        when it has already been converted (`python_sources`), the matching signatures
+        of its Python module, so calls are translated to the names that actually exist.
+        Bodies are never included. Sections are cut at `token_budget` estimated tokens.
+        """
+        python_sources = python_sources or {}
+        sections = []
+        used_tokens = 0
+        for dependency in self.dependencies(base_name):
+            members = self.references[base_name][dependency]
+            lines = [f"-- {self.packages[dependency]} ({dependency}.pks)"]
+            lines.extend(spec_signature_summary(self.specs.get(dependency, ''), members).splitlines())
+            python_summary = python_api_summary(python_sources.get(dependency, ''), members)
+            if python_summary:
+                lines.append(f"# Converted Python module {dependency}.py")
+                lines.extend(python_summary.splitlines())
+
+            kept = []
+            for line in lines:
+                line_tokens = estimate_text_tokens(line + '\n')
+                if used_tokens + line_tokens > token_budget:
+                    kept.append('  ...')
+                    break
+                kept.append(line)
+                used_tokens += line_tokens
+            sections.append('\n'.join(kept))
+            if used_tokens >= token_budget or kept[-1] == '  ...':
+                logger.info(f"Dependency context for {base_name} truncated at {token_budget} tokens")
+                break
+
+        if not sections:
+            return None
+        return ("Interfaces of other packages this package calls. Call them through these names "
+                "and signatures instead of re-implementing them:\n\n" + '\n\n'.join(sections))
+
+def build_package_graph(sources: Dict[str, Tuple[str, Union[str, Iterable[str]]]]) -> PackageGraph:
+    """
+    Package call graph of `sources`, which maps each base name to its spec code and body.
+
+    A body may be given as its lines (e.g. streamed from S3 with iter_object_lines);
+    it is then scanned unit by unit as the lines arrive and never held in full.
+    """
+    packages = {base_name: package_name(pks_code) or base_name.upper()
+                for base_name, (pks_code, _) in sources.items()}
+    by_package = {name: base_name for base_name, name in packages.items()}
+
+    references = {}
+    for base_name, (pks_code, pkb_code) in sources.items():
+        known = set(by_package) - {packages[base_name]}
+        used = package_references(pks_code, known)
+        pkb_lines = iter_lines(pkb_code) if isinstance(pkb_code, str) else pkb_code
+        for unit in iter_plsql_units(pkb_lines):
+            for name, members in package_references(unit.text, known).items():
+                used.setdefault(name, set()).update(members)
+        references[base_name] = {by_package[name]: members for name, members in used.items()}
+
+    graph = PackageGraph(packages, {base_name: pks_code for base_name, (pks_code, _) in sources.items()},
+                         references)
+    edges = sum(len(dependencies) for dependencies in references.values())
+    logger.info(f"Package graph: {len(packages)} packages, {edges} dependencies, "
+                f"{len(graph.cycles())} cycles")
+    for component in graph.cycles():
+        logger.warning(f"Packages converted together because they call each other: {', '.join(component)}")
+    return graph
+
+def normalize_identifier(name: str) -> str:
+    """PL/SQL and Python spellings of one name compare equal: PieceValue, piece_value, PIECEVALUE."""
+    return name.replace('_', '').lower()
+
+def python_api_summary(code: str, members: Optional[Set[str]] = None) -> Optional[str]:
+    """
+    Signatures of the functions, classes and methods in converted Python `code`, or None.
+
+    With `members`, only definitions whose name matches one of those PL/SQL names are
+    kept (plus the classes that contain them); when none match, the full outline is
+    returned so the caller still sees what the module offers.
+    """
+    if not code.strip():
+        return None
+    try:
+        tree = ast.parse(FENCE_PATTERN.sub('', code))
+    except SyntaxError:
+        return None
+
+    wanted = {normalize_identifier(member) for member in members or ()}
+
+    def signature(node) -> str:
+        prefix = 'async def' if isinstance(node, ast.AsyncFunctionDef) else 'def'
+        returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ''
+        return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+    def outline(only_wanted: bool) -> List[str]:
+        lines = []
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                if not only_wanted or normalize_identifier(node.name) in wanted:
+                    lines.append(signature(node))
+            elif isinstance(node, ast.ClassDef):
+                methods = [child for child in node.body
+                           if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+                class_wanted = normalize_identifier(node.name) in wanted
+                if only_wanted and not class_wanted:
+                    methods = [method for method in methods if normalize_identifier(method.name) in wanted]
+                    if not methods:
+                        continue
+                bases = f"({', '.join(ast.unparse(base) for base in node.bases)})" if node.bases else ''
+                lines.append(f"class {node.name}{bases}:")
+                lines.extend(f"    {signature(method)}" for method in methods)
+        return lines
+
+    lines = outline(bool(wanted)) or outline(False)
+    return '\n'.join(lines) or None
@@ -0,0 +1,245 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+from pipeline.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Keys per list_objects_v2 request; 1000 is the service maximum
+LIST_PAGE_SIZE = 1000
+
+# Pages waiting for the consumer; workers block once it falls this far behind
+QUEUE_PAGES = 64
+
+# Inventory columns when the manifest has no fileSchema (the order S3 writes by default)
+DEFAULT_INVENTORY_SCHEMA = 'Bucket, Key, Size, LastModifiedDate, ETag'
+
+_DONE = object()
+
+def parse_s3_uri(uri: str) -> Tuple[str, str]:
+    bucket_name, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket_name, key
+
+class _ListingRun:
+    """
+    Pages produced by listing tasks on a thread pool, handed to one consumer through a bounded queue.
+
+    Tasks can submit more tasks (a shard discovering sub-shards); the run ends when the
+    last one finishes. A task's exception is raised in the consumer, and closing the
+    consumer early stops the workers at their next page.
+    """
+
+    def __init__(self, max_workers: int, queue_pages: int = QUEUE_PAGES):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-list')
+        self.pages = queue.Queue(maxsize=queue_pages)
+        self.stop = threading.Event()
+        self.outstanding = 0
+        self.submitted = 0
+        self.lock = threading.Lock()
+
+    def submit(self, task: Callable, *args) -> None:
+        with self.lock:
+            self.outstanding += 1
+            self.submitted += 1
+        self.executor.submit(self._run, task, *args)
+
+    def _run(self, task: Callable, *args) -> None:
+        try:
+            if not self.stop.is_set():
+                task(self, *args)
+        except Exception as e:
+            self.emit(e)
+        finally:
+            with self.lock:
+                self.outstanding -= 1
+                finished = self.outstanding == 0
+            if finished:
+                self.emit(_DONE)
+
+    def emit(self, item) -> bool:
+        """Queue a page (or the end marker); False once the consumer has gone away."""
+        while not self.stop.is_set():
+            try:
+                self.pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator[list]:
+        try:
+            while self.submitted:
+                item = self.pages.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop.set()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+class ObjectLister:
+    """
+    Lists the objects under a prefix with many concurrent list_objects_v2 requests.
+
+    S3 only pages one listing sequentially, about 1000 keys per round trip. The prefix
+    is instead split into shards with Delimiter='/' listings, down to `shard_depth`
+    levels of sub-prefixes, and the shards are paged concurrently on `max_workers`
+    threads. Entries are yielded as pages arrive, so a stage can start on the first
+    files while the rest of the bucket is still being listed. A prefix without
+    sub-prefixes is simply paged as one shard.
+
+    With `inventory_manifest` (an s3:// URI of an S3 Inventory manifest.json for the
+    bucket) source listings read the inventory's CSV files instead, without a single
+    list request. Inventories are produced daily or weekly, so they only suit inputs
+    that already existed at the last inventory, never the outputs of earlier stages.
+    """
+
+    def __init__(self, max_workers: int = 8, shard_depth: int = 2,
+                 inventory_manifest: Optional[str] = None):
+        self.max_workers = max(1, max_workers)
+        self.shard_depth = max(0, shard_depth)
+        self.inventory_manifest = inventory_manifest
+
+    def iter_objects(self, bucket_name: str, prefix: str, suffixes: Optional[Tuple[str, ...]] = None,
+                     s3_client=None, from_inventory: bool = False) -> Iterator[dict]:
+        """
+        list_objects_v2 entries under `prefix` (optionally only keys ending in `suffixes`), as they are found.
+
+        The order is not lexicographic across shards. `from_inventory` allows the S3
+        Inventory source, when one is configured.
+        """
+        s3_client = s3_client or get_client('s3')
+        run = _ListingRun(self.max_workers)
+        inventory = self.load_inventory(s3_client, bucket_name) if from_inventory else None
+        if inventory is not None:
+            source = f"inventory {self.inventory_manifest}"
+            data_bucket, file_keys, columns = inventory
+            for file_key in file_keys:
+                run.submit(self._read_inventory_file, s3_client, data_bucket, file_key, columns, prefix)
+        else:
+            source = f"{self.max_workers} listing workers"
+            run.submit(self._list_shard, s3_client, bucket_name, prefix, self.shard_depth)
+
+        start = time.monotonic()
+        count = 0
+        for page in run:
+            for obj in page:
+                if suffixes is None or obj['Key'].endswith(suffixes):
+                    count += 1
+                    yield obj
+        logger.info(f"Listed {count} objects under s3://{bucket_name}/{prefix} "
+                    f"in {time.monotonic() - start:.2f}s using {source}")
+
+    def list_objects(self, bucket_name: str, prefix: str, suffixes: Optional[Tuple[str, ...]] = None,
+                     s3_client=None, from_inventory: bool = False) -> List[dict]:
+        """All entries of iter_objects, in key order as a plain listing would return them."""
+        return sorted(self.iter_objects(bucket_name, prefix, suffixes, s3_client, from_inventory),
+                      key=lambda obj: obj['Key'])
+
+    def _list_shard(self, run: _ListingRun, s3_client, bucket_name: str, prefix: str, depth: int) -> None:
+        kwargs = {'Bucket': bucket_name, 'Prefix': prefix, 'MaxKeys': LIST_PAGE_SIZE}
+        if depth > 0:
+            # Objects directly under the prefix come back here; each sub-prefix becomes its own shard
+            kwargs['Delimiter'] = '/'
+        while True:
+            page = s3_client.list_objects_v2(**kwargs)
+            for common_prefix in page.get('CommonPrefixes', []):
+                run.submit(self._list_shard, s3_client, bucket_name, common_prefix['Prefix'], depth - 1)
+            if page.get('Contents') and not run.emit(page['Contents']):
+                return
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    def load_inventory(self, s3_client, bucket_name: str) -> Optional[Tuple[str, List[str], List[str]]]:
+        """(data bucket, CSV file keys, column names) of the configured inventory, if it covers `bucket_name`."""
+        if not self.inventory_manifest:
+            return None
+        manifest_bucket, manifest_key = parse_s3_uri(self.inventory_manifest)
+        response = s3_client.get_object(Bucket=manifest_bucket, Key=manifest_key)
+        manifest = json.loads(response['Body'].read())
+        if manifest.get('sourceBucket', bucket_name) != bucket_name:
+            logger.warning(f"Inventory {self.inventory_manifest} is for bucket {manifest['sourceBucket']}, "
+                           f"not {bucket_name}; listing instead")
+            return None
+        file_format = manifest.get('fileFormat', 'CSV')
+        if file_format.upper() != 'CSV':
+            raise ValueError(f"Inventory {self.inventory_manifest} is {file_format}; only CSV inventories are supported")
+        # destinationBucket is an ARN (arn:aws:s3:::name)
+        data_bucket = manifest.get('destinationBucket', manifest_bucket).rsplit(':', 1)[-1]
+        columns = [column.strip() for column in manifest.get('fileSchema', DEFAULT_INVENTORY_SCHEMA).split(',')]
+        file_keys = [entry['key'] for entry in manifest.get('files', [])]
+        logger.info(f"Using inventory {self.inventory_manifest} ({len(file_keys)} files, "
+                    f"created {manifest.get('creationTimestamp', 'unknown')})")
+        return data_bucket, file_keys, columns
+
+    def _read_inventory_file(self, run: _ListingRun, s3_client, data_bucket: str, file_key: str,
+                             columns: List[str], prefix: str) -> None:
+        body = s3_client.get_object(Bucket=data_bucket, Key=file_key)['Body']
+        try:
+            # CSV inventory files are always gzipped; decompressed and parsed as they stream in
+            text = io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding='utf-8', newline='')
+            page = []
+            for row in csv.reader(text):
+                record = dict(zip(columns, row))
+                if record.get('IsLatest', 'true') != 'true' or record.get('IsDeleteMarker', 'false') == 'true':
+                    continue
+                # Inventory keys are URL-encoded
+                key = unquote(record['Key'])
+                if not key.startswith(prefix):
+                    continue
+                page.append(object_from_inventory(key, record))
+                if len(page) >= LIST_PAGE_SIZE:
+                    if not run.emit(page):
+                        return
+                    page = []
+            if page:
+                run.emit(page)
+        finally:
+            body.close()
+
+    @classmethod
+    def from_env(cls) -> "ObjectLister":
+        return cls(
+            max_workers=int(os.environ.get('PIPELINE_LIST_WORKERS', '8')),
+            shard_depth=int(os.environ.get('PIPELINE_LIST_SHARD_DEPTH', '2')),
+            inventory_manifest=os.environ.get('PIPELINE_S3_INVENTORY_MANIFEST'),
+        )
+
+def object_from_inventory(key: str, record: dict) -> dict:
+    """A list_objects_v2-style entry from an inventory row, so manifests compare it with listed ones."""
+    obj = {'Key': key}
+    etag = record.get('ETag')
+    if etag is not None:
+        # Listings quote ETags, inventories do not
+        obj['ETag'] = etag if etag.startswith('"') else f'"{etag}"'
+    if record.get('Size'):
+        obj['Size'] = int(record['Size'])
+    last_modified = record.get('LastModifiedDate')
+    if last_modified:
+        obj['LastModified'] = datetime.fromisoformat(last_modified.replace('Z', '+00:00'))
+    return obj
+
+_object_lister: Optional[ObjectLister] = None
+_object_lister_lock = threading.Lock()
+
+def get_object_lister() -> ObjectLister:
+    """Return the process-wide lister, created from the environment on first use."""
+    global _object_lister
+    with _object_lister_lock:
+        if _object_lister is None:
+            _object_lister = ObjectLister.from_env()
+        return _object_lister
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from pipeline.clients import get_client
+from pipeline.outputs import get_output_sink
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PREFIX = 'target/manifests'
+
+def get_manifest_key(stage_name: str) -> str:
+    return f"{MANIFEST_PREFIX}/{stage_name}.json"
+
+def object_info_from_listing(obj: dict) -> dict:
+    """Keep the parts of a list_objects_v2 entry that identify an input's version."""
+    last_modified = obj.get('LastModified')
+    return {
+        'etag': obj.get('ETag', ''),
+        'last_modified': last_modified.isoformat() if hasattr(last_modified, 'isoformat') else str(last_modified),
+    }
+
+def combine_etags(*etags: str) -> str:
+    """Version marker for a stage input made of several objects (e.g. a .pks/.pkb pair)."""
+    return '+'.join(etag or '-' for etag in etags)
+
+class StageManifest:
+    """
+    Record of which input versions a stage has already turned into outputs.
+
+    Stored as JSON in S3 at target/manifests/<stage>.json. An input is skipped on a
+    later run when its ETag and the stage's prompt version both match the recorded
+    entry. Set PIPELINE_FULL_RUN=1 to reprocess everything regardless.
+    """
+
+    def __init__(self, bucket_name: str, stage_name: str, prompt_version: str, s3_client=None):
+        self.bucket_name = bucket_name
+        self.stage_name = stage_name
+        self.prompt_version = prompt_version
+        self.manifest_key = get_manifest_key(stage_name)
+        self.s3_client = s3_client or get_client('s3')
+        self.full_run = os.environ.get('PIPELINE_FULL_RUN', '').lower() in ('1', 'true', 'yes')
+        self.entries: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> "StageManifest":
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.manifest_key)
+            self.entries = json.loads(response['Body'].read()).get('inputs', {})
+            logger.info(f"Loaded manifest {self.manifest_key} with {len(self.entries)} entries")
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            logger.info(f"No manifest at {self.manifest_key}, processing all inputs")
+        return self
+
+    def is_current(self, input_key: str, etag: str) -> bool:
+        if self.full_run:
+            return False
+        entry = self.entries.get(input_key)
+        return bool(entry) and entry.get('etag') == etag and entry.get('prompt_version') == self.prompt_version
+
+    def filter_pending(self, input_keys: List[str], etags: Dict[str, str]) -> List[str]:
+        pending = [key for key in input_keys if not self.is_current(key, etags.get(key, ''))]
+        skipped = len(input_keys) - len(pending)
+        if skipped:
+            logger.info(f"Skipping {skipped} unchanged input(s) already recorded in {self.manifest_key}")
+        return pending
+
+    def iter_pending(self, objects: Iterable[dict]) -> Iterator[Tuple[str, dict]]:
+        """(key, object info) of the listed entries that still need processing, as the listing streams in."""
+        skipped = 0
+        for obj in objects:
+            info = object_info_from_listing(obj)
+            if self.is_current(obj['Key'], info['etag']):
+                skipped += 1
+                continue
+            yield obj['Key'], info
+        if skipped:
+            logger.info(f"Skipped {skipped} unchanged input(s) already recorded in {self.manifest_key}")
+
+    def record(self, input_key: str, etag: str, output_keys: List[str],
+               last_modified: Optional[str] = None) -> None:
+        with self.lock:
+            self.entries[input_key] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'prompt_version': self.prompt_version,
+                'outputs': output_keys,
+                'updated': datetime.now().isoformat(),
+            }
+
+    def save(self) -> None:
+        """
+        Write the manifest, leaving out inputs whose outputs the output sink has not stored yet.
+
+        Those are saved by a later save once their uploads finish; the stages save once
+        more after flushing the sink. An input whose output failed to upload stays out,
+        so the next run processes it again.
+        """
+        sink = get_output_sink()
+        # Held across the upload so concurrent savers cannot overwrite a newer snapshot with an older one
+        with self.lock:
+            entries = {
+                input_key: entry for input_key, entry in self.entries.items()
+                if all(sink.is_written(self.bucket_name, output_key) for output_key in entry.get('outputs', []))
+            }
+            payload = json.dumps({
+                'stage': self.stage_name,
+                'prompt_version': self.prompt_version,
+                'inputs': entries,
+            }, indent=2, sort_keys=True)
+            try:
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=self.manifest_key,
+                                          Body=payload.encode('utf-8'))
+            except ClientError as e:
+                logger.error(f"Error writing manifest {self.manifest_key}: {e}")
+
+def get_object_etag(s3_client, bucket_name: str, key: str) -> Optional[str]:
+    """ETag of an object written earlier in the same run, or None if it does not exist."""
+    try:
+        return s3_client.head_object(Bucket=bucket_name, Key=key).get('ETag', '')
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404', 'NotFound'):
+            return None
+        raise
@@ -0,0 +1,334 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from pipeline.tokens import flush_token_calibration
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the Prometheus histogram buckets for span durations
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Durations kept per series for percentiles; beyond this a uniform sample is kept
+MAX_SAMPLES = 10000
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('pipeline_span', default=None)
+
+def label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+def format_labels(key: LabelKey) -> str:
+    if not key:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class SpanSeries:
+    """Durations of one span name and label set: Prometheus buckets plus a sample for percentiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.samples: List[float] = []
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+
+    def observe(self, started: float, duration: float, error: bool) -> None:
+        self.count += 1
+        self.errors += int(error)
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = duration
+        self.first_start = started if self.first_start is None else min(self.first_start, started)
+        self.last_end = max(self.last_end or 0.0, started + duration)
+
+    def as_dict(self) -> dict:
+        ordered = sorted(self.samples)
+        wall = (self.last_end - self.first_start) if self.count else 0.0
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': round(self.total, 3),
+            'p50': round(percentile(ordered, 0.5), 3),
+            'p95': round(percentile(ordered, 0.95), 3),
+            'p99': round(percentile(ordered, 0.99), 3),
+            'max': round(self.maximum, 3),
+            'per_minute': round(self.count * 60 / wall, 2) if wall > 0 else None,
+        }
+
+class Span:
+    def __init__(self, name: str, labels: Dict[str, object], parent: Optional["Span"]):
+        self.name = name
+        self.labels = dict(labels)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.started = time.time()
+
+    def set(self, **labels) -> None:
+        """Add labels known only once the work is done, e.g. whether a response was a cache hit."""
+        self.labels.update(labels)
+
+class MetricsRegistry:
+    """
+    Counters and timed spans for one pipeline run, shared by every thread and stage.
+
+    Spans time a piece of work (a stage for one file, a Bedrock call, an S3 request)
+    and feed per name-and-label latency series; counters add up things like tokens,
+    retries and throttles. The registry can serve Prometheus text on a local port,
+    write it to a file for a textfile collector, append every finished span to a JSON
+    lines trace file, and log a per-run summary.
+    """
+
+    def __init__(self, metrics_file: Optional[str] = None, trace_file: Optional[str] = None,
+                 report_file: Optional[str] = None, port: Optional[int] = None):
+        self.metrics_file = metrics_file
+        self.trace_file = trace_file
+        self.report_file = report_file
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.spans: Dict[str, Dict[LabelKey, SpanSeries]] = {}
+        self.lock = threading.Lock()
+        self.trace_lock = threading.Lock()
+        self.server = None
+        if port:
+            self.serve(port)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not value:
+            return
+        key = label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def record_span(self, name: str, started: float, duration: float, status: str = 'ok',
+                    labels: Optional[Dict[str, object]] = None, span_id: Optional[str] = None,
+                    parent_id: Optional[str] = None) -> None:
+        """Record a finished span; `started` is a Unix timestamp."""
+        labels = labels or {}
+        with self.lock:
+            series = self.spans.setdefault(name, {}).setdefault(label_key(labels), SpanSeries())
+            series.observe(started, duration, status != 'ok')
+        if self.trace_file:
+            event = {
+                'run': self.run_id, 'span': span_id or uuid.uuid4().hex[:16], 'parent': parent_id,
+                'name': name, 'start': round(started, 6), 'duration': round(duration, 6), 'status': status,
+                'thread': threading.current_thread().name, 'labels': {key: str(value) for key, value in labels.items()},
+            }
+            with self.trace_lock:
+                with open(self.trace_file, 'a', encoding='utf-8') as trace:
+                    trace.write(json.dumps(event) + '\n')
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the enclosed block as span `name`; an exception marks it as an error and propagates."""
+        span = Span(name, labels, _current_span.get())
+        token = _current_span.set(span)
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            yield span
+        except BaseException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            self.record_span(name, span.started, time.monotonic() - started, status, span.labels,
+                             span.span_id, span.parent_id)
+
+    def current_span_id(self) -> Optional[str]:
+        span = _current_span.get()
+        return span.span_id if span is not None else None
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                metric = f"pipeline_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                lines.extend(f"{metric}{format_labels(key)} {value:g}" for key, value in sorted(series.items()))
+
+            lines.append("# TYPE pipeline_span_seconds histogram")
+            for name, series in sorted(self.spans.items()):
+                for key, values in sorted(series.items()):
+                    base = (('span', name),) + key
+                    for bound, count in zip(LATENCY_BUCKETS, values.buckets):
+                        lines.append(f"pipeline_span_seconds_bucket{format_labels(base + (('le', f'{bound:g}'),))} "
+                                     f"{count}")
+                    lines.append(f"pipeline_span_seconds_bucket{format_labels(base + (('le', '+Inf'),))} "
+                                 f"{values.count}")
+                    lines.append(f"pipeline_span_seconds_sum{format_labels(base)} {values.total:.6f}")
+                    lines.append(f"pipeline_span_seconds_count{format_labels(base)} {values.count}")
+
+            lines.append("# TYPE pipeline_span_errors_total counter")
+            for name, series in sorted(self.spans.items()):
+                for key, values in sorted(series.items()):
+                    lines.append(f"pipeline_span_errors_total{format_labels((('span', name),) + key)} {values.errors}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> None:
+        """Serve the Prometheus text format on http://host:port/metrics from a daemon thread."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                'run': self.run_id,
+                'wall_seconds': round(time.time() - self.started, 3),
+                'spans': {name: {format_labels(key): values.as_dict() for key, values in sorted(series.items())}
+                          for name, series in sorted(self.spans.items())},
+                'counters': {name: {format_labels(key): value for key, value in sorted(series.items())}
+                             for name, series in sorted(self.counters.items())},
+            }
+
+    def log_summary(self) -> None:
+        """Log the run summary and write the configured metrics and report files."""
+        report = self.summary()
+        if report['spans'] or report['counters']:
+            logger.info(f"Run {report['run']} metrics after {report['wall_seconds']:.1f}s:")
+            logger.info(f"  {'span':<64} {'count':>6} {'errors':>6} {'p50':>8} {'p95':>8} {'p99':>8} "
+                        f"{'max':>8} {'total':>9} {'/min':>7}")
+            for name, series in report['spans'].items():
+                for labels, values in series.items():
+                    per_minute = f"{values['per_minute']:.1f}" if values['per_minute'] is not None else '-'
+                    logger.info(f"  {name + labels:<64} {values['count']:>6} {values['errors']:>6} "
+                                f"{values['p50']:>8.2f} {values['p95']:>8.2f} {values['p99']:>8.2f} "
+                                f"{values['max']:>8.2f} {values['total_seconds']:>9.1f} {per_minute:>7}")
+            for name, series in report['counters'].items():
+                for labels, value in series.items():
+                    logger.info(f"  {name + labels:<64} {value:>g}")
+
+            # The stage with the most busy time is where extra workers or quota pay off first
+            stages = report['spans'].get('stage', {})
+            if stages:
+                labels, values = max(stages.items(), key=lambda item: item[1]['total_seconds'])
+                logger.info(f"Busiest stage: {labels} with {values['total_seconds']:.1f}s across "
+                            f"{values['count']} tasks")
+
+        if self.metrics_file:
+            with open(self.metrics_file, 'w', encoding='utf-8') as metrics:
+                metrics.write(self.prometheus_text())
+        if self.report_file:
+            with open(self.report_file, 'w', encoding='utf-8') as report_out:
+                json.dump(report, report_out, indent=2)
+
+    @classmethod
+    def from_env(cls) -> "MetricsRegistry":
+        port = os.environ.get('PIPELINE_METRICS_PORT')
+        return cls(
+            metrics_file=os.environ.get('PIPELINE_METRICS_FILE') or None,
+            trace_file=os.environ.get('PIPELINE_TRACE_FILE') or None,
+            report_file=os.environ.get('PIPELINE_METRICS_REPORT') or None,
+            port=int(port) if port else None,
+        )
+
+_metrics: Optional[MetricsRegistry] = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> MetricsRegistry:
+    """Process-wide metrics registry, created from PIPELINE_METRICS_* / PIPELINE_TRACE_FILE on first use."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry.from_env()
+        return _metrics
+
+def span(name: str, **labels):
+    return get_metrics().span(name, **labels)
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    get_metrics().inc(name, value, **labels)
+
+def log_metrics_summary() -> None:
+    # Every stage and the orchestrator end here, so this is where their token calibration is written
+    flush_token_calibration()
+    get_metrics().log_summary()
+
+def instrument_client(client) -> None:
+    """
+    Record every AWS API call made through `client` as an `aws_request` span.
+
+    Uses botocore's event hooks, so it covers every S3 and Bedrock call made through the
+    shared clients, including aiobotocore clients. Attempts (including botocore's own
+    retries) and S3 bytes read and written are counted as well.
+    """
+    events = client.meta.events
+    service = client.meta.service_model.service_name
+    metrics = get_metrics()
+
+    def before_call(model, params, context, **kwargs):
+        context['metrics_started'] = (time.time(), time.monotonic(), model.name)
+        body = params.get('body') if isinstance(params, dict) else None
+        if isinstance(body, (bytes, bytearray)):
+            metrics.inc('aws_bytes_total', len(body), service=service, operation=model.name, direction='sent')
+
+    def finish(context, status):
+        started = context.pop('metrics_started', None)
+        if started is not None:
+            metrics.record_span('aws_request', started[0], time.monotonic() - started[1], status,
+                                {'service': service, 'operation': started[2]},
+                                parent_id=metrics.current_span_id())
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        status_code = getattr(http_response, 'status_code', 200)
+        finish(context, 'ok' if status_code < 400 else parsed.get('Error', {}).get('Code', str(status_code)))
+        if status_code < 400 and isinstance(parsed.get('ContentLength'), int) and model.name == 'GetObject':
+            metrics.inc('aws_bytes_total', parsed['ContentLength'], service=service, operation=model.name,
+                        direction='received')
+
+    def after_call_error(exception, context, **kwargs):
+        finish(context, type(exception).__name__)
+
+    def before_send(**kwargs):
+        # Counts every HTTP attempt; attempts above the aws_request count are botocore retries
+        metrics.inc('aws_attempts_total', service=service)
+
+    events.register('before-call', before_call)
+    events.register('after-call', after_call)
+    events.register('after-call-error', after_call_error)
+    events.register('before-send', before_send)
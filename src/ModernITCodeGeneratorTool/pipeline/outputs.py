@@ -0,0 +1,202 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from pipeline.clients import get_client
+from pipeline.metrics import inc, span
+
+logger = logging.getLogger(__name__)
+
+# Outputs at least this large are uploaded in parts
+MULTIPART_THRESHOLD_BYTES = 16 * 1024 * 1024
+
+# S3 parts must be at least 5 MB, except the last one
+MULTIPART_PART_BYTES = 8 * 1024 * 1024
+
+OutputKey = Tuple[str, str]
+
+class OutputWriteError(Exception):
+    """Raised by OutputSink.wait_for when outputs a caller depends on could not be written."""
+
+class OutputSink:
+    """
+    Write-behind uploads of generated outputs, so model-call workers never wait on S3.
+
+    write() queues the content and returns at once; a pool of `max_workers` threads
+    uploads it, in parts once it reaches `multipart_threshold` bytes. At most
+    `max_queued` outputs wait or upload at a time; beyond that write() blocks, so a
+    slow bucket cannot pile generated text up in memory.
+
+    Writes of the same key are applied in order, and a write superseded before its
+    upload starts is skipped. Content still queued can be read back with
+    pending_text, and a failed upload is remembered until the key is written again,
+    so manifests never record an input whose outputs are not in S3. Each stage calls
+    flush() before it finishes.
+    """
+
+    def __init__(self, max_workers: int = 8, max_queued: int = 64,
+                 multipart_threshold: int = MULTIPART_THRESHOLD_BYTES, part_size: int = MULTIPART_PART_BYTES,
+                 s3_client=None):
+        self.max_workers = max(1, max_workers)
+        self.multipart_threshold = multipart_threshold
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.s3_client = s3_client
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='s3-output')
+        self.slots = threading.BoundedSemaphore(max(1, max_queued))
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.sequence = 0
+        # Per key: latest write's sequence number and content, writes not yet finished and their lock
+        self.latest: Dict[OutputKey, int] = {}
+        self.contents: Dict[OutputKey, bytes] = {}
+        self.pending: Dict[OutputKey, int] = {}
+        self.key_locks: Dict[OutputKey, threading.Lock] = {}
+        self.failed: Dict[OutputKey, str] = {}
+
+    def write(self, bucket_name: str, key: str, content: Union[str, bytes],
+              on_written: Optional[Callable[[], None]] = None) -> None:
+        """Queue `content` for s3://bucket_name/key; `on_written` runs once it is stored."""
+        data = content.encode('utf-8') if isinstance(content, str) else bytes(content)
+        if not self.slots.acquire(blocking=False):
+            inc('output_queue_full_total')
+            self.slots.acquire()
+        output_key = (bucket_name, key)
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            self.latest[output_key] = sequence
+            self.contents[output_key] = data
+            self.pending[output_key] = self.pending.get(output_key, 0) + 1
+            key_lock = self.key_locks.setdefault(output_key, threading.Lock())
+        try:
+            self.executor.submit(self._upload, output_key, sequence, data, key_lock, on_written)
+        except Exception:
+            self._finish(output_key, sequence, None)
+            self.slots.release()
+            raise
+
+    def _upload(self, output_key: OutputKey, sequence: int, data: bytes, key_lock: threading.Lock,
+                on_written: Optional[Callable[[], None]]) -> None:
+        bucket_name, key = output_key
+        error = None
+        try:
+            with key_lock:
+                with self.lock:
+                    superseded = self.latest[output_key] != sequence
+                if superseded:
+                    inc('output_writes_total', method='superseded')
+                    return
+                method = 'multipart' if len(data) >= self.multipart_threshold else 'put'
+                with span('output_write', method=method):
+                    s3_client = self.s3_client or get_client('s3')
+                    if method == 'multipart':
+                        self._multipart_upload(s3_client, bucket_name, key, data)
+                    else:
+                        s3_client.put_object(Bucket=bucket_name, Key=key, Body=data)
+                inc('output_writes_total', method=method)
+                logger.info(f"Successfully wrote to S3: {key} ({len(data)} bytes)")
+        except Exception as e:
+            error = str(e)
+            inc('output_writes_total', method='failed')
+            logger.error(f"Error writing {key} to S3: {error}")
+        else:
+            # Before the key stops being pending, so flush() also waits for the callback
+            if on_written is not None:
+                try:
+                    on_written()
+                except Exception as e:
+                    logger.error(f"Error after writing {key}: {e}")
+        finally:
+            self._finish(output_key, sequence, error)
+            self.slots.release()
+
+    def _multipart_upload(self, s3_client, bucket_name: str, key: str, data: bytes) -> None:
+        upload_id = s3_client.create_multipart_upload(Bucket=bucket_name, Key=key)['UploadId']
+        try:
+            parts = []
+            for number, start in enumerate(range(0, len(data), self.part_size), 1):
+                response = s3_client.upload_part(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                                 PartNumber=number, Body=data[start:start + self.part_size])
+                parts.append({'ETag': response['ETag'], 'PartNumber': number})
+            s3_client.complete_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id,
+                                                MultipartUpload={'Parts': parts})
+        except Exception:
+            try:
+                s3_client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logger.warning(f"Could not abort multipart upload of {key}: {e}")
+            raise
+
+    def _finish(self, output_key: OutputKey, sequence: int, error: Optional[str]) -> None:
+        with self.lock:
+            if self.latest.get(output_key) == sequence:
+                # The newest write decides whether the key is stored
+                if error is None:
+                    self.failed.pop(output_key, None)
+                else:
+                    self.failed[output_key] = error
+            self.pending[output_key] -= 1
+            if not self.pending[output_key]:
+                for entries in (self.pending, self.latest, self.contents, self.key_locks):
+                    entries.pop(output_key, None)
+                self.idle.notify_all()
+
+    def pending_text(self, bucket_name: str, key: str) -> Optional[str]:
+        """Text queued for a key whose upload has not finished, so a later step can read its own writes."""
+        with self.lock:
+            data = self.contents.get((bucket_name, key))
+        return data.decode('utf-8') if data is not None else None
+
+    def is_written(self, bucket_name: str, key: str) -> bool:
+        """False while a write of the key is queued or uploading, or if its last write failed."""
+        output_key = (bucket_name, key)
+        with self.lock:
+            return output_key not in self.pending and output_key not in self.failed
+
+    def wait_for(self, bucket_name: str, keys: Iterable[str]) -> None:
+        """Block until `keys` are uploaded, raising OutputWriteError for any that failed."""
+        output_keys = [(bucket_name, key) for key in keys]
+        with self.idle:
+            self.idle.wait_for(lambda: not any(output_key in self.pending for output_key in output_keys))
+            failed = [key for bucket_name, key in output_keys if (bucket_name, key) in self.failed]
+        if failed:
+            raise OutputWriteError(f"Failed to write {', '.join(failed)}")
+
+    def flush(self) -> List[str]:
+        """Wait for every queued output; returns the keys whose last write failed."""
+        with self.idle:
+            if self.pending:
+                logger.info(f"Waiting for {sum(self.pending.values())} queued output write(s)")
+            self.idle.wait_for(lambda: not self.pending)
+            failed = sorted(key for _, key in self.failed)
+        if failed:
+            logger.error(f"{len(failed)} output(s) could not be written: {', '.join(failed)}")
+        return failed
+
+    @classmethod
+    def from_env(cls) -> "OutputSink":
+        return cls(
+            max_workers=int(os.environ.get('PIPELINE_OUTPUT_WORKERS', '8')),
+            max_queued=int(os.environ.get('PIPELINE_OUTPUT_QUEUE', '64')),
+            multipart_threshold=int(float(os.environ.get('PIPELINE_MULTIPART_THRESHOLD_MB', '16')) * 1024 * 1024),
+            part_size=int(float(os.environ.get('PIPELINE_MULTIPART_PART_MB', '8')) * 1024 * 1024),
+        )
+
+_output_sink: Optional[OutputSink] = None
+_output_sink_lock = threading.Lock()
+
+def get_output_sink() -> OutputSink:
+    """Return the process-wide output sink, creating it from the environment on first use."""
+    global _output_sink
+    with _output_sink_lock:
+        if _output_sink is None:
+            _output_sink = OutputSink.from_env()
+        return _output_sink
+
+def flush_outputs() -> List[str]:
+    """Wait for the outputs queued so far in this process; a no-op if nothing was ever written."""
+    with _output_sink_lock:
+        sink = _output_sink
+    return sink.flush() if sink is not None else []
@@ -0,0 +1,408 @@
+import logging
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pipeline.bedrock import estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+# Strings, quoted identifiers and comments are matched whole so keywords inside them are ignored
+TOKEN_PATTERN = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>[nN]?[qQ]'(?:\[.*?\]|\{.*?\}|\(.*?\)|<.*?>|(?P<delimiter>\S).*?(?P=delimiter))'
+                |[nN]?'(?:[^']|'')*(?:'|\Z))
+    | (?P<word>"[^"]*"|[A-Za-z][A-Za-z0-9_$\#]*)
+    | (?P<other>\S)
+""", re.VERBOSE | re.DOTALL)
+
+SUBPROGRAM_KEYWORDS = ('PROCEDURE', 'FUNCTION')
+CREATE_MODIFIERS = ('OR', 'REPLACE', 'EDITIONABLE', 'NONEDITIONABLE', 'FORCE')
+# Leading keywords of spec declarations whose name is the following word
+NAMED_DECLARATION_KEYWORDS = ('TYPE', 'SUBTYPE', 'CURSOR')
+# Longer initial values are elided from signature summaries
+SUMMARY_VALUE_CHARS = 200
+# Characters of new lines that iter_plsql_units collects before splitting again
+UNIT_BUFFER_CHARS = 64 * 1024
+
+class Token:
+    def __init__(self, value: str, start: int, end: int):
+        self.value = value
+        self.start = start
+        self.end = end
+
+class PlsqlUnit:
+    """
+    A top-level piece of a PL/SQL source file.
+
+    `kind` is "declaration" (a subprogram signature ending in ';', as in a package spec),
+    "implementation" (a subprogram with its body) or "other" (package header, types,
+    variables, initialization section, END of the package, ...). Units partition the
+    source exactly: joining their text gives back the original file, with leading
+    comments attached to the unit they precede.
+    """
+
+    def __init__(self, kind: str, name: Optional[str], text: str):
+        self.kind = kind
+        self.name = name
+        self.text = text
+
+def tokenize(code: str) -> List[Token]:
+    """Structural tokens of PL/SQL source: words (upper-cased) and punctuation, without strings or comments."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(code):
+        if match.lastgroup == 'word':
+            value = match.group('word')
+            tokens.append(Token(value if value.startswith('"') else value.upper(), match.start(), match.end()))
+        elif match.lastgroup == 'other':
+            tokens.append(Token(match.group('other'), match.start(), match.end()))
+    return tokens
+
+def normalize_name(value: str) -> str:
+    return value.strip('"').upper()
+
+class UnitScanner:
+    """Finds where each top-level declaration, subprogram and statement ends in a token list."""
+
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+
+    def value(self, index: int) -> str:
+        return self.tokens[index].value if index < len(self.tokens) else ''
+
+    def statement_end(self, index: int) -> int:
+        """Index of the ';' ending the statement at `index`, consuming any block it contains."""
+        depth = 0
+        while index < len(self.tokens):
+            value = self.tokens[index].value
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+            elif depth == 0 and value == ';':
+                return index
+            elif depth == 0 and value == 'BEGIN':
+                return self.block_end(index)
+            index += 1
+        return len(self.tokens) - 1
+
+    def block_end(self, index: int) -> int:
+        """Index of the ';' after the END matching the BEGIN at `index`."""
+        depth = 0
+        while index < len(self.tokens):
+            value = self.tokens[index].value
+            if value in ('BEGIN', 'CASE'):
+                depth += 1
+            elif value == 'END':
+                following = self.value(index + 1)
+                if following in ('IF', 'LOOP'):
+                    index += 2
+                    continue
+                if following == 'CASE':
+                    index += 1
+                depth -= 1
+                if depth == 0:
+                    while index < len(self.tokens) and self.tokens[index].value != ';':
+                        index += 1
+                    return min(index, len(self.tokens) - 1)
+            index += 1
+        return len(self.tokens) - 1
+
+    def subprogram_end(self, index: int) -> Tuple[int, str, bool]:
+        """
+        Scan the PROCEDURE/FUNCTION at `index`.
+
+        Returns the index of its final ';', its name, and whether it is only a
+        declaration (no IS/AS body).
+        """
+        name_index = index + 1
+        if self.value(name_index + 1) == '.':
+            name_index += 2
+        name = normalize_name(self.value(name_index))
+
+        depth = 0
+        index = name_index + 1
+        while index < len(self.tokens):
+            value = self.tokens[index].value
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+            elif depth == 0 and value == ';':
+                return index, name, True
+            elif depth == 0 and value in ('IS', 'AS'):
+                break
+            index += 1
+
+        index += 1
+        if self.value(index) in ('LANGUAGE', 'EXTERNAL'):
+            return self.statement_end(index), name, False
+        # Declaration section, which may hold nested subprograms, then the executable block
+        while index < len(self.tokens):
+            value = self.tokens[index].value
+            if value in SUBPROGRAM_KEYWORDS:
+                index = self.subprogram_end(index)[0] + 1
+                continue
+            if value == 'BEGIN':
+                return self.block_end(index), name, False
+            index += 1
+        return len(self.tokens) - 1, name, False
+
+    def create_end(self, index: int) -> Tuple[int, Optional[str], str]:
+        """Scan a CREATE statement; a package/type header stops at its IS/AS so its members become units."""
+        keyword_index = index + 1
+        while self.value(keyword_index) in CREATE_MODIFIERS:
+            keyword_index += 1
+        if self.value(keyword_index) in SUBPROGRAM_KEYWORDS:
+            end, name, is_declaration = self.subprogram_end(keyword_index)
+            return end, name, 'declaration' if is_declaration else 'implementation'
+
+        index = keyword_index
+        while index < len(self.tokens):
+            value = self.tokens[index].value
+            if value in ('IS', 'AS', ';'):
+                return index, None, 'other'
+            if value in ('BEGIN', 'DECLARE'):
+                return self.statement_end(index), None, 'other'
+            index += 1
+        return len(self.tokens) - 1, None, 'other'
+
+def split_plsql_units(code: str) -> List[PlsqlUnit]:
+    """Split PL/SQL source into top-level units (see PlsqlUnit)."""
+    tokens = tokenize(code)
+    scanner = UnitScanner(tokens)
+    units = []
+    unit_start = 0
+    index = 0
+
+    while index < len(tokens):
+        value = tokens[index].value
+        name = None
+        kind = 'other'
+        if value in SUBPROGRAM_KEYWORDS:
+            end, name, is_declaration = scanner.subprogram_end(index)
+            kind = 'declaration' if is_declaration else 'implementation'
+        elif value == 'CREATE':
+            end, name, kind = scanner.create_end(index)
+        else:
+            end = scanner.statement_end(index)
+        # SQL*Plus statement terminator
+        if scanner.value(end + 1) == '/':
+            end += 1
+
+        unit_end = tokens[end].end
+        units.append(PlsqlUnit(kind, name, code[unit_start:unit_end]))
+        unit_start = unit_end
+        index = end + 1
+
+    if unit_start < len(code):
+        if units:
+            units[-1].text += code[unit_start:]
+        else:
+            units.append(PlsqlUnit('other', None, code[unit_start:]))
+    return units
+
+def iter_plsql_units(lines: Iterable[str], buffer_chars: int = UNIT_BUFFER_CHARS) -> Iterator[PlsqlUnit]:
+    """
+    The units split_plsql_units would return for the joined `lines`, yielded as the lines arrive.
+
+    Only the text after the last complete unit is kept and tokenized, so memory follows
+    the largest unit rather than the file, and a source streamed from S3 can be split
+    while it downloads.
+    """
+    buffer = ''
+    pending: List[str] = []
+    pending_chars = 0
+    for line in lines:
+        pending.append(line)
+        pending_chars += len(line)
+        # Waiting for as much new text as is buffered keeps a very long unit from being re-split per line
+        if pending_chars < max(buffer_chars, len(buffer)):
+            continue
+        buffer += ''.join(pending)
+        pending, pending_chars = [], 0
+        units = split_plsql_units(buffer)
+        # The last unit may still be incomplete; it is split again together with the lines that follow
+        yield from units[:-1]
+        buffer = units[-1].text if units else buffer
+    buffer += ''.join(pending)
+    if buffer:
+        yield from split_plsql_units(buffer)
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Lines of `text` with their line ends, without building a list of them."""
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        end = len(text) if end < 0 else end + 1
+        yield text[start:end]
+        start = end
+
+def group_units_by_name(pks_units: List[PlsqlUnit], pkb_units: List[PlsqlUnit]) -> List[Tuple[List[str], List[str]]]:
+    """
+    Pair each spec declaration with its body implementation by subprogram name.
+
+    Returns (spec parts, body parts) groups in body order. Non-subprogram units of
+    both files (package headers, types, globals, END) form the first group; every
+    overload of a name stays in the same group; spec-only and body-only names get
+    groups of their own.
+    """
+    context: Tuple[List[str], List[str]] = ([], [])
+    groups: Dict[str, Tuple[List[str], List[str]]] = {}
+
+    for unit in pkb_units:
+        if unit.name is None:
+            context[1].append(unit.text)
+        else:
+            groups.setdefault(unit.name, ([], []))[1].append(unit.text)
+    for unit in pks_units:
+        if unit.name is None:
+            context[0].append(unit.text)
+        else:
+            groups.setdefault(unit.name, ([], []))[0].append(unit.text)
+
+    return [context] + list(groups.values())
+
+def split_text_by_lines(text: str, token_budget: int) -> List[str]:
+    """Last resort for a single unit over the budget: cut it at line boundaries."""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_text_tokens(line)
+        if current and current_tokens + line_tokens > token_budget:
+            pieces.append(''.join(current))
+            current = []
+            current_tokens = 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        pieces.append(''.join(current))
+    return pieces
+
+def chunk_plsql_package(pks_code: str, pkb_code: str, token_budget: int) -> List[Tuple[str, str]]:
+    """
+    Split a package spec and body into (spec, body) chunks of at most `token_budget` estimated tokens.
+
+    Units are paired by subprogram name (group_units_by_name) and whole groups are
+    packed into chunks in order, so a declaration always travels with its
+    implementation. Only a group that alone exceeds the budget is split further.
+    """
+    pks_units = list(iter_plsql_units(iter_lines(pks_code)))
+    pkb_units = list(iter_plsql_units(iter_lines(pkb_code)))
+    groups = group_units_by_name(pks_units, pkb_units)
+
+    chunks: List[Tuple[str, str]] = []
+    current_pks: List[str] = []
+    current_pkb: List[str] = []
+    current_tokens = 0
+
+    def flush() -> None:
+        nonlocal current_pks, current_pkb, current_tokens
+        if current_pks or current_pkb:
+            chunks.append((''.join(current_pks), ''.join(current_pkb)))
+        current_pks, current_pkb, current_tokens = [], [], 0
+
+    for pks_parts, pkb_parts in groups:
+        group_tokens = sum(estimate_text_tokens(part) for part in pks_parts + pkb_parts)
+        if group_tokens == 0:
+            continue
+        if group_tokens > token_budget:
+            flush()
+            spec_text = ''.join(pks_parts)
+            body_pieces = split_text_by_lines(''.join(pkb_parts), max(1, token_budget - estimate_text_tokens(spec_text)))
+            for piece_number, body_piece in enumerate(body_pieces):
+                chunks.append((spec_text if piece_number == 0 else '', body_piece))
+            if not body_pieces:
+                chunks.extend((piece, '') for piece in split_text_by_lines(spec_text, token_budget))
+            continue
+        if current_tokens + group_tokens > token_budget:
+            flush()
+        current_pks.extend(pks_parts)
+        current_pkb.extend(pkb_parts)
+        current_tokens += group_tokens
+    flush()
+
+    logger.info(f"Split package into {len(chunks)} chunks from {len(pks_units)} spec and "
+                f"{len(pkb_units)} body units ({len(groups) - 1} named subprograms)")
+    return chunks or [(pks_code, pkb_code)]
+
+def strip_comments(code: str) -> str:
+    """`code` without comments; strings are left untouched."""
+    return TOKEN_PATTERN.sub(lambda match: '' if match.lastgroup == 'comment' else match.group(0), code)
+
+def package_name(code: str) -> Optional[str]:
+    """Name of the first package (or package body) created in `code`, upper-cased."""
+    tokens = tokenize(code)
+    for index, token in enumerate(tokens):
+        if token.value != 'CREATE':
+            continue
+        keyword_index = index + 1
+        while keyword_index < len(tokens) and tokens[keyword_index].value in CREATE_MODIFIERS:
+            keyword_index += 1
+        if keyword_index < len(tokens) and tokens[keyword_index].value == 'PACKAGE':
+            name_index = keyword_index + 1
+            if name_index < len(tokens) and tokens[name_index].value == 'BODY':
+                name_index += 1
+            # Schema-qualified names: OWNER.PACKAGE
+            if name_index + 2 < len(tokens) and tokens[name_index + 1].value == '.':
+                name_index += 2
+            if name_index < len(tokens):
+                return normalize_name(tokens[name_index].value)
+    return None
+
+def package_references(code: str, package_names: Iterable[str]) -> Dict[str, Set[str]]:
+    """Members of other packages that `code` refers to as PACKAGE.MEMBER, keyed by package name."""
+    known = set(package_names)
+    tokens = tokenize(code)
+    references: Dict[str, Set[str]] = {}
+    for index in range(len(tokens) - 2):
+        name = normalize_name(tokens[index].value)
+        if name in known and tokens[index + 1].value == '.':
+            references.setdefault(name, set()).add(normalize_name(tokens[index + 2].value))
+    return references
+
+def declared_name(unit: PlsqlUnit) -> Optional[str]:
+    """Name declared by a spec unit: a subprogram, type, cursor, constant, variable or exception."""
+    if unit.name is not None:
+        return unit.name
+    tokens = tokenize(unit.text)
+    if not tokens:
+        return None
+    if tokens[0].value in NAMED_DECLARATION_KEYWORDS and len(tokens) > 1:
+        return normalize_name(tokens[1].value)
+    first = tokens[0].value
+    if first in ('CREATE', 'DROP', 'END', 'PRAGMA') or not (first[0].isalpha() or first.startswith('"')):
+        return None
+    return normalize_name(first)
+
+def spec_signature_summary(pks_code: str, members: Optional[Set[str]] = None) -> str:
+    """
+    Compact interface of a package spec: its declarations without comments, one per line.
+
+    With `members`, only the declarations of those names are kept, so a dependent
+    package's prompt carries just the parts of the spec it actually uses.
+    """
+    name = package_name(pks_code) or 'UNKNOWN'
+    declarations = []
+    for unit in split_plsql_units(pks_code):
+        unit_name = declared_name(unit)
+        if unit_name not in (None, name):
+            text = ' '.join(strip_comments(unit.text).split())
+            # Signatures matter to a caller, large initial values (data tables) do not
+            if unit.kind == 'other' and len(text) > SUMMARY_VALUE_CHARS and ':=' in text:
+                text = text[:text.index(':=')] + ':= ...;'
+            declarations.append((unit_name, text, {normalize_name(token.value) for token in tokenize(text)}))
+
+    if members is not None:
+        # Also keep the package's own types and constants that the kept declarations use
+        declared = {unit_name for unit_name, _, _ in declarations}
+        members = set(members)
+        while True:
+            used = set().union(*(words for unit_name, _, words in declarations if unit_name in members)) & declared
+            if used <= members:
+                break
+            members |= used
+        declarations = [declaration for declaration in declarations if declaration[0] in members]
+
+    lines = [f"PACKAGE {name} IS"] + [f"  {text}" for _, text, _ in declarations] + [f"END {name};"]
+    return '\n'.join(lines)
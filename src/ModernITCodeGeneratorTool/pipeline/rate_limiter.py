@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from pipeline.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` units per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def set_rate(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+class AdaptiveRateLimiter:
+    """
+    Client-side limiter for requests/sec and tokens/min shared by every Bedrock caller.
+
+    The effective rate is a fraction of the configured maximum. Each ThrottlingException
+    cuts the fraction multiplicatively (at most once per cooldown window, so a burst of
+    concurrent throttles counts once) and empties both buckets; each successful call
+    raises it additively until the configured maximum is reached again.
+    """
+
+    def __init__(self, max_requests_per_second: float, max_tokens_per_minute: float,
+                 max_in_flight: int, min_fraction: float = 0.05, increase_step: float = 0.02,
+                 decrease_factor: float = 0.5, throttle_cooldown: float = 2.0, name: str = "Bedrock"):
+        self.max_requests_per_second = max_requests_per_second
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.min_fraction = min_fraction
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.throttle_cooldown = throttle_cooldown
+        self.name = name
+
+        self.fraction = 1.0
+        self.throttle_count = 0
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.request_bucket = TokenBucket(max_requests_per_second, max(1.0, max_requests_per_second))
+        self.token_bucket = TokenBucket(max_tokens_per_minute / 60.0, max_tokens_per_minute)
+
+    def _apply_fraction(self) -> None:
+        rps = self.max_requests_per_second * self.fraction
+        tpm = self.max_tokens_per_minute * self.fraction
+        self.request_bucket.set_rate(rps, max(1.0, rps))
+        self.token_bucket.set_rate(tpm / 60.0, tpm)
+
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        """Take one request and `estimated_tokens` tokens if available; otherwise return how long to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.request_bucket.refill(now)
+            self.token_bucket.refill(now)
+            tokens = min(float(estimated_tokens), self.token_bucket.capacity)
+            delay = max(self.request_bucket.wait_time(1.0), self.token_bucket.wait_time(tokens))
+            if delay <= 0:
+                self.request_bucket.tokens -= 1.0
+                self.token_bucket.tokens -= tokens
+            return delay
+
+    def acquire(self, estimated_tokens: int = 0) -> None:
+        """Block until one request and `estimated_tokens` tokens are available, then take them."""
+        while True:
+            delay = self.reserve(estimated_tokens)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    async def acquire_async(self, estimated_tokens: int = 0) -> None:
+        """Like acquire, but waits with asyncio.sleep so the event loop keeps serving other requests."""
+        while True:
+            delay = self.reserve(estimated_tokens)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    @contextmanager
+    def slot(self, estimated_tokens: int = 0):
+        """Hold one of the in-flight request slots for the duration of a model call."""
+        started, waiting = time.time(), time.monotonic()
+        with self.in_flight:
+            self.acquire(estimated_tokens)
+            get_metrics().record_span('rate_limit_wait', started, time.monotonic() - waiting,
+                                      labels={'limiter': self.name})
+            yield
+
+    def record_success(self, extra_tokens: int = 0) -> None:
+        """Charge tokens only known after the call (e.g. output tokens) and recover the rate."""
+        with self.lock:
+            if extra_tokens > 0:
+                self.token_bucket.tokens -= extra_tokens
+            if self.fraction < 1.0:
+                self.fraction = min(1.0, self.fraction + self.increase_step)
+                self._apply_fraction()
+
+    def record_throttle(self) -> None:
+        with self.lock:
+            self.throttle_count += 1
+            now = time.monotonic()
+            if now - self.last_decrease < self.throttle_cooldown:
+                return
+            self.last_decrease = now
+            self.fraction = max(self.min_fraction, self.fraction * self.decrease_factor)
+            self._apply_fraction()
+            self.request_bucket.tokens = 0.0
+            self.token_bucket.tokens = min(self.token_bucket.tokens, 0.0)
+            logger.warning(
+                f"{self.name} throttled (total {self.throttle_count}); reducing rate to "
+                f"{self.request_bucket.rate:.2f} requests/sec and {self.token_bucket.rate * 60:.0f} tokens/min"
+            )
+
+    @classmethod
+    def from_env(cls, name: str = "Bedrock") -> "AdaptiveRateLimiter":
+        return cls(
+            max_requests_per_second=float(os.environ.get('BEDROCK_MAX_REQUESTS_PER_SECOND', '0.8')),
+            max_tokens_per_minute=float(os.environ.get('BEDROCK_MAX_TOKENS_PER_MINUTE', '400000')),
+            max_in_flight=int(os.environ.get('BEDROCK_MAX_IN_FLIGHT', '8')),
+            name=name,
+        )
+
+_rate_limiters: Dict[tuple, AdaptiveRateLimiter] = {}
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter(model_id: Optional[str] = None, region_name: Optional[str] = None) -> AdaptiveRateLimiter:
+    """
+    Return the process-wide limiter of a model and region, creating it from the environment on first use.
+
+    Bedrock quotas apply per model and region, so each pair is paced on its own and a
+    throttled model does not slow calls to another one.
+    """
+    with _rate_limiter_lock:
+        limiter = _rate_limiters.get((model_id, region_name))
+        if limiter is None:
+            name = ' '.join(part for part in (model_id, region_name) if part) or "Bedrock"
+            limiter = _rate_limiters[(model_id, region_name)] = AdaptiveRateLimiter.from_env(name)
+        return limiter
@@ -0,0 +1,334 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from pipeline import bedrock, metrics
+from pipeline.clients import client_region, get_client
+
+logger = logging.getLogger(__name__)
+
+# Candidates of each tier in fallback order; a candidate is "model_id" or "model_id@region"
+DEFAULT_TIERS = {
+    'large': ['anthropic.claude-3-5-sonnet-20240620-v1:0'],
+    'small': ['anthropic.claude-3-haiku-20240307-v1:0', 'anthropic.claude-3-5-sonnet-20240620-v1:0'],
+}
+
+# Route names are "<stage>" or "<stage>.<prompt type>"; a route without an entry uses its stage's
+DEFAULT_ROUTES = {
+    'knowledge_base': 'large',
+    'source': 'large',
+    'docs': 'small',
+    'epics': 'small',
+    'unit_tests': 'small',
+}
+
+DEFAULT_TIER = 'large'
+
+# On-demand USD prices per 1,000 input and output tokens, matched against the end of the model id
+MODEL_PRICES = {
+    'anthropic.claude-3-5-sonnet-20240620-v1:0': (0.003, 0.015),
+    'anthropic.claude-3-5-sonnet-20241022-v2:0': (0.003, 0.015),
+    'anthropic.claude-3-7-sonnet-20250219-v1:0': (0.003, 0.015),
+    'anthropic.claude-3-5-haiku-20241022-v1:0': (0.0008, 0.004),
+    'anthropic.claude-3-haiku-20240307-v1:0': (0.00025, 0.00125),
+}
+
+# Prompt cache reads and writes are billed as these multiples of the input token price
+CACHE_READ_PRICE_FACTOR = 0.1
+CACHE_WRITE_PRICE_FACTOR = 1.25
+
+class ModelCandidate:
+    def __init__(self, model_id: str, region_name: Optional[str] = None):
+        self.model_id = model_id
+        self.region_name = region_name
+
+    @classmethod
+    def parse(cls, value: str) -> "ModelCandidate":
+        model_id, _, region_name = value.strip().partition('@')
+        return cls(model_id, region_name or None)
+
+    def __str__(self) -> str:
+        return f"{self.model_id}@{self.region_name}" if self.region_name else self.model_id
+
+def get_model_price(model_id: str) -> Optional[tuple]:
+    for priced_model_id, price in MODEL_PRICES.items():
+        # Cross-region inference profiles prefix the model id, e.g. "us.anthropic..."
+        if model_id.endswith(priced_model_id):
+            return price
+    return None
+
+class TokenUsage:
+    """Token counts of one response; input_tokens excludes tokens read from or written to the prompt cache."""
+
+    def __init__(self, input_tokens: int = 0, output_tokens: int = 0, cache_read_tokens: int = 0,
+                 cache_write_tokens: int = 0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_read_tokens = cache_read_tokens
+        self.cache_write_tokens = cache_write_tokens
+
+    @classmethod
+    def from_response(cls, response: dict) -> "TokenUsage":
+        """Usage of an invoke_model or streaming response, 0 when unknown."""
+        metadata = response.get('ResponseMetadata', {})
+        if 'StreamMetrics' in metadata:
+            metrics = metadata['StreamMetrics']
+            return cls(metrics['input_tokens'], metrics['output_tokens'],
+                       metrics.get('cache_read_input_tokens', 0), metrics.get('cache_write_input_tokens', 0))
+        return cls(bedrock.get_input_token_count(response), bedrock.get_output_token_count(response),
+                   bedrock.get_cache_read_token_count(response), bedrock.get_cache_write_token_count(response))
+
+    @classmethod
+    def from_body(cls, response_body: dict) -> "TokenUsage":
+        """Usage from the `usage` object of a decoded messages response."""
+        usage = response_body.get('usage', {})
+        return cls(usage.get('input_tokens', 0), usage.get('output_tokens', 0),
+                   usage.get('cache_read_input_tokens', 0), usage.get('cache_creation_input_tokens', 0))
+
+class RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.throttles = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.cost = 0.0
+        self.cache_savings = 0.0
+        self.models: Dict[str, int] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'cache_hits': self.cache_hits,
+            'throttles': self.throttles,
+            'fallbacks': self.fallbacks,
+            'errors': self.errors,
+            'average_latency': round(self.latency / (self.calls - self.cache_hits), 3)
+                               if self.calls > self.cache_hits else 0.0,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_read_tokens': self.cache_read_tokens,
+            'cache_write_tokens': self.cache_write_tokens,
+            'cost_usd': round(self.cost, 4),
+            'cache_savings_usd': round(self.cache_savings, 4),
+            'models': dict(self.models),
+        }
+
+class ModelRouter:
+    """
+    Maps each stage and prompt type to a model tier, with fallback on throttling.
+
+    A tier is an ordered list of candidates (a model id, optionally pinned to a region).
+    A call goes to the first candidate; when it is throttled, the same call moves on to
+    the next one instead of waiting, and only the last candidate's throttle is raised to
+    the caller's retry loop. Every model and region has its own rate limiter (see
+    get_rate_limiter), so a cheap tier does not draw on the large model's quota.
+    Latency, tokens and on-demand cost are accumulated per route.
+    """
+
+    def __init__(self, tiers: Dict[str, List[str]], routes: Dict[str, str], default_tier: str = DEFAULT_TIER):
+        self.tiers = {name: [ModelCandidate.parse(value) for value in values] for name, values in tiers.items()}
+        self.routes = routes
+        self.default_tier = default_tier
+        self.stats: Dict[str, RouteStats] = {}
+        self.lock = threading.Lock()
+
+    def tier_for(self, route: str) -> str:
+        parts = route.split('.')
+        for length in range(len(parts), 0, -1):
+            tier = self.routes.get('.'.join(parts[:length]))
+            if tier:
+                return tier
+        return self.default_tier
+
+    def candidates(self, route: str) -> List[ModelCandidate]:
+        tier = self.tier_for(route)
+        if tier not in self.tiers:
+            raise ValueError(f"Route {route} uses unknown model tier {tier}")
+        return self.tiers[tier]
+
+    def primary_model(self, route: str) -> str:
+        return self.candidates(route)[0].model_id
+
+    def client_for(self, bedrock_client, candidate: ModelCandidate):
+        if candidate.region_name is None or candidate.region_name == client_region(bedrock_client):
+            return bedrock_client
+        return get_client('bedrock-runtime', candidate.region_name)
+
+    def _route_stats(self, route: str) -> RouteStats:
+        stats = self.stats.get(route)
+        if stats is None:
+            stats = self.stats[route] = RouteStats()
+        return stats
+
+    def record_throttle(self, route: str, fell_back: bool) -> None:
+        with self.lock:
+            stats = self._route_stats(route)
+            stats.throttles += 1
+            if fell_back:
+                stats.fallbacks += 1
+        metrics.inc('bedrock_throttles_total', route=route)
+
+    def record_error(self, route: str) -> None:
+        with self.lock:
+            self._route_stats(route).errors += 1
+        metrics.inc('bedrock_errors_total', route=route)
+
+    def record_success(self, route: str, candidate: ModelCandidate, latency: float, usage: TokenUsage,
+                       cache_hit: bool) -> None:
+        """
+        Record a successful call on `route`.
+
+        `cache_hit` means the response came from the local response cache and cost
+        nothing. Prompt cache savings are what the tokens read from the provider's prompt
+        cache would have cost at the full input price, less the cache write surcharge.
+        """
+        if cache_hit:
+            metrics.inc('bedrock_response_cache_hits_total', route=route)
+        else:
+            for kind, tokens in (('input', usage.input_tokens), ('output', usage.output_tokens),
+                                 ('cache_read', usage.cache_read_tokens), ('cache_write', usage.cache_write_tokens)):
+                metrics.inc('bedrock_tokens_total', tokens, route=route, model=candidate.model_id, kind=kind)
+        with self.lock:
+            stats = self._route_stats(route)
+            stats.calls += 1
+            stats.models[str(candidate)] = stats.models.get(str(candidate), 0) + 1
+            if cache_hit:
+                stats.cache_hits += 1
+                return
+            stats.latency += latency
+            stats.input_tokens += usage.input_tokens
+            stats.output_tokens += usage.output_tokens
+            stats.cache_read_tokens += usage.cache_read_tokens
+            stats.cache_write_tokens += usage.cache_write_tokens
+            price = get_model_price(candidate.model_id)
+            if price:
+                input_price = price[0] / 1000
+                stats.cost += (usage.input_tokens * input_price + usage.output_tokens * price[1] / 1000
+                               + usage.cache_read_tokens * input_price * CACHE_READ_PRICE_FACTOR
+                               + usage.cache_write_tokens * input_price * CACHE_WRITE_PRICE_FACTOR)
+                stats.cache_savings += (usage.cache_read_tokens * input_price * (1 - CACHE_READ_PRICE_FACTOR)
+                                        - usage.cache_write_tokens * input_price * (CACHE_WRITE_PRICE_FACTOR - 1))
+
+    def handle_error(self, route: str, candidates: List[ModelCandidate], index: int, error: ClientError) -> None:
+        """Record a failed call on `route`; re-raise it unless it is a throttle with a candidate left to try."""
+        has_fallback = index < len(candidates) - 1
+        if error.response['Error'].get('Code') != 'ThrottlingException':
+            self.record_error(route)
+            raise error
+        self.record_throttle(route, has_fallback)
+        if not has_fallback:
+            raise error
+        logger.warning(f"Route {route}: {candidates[index]} throttled; falling back to {candidates[index + 1]}")
+
+    def invoke(self, bedrock_client, body: str, route: str, invoke=None) -> dict:
+        """
+        Send `body` on `route`, falling back through the route's candidates on throttling.
+
+        `invoke(client, body, model_id)` performs one call; it defaults to
+        pipeline.bedrock.invoke_model. Other errors are raised unchanged.
+        """
+        invoke = invoke or bedrock.invoke_model
+        candidates = self.candidates(route)
+        for index, candidate in enumerate(candidates):
+            started = time.monotonic()
+            try:
+                with metrics.span('bedrock_invoke', route=route, model=candidate.model_id) as span:
+                    response = invoke(self.client_for(bedrock_client, candidate), body, candidate.model_id)
+                    cache_hit = response.get('ResponseMetadata', {}).get('CacheHit', False)
+                    span.set(cache='hit' if cache_hit else 'miss')
+            except ClientError as e:
+                self.handle_error(route, candidates, index, e)
+                continue
+            self.record_success(route, candidate, time.monotonic() - started, TokenUsage.from_response(response),
+                                cache_hit)
+            return response
+
+    def summary(self) -> Dict[str, dict]:
+        with self.lock:
+            return {route: stats.as_dict() for route, stats in sorted(self.stats.items())}
+
+    def log_summary(self) -> None:
+        summary = self.summary()
+        if not summary:
+            return
+        logger.info("Bedrock usage by route:")
+        for route, stats in summary.items():
+            logger.info(f"  {route} ({self.tier_for(route)}): {stats['calls']} calls "
+                        f"({stats['cache_hits']} cached), {stats['throttles']} throttles, "
+                        f"{stats['fallbacks']} fallbacks, {stats['average_latency']:.2f}s average latency, "
+                        f"{stats['input_tokens']} input / {stats['output_tokens']} output tokens, "
+                        f"${stats['cost_usd']:.4f}")
+        logger.info(f"  total: ${sum(stats['cost_usd'] for stats in summary.values()):.4f}")
+
+        for stage, cache_stats in self.prompt_cache_summary().items():
+            logger.info(f"Prompt cache for {stage}: {cache_stats['cache_read_tokens']} input tokens read from "
+                        f"the cache, {cache_stats['cache_write_tokens']} written, "
+                        f"saving ${cache_stats['cache_savings_usd']:.4f}")
+
+    def prompt_cache_summary(self) -> Dict[str, dict]:
+        """Prompt cache reads, writes and savings per stage (the first part of the route name)."""
+        stages: Dict[str, dict] = {}
+        for route, stats in self.summary().items():
+            if not stats['cache_read_tokens'] and not stats['cache_write_tokens']:
+                continue
+            stage = stages.setdefault(route.split('.')[0],
+                                      {'cache_read_tokens': 0, 'cache_write_tokens': 0, 'cache_savings_usd': 0.0})
+            stage['cache_read_tokens'] += stats['cache_read_tokens']
+            stage['cache_write_tokens'] += stats['cache_write_tokens']
+            stage['cache_savings_usd'] = round(stage['cache_savings_usd'] + stats['cache_savings_usd'], 4)
+        return stages
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        Tiers and routes from the environment, on top of the defaults.
+
+        BEDROCK_MODEL_TIER_<TIER> is a comma-separated candidate list, e.g.
+        BEDROCK_MODEL_TIER_SMALL="anthropic.claude-3-haiku-20240307-v1:0,anthropic.claude-3-haiku-20240307-v1:0@us-west-2".
+        BEDROCK_ROUTE_<ROUTE> picks the tier of a route, with dots written as double
+        underscores, e.g. BEDROCK_ROUTE_UNIT_TESTS__FUNCTIONAL=large.
+        BEDROCK_ROUTING_FILE may name a JSON file with "tiers" and "routes" objects.
+        """
+        tiers = dict(DEFAULT_TIERS)
+        routes = dict(DEFAULT_ROUTES)
+        routing_file = os.environ.get('BEDROCK_ROUTING_FILE')
+        if routing_file:
+            with open(os.path.expanduser(routing_file), 'r', encoding='utf-8') as config_file:
+                config = json.load(config_file)
+            tiers.update(config.get('tiers', {}))
+            routes.update(config.get('routes', {}))
+        for name, value in os.environ.items():
+            if name.startswith('BEDROCK_MODEL_TIER_') and value:
+                tiers[name[len('BEDROCK_MODEL_TIER_'):].lower()] = [part for part in value.split(',') if part.strip()]
+            elif name.startswith('BEDROCK_ROUTE_') and value:
+                routes[name[len('BEDROCK_ROUTE_'):].lower().replace('__', '.')] = value.lower()
+        return cls(tiers, routes, os.environ.get('BEDROCK_DEFAULT_TIER', DEFAULT_TIER))
+
+_model_router: Optional[ModelRouter] = None
+_model_router_lock = threading.Lock()
+
+def get_model_router() -> ModelRouter:
+    """Return the process-wide router, creating it from the environment on first use."""
+    global _model_router
+    with _model_router_lock:
+        if _model_router is None:
+            _model_router = ModelRouter.from_env()
+        return _model_router
+
+def invoke_routed(bedrock_client, body: str, route: str, invoke=None) -> dict:
+    """pipeline.bedrock.invoke_model for the model tier of `route` (see ModelRouter.invoke)."""
+    return get_model_router().invoke(bedrock_client, body, route, invoke)
+
+def log_route_summary() -> None:
+    get_model_router().log_summary()
@@ -0,0 +1,569 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from pipeline.storage import ListObjectsPaginator, MemoryStorage, ObjectBody, ObjectStorage
+
+logger = logging.getLogger(__name__)
+
+TOO_MANY_TOKENS_MESSAGE = "Too many tokens, please wait before trying again."
+TOO_MANY_REQUESTS_MESSAGE = "Too many requests, please wait before trying again."
+INPUT_TOO_LONG_MESSAGE = "Input is too long for requested model."
+
+def client_error(code: str, message: str, status_code: int, operation_name: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status_code}}, operation_name)
+
+class LatencyDistribution:
+    """
+    Seconds (or token counts) drawn from a distribution given as a short spec string.
+
+    "0.5" is a constant, "uniform:0.2:1.5" uniform between two bounds,
+    "lognormal:2.0:0.5" log-normal with median 2.0 and sigma 0.5, and
+    "exponential:1.0" exponential with mean 1.0.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = str(spec)
+        kind, _, arguments = self.spec.partition(':')
+        if not arguments:
+            kind, arguments = 'constant', kind
+        self.kind = kind
+        self.arguments = [float(argument) for argument in arguments.split(':')]
+        if self.kind not in ('constant', 'uniform', 'lognormal', 'exponential'):
+            raise ValueError(f"Unknown distribution '{self.kind}' in '{self.spec}'")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'constant':
+            return self.arguments[0]
+        if self.kind == 'uniform':
+            return rng.uniform(self.arguments[0], self.arguments[1])
+        if self.kind == 'lognormal':
+            return rng.lognormvariate(math.log(self.arguments[0]), self.arguments[1])
+        return rng.expovariate(1.0 / self.arguments[0])
+
+class SimulatorConfig:
+    """
+    Behaviour of the simulated Bedrock and S3 services.
+
+    Latency of a model call is `first_token_latency` plus the uncached input and the
+    output tokens times their per-token costs. Faults are drawn per request from a
+    random generator seeded with `seed` and the request itself, so a request gets the
+    same outcome on every run regardless of thread scheduling; only the per-minute
+    quotas depend on timing, as they do on the real service.
+    """
+
+    def __init__(self, seed: int = 0,
+                 first_token_latency: str = '0.05',
+                 seconds_per_output_token: float = 0.0,
+                 seconds_per_input_token: float = 0.0,
+                 output_tokens: str = 'uniform:200:800',
+                 chars_per_token: float = 4.0,
+                 throttle_rate: float = 0.0,
+                 too_many_tokens_rate: float = 0.0,
+                 server_error_rate: float = 0.0,
+                 max_input_tokens: int = 200000,
+                 requests_per_minute: int = 0,
+                 tokens_per_minute: int = 0,
+                 s3_latency: str = '0.005',
+                 s3_bytes_per_second: float = 0.0,
+                 batch_job_seconds: float = 0.0,
+                 prompt_caching: bool = True):
+        self.seed = seed
+        self.first_token_latency = LatencyDistribution(first_token_latency)
+        self.seconds_per_output_token = seconds_per_output_token
+        self.seconds_per_input_token = seconds_per_input_token
+        self.output_tokens = LatencyDistribution(output_tokens)
+        self.chars_per_token = chars_per_token
+        self.throttle_rate = throttle_rate
+        self.too_many_tokens_rate = too_many_tokens_rate
+        self.server_error_rate = server_error_rate
+        self.max_input_tokens = max_input_tokens
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.s3_latency = LatencyDistribution(s3_latency)
+        self.s3_bytes_per_second = s3_bytes_per_second
+        self.batch_job_seconds = batch_job_seconds
+        self.prompt_caching = prompt_caching
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "SimulatorConfig":
+        return cls(**values)
+
+class SimulatorStats:
+    """What the simulator did, to check a benchmark against the faults it was configured with."""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(sorted(self.counts.items()))
+
+class SimulatedEvents:
+    """The part of botocore's event emitter that pipeline.metrics.instrument_client uses."""
+
+    def __init__(self):
+        self.handlers: List[Tuple[str, object]] = []
+
+    def register(self, event_name: str, handler, **kwargs) -> None:
+        self.handlers.append((event_name, handler))
+
+    def emit(self, event_name: str, **kwargs) -> None:
+        for prefix, handler in list(self.handlers):
+            if event_name == prefix or event_name.startswith(prefix + '.'):
+                handler(event_name=event_name, **kwargs)
+
+class SimulatedOperation:
+    def __init__(self, name: str):
+        self.name = name
+
+class SimulatedHttpResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+class SimulatedMeta:
+    def __init__(self, service_name: str, region_name: str):
+        self.events = SimulatedEvents()
+        self.region_name = region_name
+        self.service_model = type('ServiceModel', (), {'service_name': service_name})()
+
+class SimulatedClient:
+    """Base for simulated clients: every API call emits the botocore events a real client would."""
+
+    service_name = ''
+
+    def __init__(self, config: SimulatorConfig, stats: SimulatorStats, region_name: str = 'us-east-1'):
+        self.config = config
+        self.stats = stats
+        self.meta = SimulatedMeta(self.service_name, region_name)
+        self.lock = threading.Lock()
+
+    def _call(self, operation_name: str, function, params: dict):
+        event_suffix = f"{self.service_name}.{operation_name}"
+        operation = SimulatedOperation(operation_name)
+        context = {}
+        body = params.get('Body', params.get('body'))
+        self.meta.events.emit(f'before-call.{event_suffix}', model=operation, context=context,
+                              params={'body': body if isinstance(body, (bytes, bytearray)) else None})
+        self.meta.events.emit(f'before-send.{event_suffix}', request=None)
+        try:
+            response = function(**params)
+        except ClientError as e:
+            self.meta.events.emit(f'after-call.{event_suffix}', model=operation, context=context,
+                                  http_response=SimulatedHttpResponse(
+                                      e.response['ResponseMetadata']['HTTPStatusCode']),
+                                  parsed=e.response)
+            raise
+        except Exception as e:
+            self.meta.events.emit(f'after-call-error.{event_suffix}', exception=e, context=context)
+            raise
+        self.meta.events.emit(f'after-call.{event_suffix}', model=operation, context=context,
+                              http_response=SimulatedHttpResponse(200), parsed=response)
+        return response
+
+    def request_rng(self, *parts: str) -> random.Random:
+        return random.Random(hashlib.sha256(':'.join((str(self.config.seed),) + parts).encode('utf-8')).digest())
+
+class SimulatedS3(SimulatedClient):
+    """S3 latency, fault injection and request counts over the storage backend shared by the session."""
+
+    service_name = 's3'
+
+    def __init__(self, config: SimulatorConfig, stats: SimulatorStats, storage: ObjectStorage,
+                 region_name: str = 'us-east-1'):
+        super().__init__(config, stats, region_name)
+        self.storage = storage
+
+    def _latency(self, key: str, size: int = 0) -> None:
+        delay = self.config.s3_latency.sample(self.request_rng('s3', key, str(time.monotonic_ns())))
+        if self.config.s3_bytes_per_second > 0:
+            delay += size / self.config.s3_bytes_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+    def _get(self, Bucket: str, Key: str, **kwargs) -> dict:
+        try:
+            response = self.storage.get_object(Bucket=Bucket, Key=Key, **kwargs)
+        except ClientError:
+            self._latency(Key)
+            raise
+        self._latency(Key, response['ContentLength'])
+        self.stats.add('s3_get')
+        return response
+
+    def _put(self, Bucket: str, Key: str, Body=b'', **kwargs) -> dict:
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        self._latency(Key, len(data))
+        response = self.storage.put_object(Bucket=Bucket, Key=Key, Body=data)
+        self.stats.add('s3_put')
+        return response
+
+    def _create_multipart(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._latency(Key)
+        return self.storage.create_multipart_upload(Bucket=Bucket, Key=Key)
+
+    def _upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body=b'', **kwargs) -> dict:
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        self._latency(Key, len(data))
+        response = self.storage.upload_part(Bucket=Bucket, Key=Key, UploadId=UploadId, PartNumber=PartNumber,
+                                            Body=data)
+        self.stats.add('s3_upload_part')
+        return response
+
+    def _complete_multipart(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs) -> dict:
+        self._latency(Key)
+        response = self.storage.complete_multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId,
+                                                          MultipartUpload=MultipartUpload)
+        self.stats.add('s3_put')
+        return response
+
+    def _abort_multipart(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        self._latency(Key)
+        return self.storage.abort_multipart_upload(Bucket=Bucket, Key=Key, UploadId=UploadId)
+
+    def _head(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._latency(Key)
+        return self.storage.head_object(Bucket=Bucket, Key=Key)
+
+    def _delete(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._latency(Key)
+        return self.storage.delete_object(Bucket=Bucket, Key=Key)
+
+    def _list(self, Bucket: str, Prefix: str = '', **kwargs) -> dict:
+        self._latency(Prefix)
+        return self.storage.list_objects_v2(Bucket=Bucket, Prefix=Prefix, **kwargs)
+
+    def get_object(self, **kwargs) -> dict:
+        return self._call('GetObject', self._get, kwargs)
+
+    def put_object(self, **kwargs) -> dict:
+        return self._call('PutObject', self._put, kwargs)
+
+    def head_object(self, **kwargs) -> dict:
+        return self._call('HeadObject', self._head, kwargs)
+
+    def delete_object(self, **kwargs) -> dict:
+        return self._call('DeleteObject', self._delete, kwargs)
+
+    def list_objects_v2(self, **kwargs) -> dict:
+        return self._call('ListObjectsV2', self._list, kwargs)
+
+    def create_multipart_upload(self, **kwargs) -> dict:
+        return self._call('CreateMultipartUpload', self._create_multipart, kwargs)
+
+    def upload_part(self, **kwargs) -> dict:
+        return self._call('UploadPart', self._upload_part, kwargs)
+
+    def complete_multipart_upload(self, **kwargs) -> dict:
+        return self._call('CompleteMultipartUpload', self._complete_multipart, kwargs)
+
+    def abort_multipart_upload(self, **kwargs) -> dict:
+        return self._call('AbortMultipartUpload', self._abort_multipart, kwargs)
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs) -> None:
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        with open(Filename, 'rb') as file:
+            self.upload_fileobj(file, Bucket, Key)
+
+    def get_paginator(self, operation_name: str) -> ListObjectsPaginator:
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f"Simulated S3 has no paginator for {operation_name}")
+        return ListObjectsPaginator(self)
+
+class QuotaWindow:
+    """Requests and tokens admitted over the last minute, for the simulated per-model quotas."""
+
+    def __init__(self):
+        self.events = deque()
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int, requests_per_minute: int, tokens_per_minute: int) -> Optional[str]:
+        """Record the request, or return the throttling message if it would exceed a quota."""
+        with self.lock:
+            now = time.monotonic()
+            while self.events and now - self.events[0][0] > 60:
+                self.events.popleft()
+            if requests_per_minute and len(self.events) >= requests_per_minute:
+                return TOO_MANY_REQUESTS_MESSAGE
+            if tokens_per_minute and sum(used for _, used in self.events) + tokens > tokens_per_minute:
+                return TOO_MANY_TOKENS_MESSAGE
+            self.events.append((now, tokens))
+            return None
+
+class SimulatedBedrockRuntime(SimulatedClient):
+    """
+    bedrock-runtime stand-in answering Anthropic messages bodies with generated Python.
+
+    The text is a module of small test functions, sized to the sampled output token
+    count, so every downstream stage (docs, tests, Gherkin) has something to parse.
+    Token counts are reported in the response headers and body like the real service,
+    including prompt cache reads and writes for bodies with cache_control points.
+    """
+
+    service_name = 'bedrock-runtime'
+
+    def __init__(self, config: SimulatorConfig, stats: SimulatorStats, quotas: Dict[str, QuotaWindow],
+                 prompt_cache: set, region_name: str = 'us-east-1'):
+        super().__init__(config, stats, region_name)
+        self.quotas = quotas
+        self.prompt_cache = prompt_cache
+        self.attempts: Dict[str, int] = {}
+
+    def count_tokens(self, text: str) -> int:
+        return max(1, int(len(text) / self.config.chars_per_token))
+
+    def _cache_usage(self, request: dict, input_tokens: int) -> Tuple[int, int]:
+        """(cache read, cache write) tokens for the prefix up to the request's last cache point."""
+        if not self.config.prompt_caching:
+            return 0, 0
+        blocks = list(request.get('system', [])) if isinstance(request.get('system'), list) else []
+        for message in request.get('messages', []):
+            if isinstance(message.get('content'), list):
+                blocks.extend(message['content'])
+        last_point = max((index for index, block in enumerate(blocks)
+                          if isinstance(block, dict) and 'cache_control' in block), default=None)
+        if last_point is None:
+            return 0, 0
+        prefix = json.dumps(blocks[:last_point + 1], sort_keys=True)
+        prefix_tokens = min(input_tokens, self.count_tokens(prefix))
+        with self.lock:
+            if prefix in self.prompt_cache:
+                return prefix_tokens, 0
+            self.prompt_cache.add(prefix)
+        return 0, prefix_tokens
+
+    def _respond(self, modelId: str, body) -> Tuple[dict, dict, float]:
+        """Decide the outcome of one call: (response body, headers, seconds it takes), or raise its error."""
+        body = body.decode('utf-8') if isinstance(body, (bytes, bytearray)) else body
+        request = json.loads(body)
+        request_key = hashlib.sha256(f"{modelId}:{body}".encode('utf-8')).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(request_key, 0) + 1
+            self.attempts[request_key] = attempt
+        rng = self.request_rng(request_key, str(attempt))
+        self.stats.add('bedrock_requests')
+
+        text = ''
+        system = request.get('system', '')
+        text += ''.join(block.get('text', '') for block in system) if isinstance(system, list) else str(system)
+        for message in request.get('messages', []):
+            content = message.get('content', '')
+            text += ''.join(block.get('text', '') for block in content if isinstance(block, dict)) \
+                if isinstance(content, list) else str(content)
+        input_tokens = self.count_tokens(text)
+
+        if input_tokens > self.config.max_input_tokens:
+            self.stats.add('input_too_long')
+            raise client_error('ValidationException', INPUT_TOO_LONG_MESSAGE, 400, 'InvokeModel')
+        quota = self.quotas.setdefault(modelId, QuotaWindow())
+        quota_message = quota.admit(input_tokens, self.config.requests_per_minute, self.config.tokens_per_minute)
+        if quota_message:
+            self.stats.add('quota_throttles')
+            raise client_error('ThrottlingException', quota_message, 429, 'InvokeModel')
+        draw = rng.random()
+        if draw < self.config.throttle_rate:
+            self.stats.add('throttles')
+            raise client_error('ThrottlingException', TOO_MANY_REQUESTS_MESSAGE, 429, 'InvokeModel')
+        draw -= self.config.throttle_rate
+        if draw < self.config.too_many_tokens_rate:
+            self.stats.add('too_many_tokens')
+            raise client_error('ThrottlingException', TOO_MANY_TOKENS_MESSAGE, 429, 'InvokeModel')
+        draw -= self.config.too_many_tokens_rate
+        if draw < self.config.server_error_rate:
+            self.stats.add('server_errors')
+            raise client_error('ServiceUnavailable', 'Service temporarily unavailable.', 503, 'InvokeModel')
+
+        cache_read, cache_write = self._cache_usage(request, input_tokens)
+        uncached_tokens = input_tokens - cache_read - cache_write
+        output_tokens = max(1, min(int(request.get('max_tokens', 4096)),
+                                   int(self.config.output_tokens.sample(rng))))
+        seconds = (self.config.first_token_latency.sample(rng)
+                   + (uncached_tokens + cache_write) * self.config.seconds_per_input_token
+                   + output_tokens * self.config.seconds_per_output_token)
+        self.stats.add('output_tokens', output_tokens)
+
+        response_body = {
+            'id': f"msg_sim_{request_key[:16]}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': modelId,
+            'content': [{'type': 'text', 'text': self.generate_text(request_key, output_tokens)}],
+            'stop_reason': 'end_turn',
+            'usage': {'input_tokens': uncached_tokens, 'output_tokens': output_tokens,
+                      'cache_read_input_tokens': cache_read, 'cache_creation_input_tokens': cache_write},
+        }
+        headers = {
+            'x-amzn-bedrock-input-token-count': str(uncached_tokens),
+            'x-amzn-bedrock-output-token-count': str(output_tokens),
+            'x-amzn-bedrock-cache-read-input-token-count': str(cache_read),
+            'x-amzn-bedrock-cache-write-input-token-count': str(cache_write),
+            'x-amzn-bedrock-invocation-latency': str(int(seconds * 1000)),
+        }
+        return response_body, headers, seconds
+
+    def generate_text(self, request_key: str, output_tokens: int) -> str:
+        lines = [f"# Simulated response {request_key[:12]}"]
+        index = 0
+        while self.count_tokens('\n'.join(lines)) < output_tokens:
+            index += 1
+            lines.append(f"\ndef test_simulated_case_{index}():\n    \"\"\"Simulated case {index}.\"\"\"\n"
+                         f"    assert {index} == {index}\n")
+        return '\n'.join(lines)
+
+    def _invoke(self, modelId: str, body, **kwargs) -> dict:
+        response_body, headers, seconds = self._respond(modelId, body)
+        if seconds > 0:
+            time.sleep(seconds)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': headers},
+                'contentType': 'application/json',
+                'body': ObjectBody(json.dumps(response_body).encode('utf-8'))}
+
+    def _invoke_stream(self, modelId: str, body, **kwargs) -> dict:
+        response_body, headers, seconds = self._respond(modelId, body)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': headers},
+                'contentType': 'application/json',
+                'body': self.stream_events(response_body, seconds)}
+
+    def stream_events(self, response_body: dict, seconds: float) -> Iterator[dict]:
+        """Messages-API stream events, with the call's latency spread over the text deltas."""
+        usage = response_body['usage']
+        text = response_body['content'][0]['text']
+        pieces = [text[index:index + 200] for index in range(0, len(text), 200)] or ['']
+        first_token = self.config.first_token_latency.sample(random.Random(response_body['id']))
+        events = [{'type': 'message_start', 'message': {'id': response_body['id'], 'usage': {
+            'input_tokens': usage['input_tokens'], 'output_tokens': 0,
+            'cache_read_input_tokens': usage['cache_read_input_tokens'],
+            'cache_creation_input_tokens': usage['cache_creation_input_tokens']}}},
+            {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}}]
+        events.extend({'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': piece}}
+                      for piece in pieces)
+        events.extend([{'type': 'content_block_stop', 'index': 0},
+                       {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+                        'usage': {'output_tokens': usage['output_tokens']}},
+                       {'type': 'message_stop'}])
+        per_piece = max(0.0, seconds - first_token) / len(pieces)
+        for event in events:
+            if event['type'] == 'content_block_start':
+                time.sleep(min(first_token, seconds))
+            elif event['type'] == 'content_block_delta' and per_piece > 0:
+                time.sleep(per_piece)
+            yield {'chunk': {'bytes': json.dumps(event).encode('utf-8')}}
+
+    def invoke_model(self, **kwargs) -> dict:
+        return self._call('InvokeModel', self._invoke, kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs) -> dict:
+        return self._call('InvokeModelWithResponseStream', self._invoke_stream, kwargs)
+
+class SimulatedBedrock(SimulatedClient):
+    """Bedrock control plane stand-in for batch inference jobs, answered by the simulated runtime."""
+
+    service_name = 'bedrock'
+
+    def __init__(self, config: SimulatorConfig, stats: SimulatorStats, s3: SimulatedS3,
+                 runtime: SimulatedBedrockRuntime, region_name: str = 'us-east-1'):
+        super().__init__(config, stats, region_name)
+        self.s3 = s3
+        self.runtime = runtime
+        self.jobs: Dict[str, dict] = {}
+
+    def _create_job(self, jobName: str, roleArn: str, modelId: str, inputDataConfig: dict,
+                    outputDataConfig: dict, **kwargs) -> dict:
+        bucket_name, _, input_key = inputDataConfig['s3InputDataConfig']['s3Uri'].replace('s3://', '', 1).partition('/')
+        _, _, output_prefix = outputDataConfig['s3OutputDataConfig']['s3Uri'].replace('s3://', '', 1).partition('/')
+        job_id = f"sim-{uuid.uuid4().hex[:12]}"
+        job_arn = f"arn:aws:bedrock:{self.meta.region_name}:000000000000:model-invocation-job/{job_id}"
+
+        output_lines = []
+        failures = 0
+        for line in self.s3._get(Bucket=bucket_name, Key=input_key)['Body'].read().decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                record['modelOutput'] = self.runtime._respond(modelId, json.dumps(record['modelInput']))[0]
+            except ClientError as e:
+                failures += 1
+                record['error'] = {'errorCode': e.response['ResponseMetadata']['HTTPStatusCode'],
+                                   'errorMessage': e.response['Error']['Message']}
+            output_lines.append(json.dumps(record))
+        output_key = f"{output_prefix.rstrip('/')}/{job_id}/{os.path.basename(input_key)}.out"
+        self.s3._put(Bucket=bucket_name, Key=output_key, Body='\n'.join(output_lines).encode('utf-8'))
+        self.stats.add('batch_jobs')
+        self.jobs[job_arn] = {'status': 'PartiallyCompleted' if failures else 'Completed',
+                              'ready_at': time.monotonic() + self.config.batch_job_seconds}
+        return {'jobArn': job_arn}
+
+    def _get_job(self, jobIdentifier: str, **kwargs) -> dict:
+        job = self.jobs[jobIdentifier]
+        status = job['status'] if time.monotonic() >= job['ready_at'] else 'InProgress'
+        return {'jobArn': jobIdentifier, 'status': status}
+
+    def create_model_invocation_job(self, **kwargs) -> dict:
+        return self._call('CreateModelInvocationJob', self._create_job, kwargs)
+
+    def get_model_invocation_job(self, **kwargs) -> dict:
+        return self._call('GetModelInvocationJob', self._get_job, kwargs)
+
+class SimulatedSession:
+    """
+    boto3 Session stand-in handing out simulated clients that share one object store.
+
+    Pass it to pipeline.clients.ClientRegistry(session=...) and install the registry
+    with use_client_registry, and every stage talks to the simulator instead of AWS.
+    """
+
+    def __init__(self, config: Optional[SimulatorConfig] = None, storage: Optional[ObjectStorage] = None):
+        self.config = config or SimulatorConfig()
+        self.stats = SimulatorStats()
+        # Another backend (e.g. LocalStorage) can hold the objects instead
+        self.storage = storage or MemoryStorage()
+        self.quotas: Dict[str, QuotaWindow] = {}
+        self.prompt_cache = set()
+
+    def client(self, service_name: str, region_name: Optional[str] = None, **kwargs):
+        region_name = region_name or 'us-east-1'
+        s3 = SimulatedS3(self.config, self.stats, self.storage, region_name)
+        if service_name == 's3':
+            return s3
+        # Quotas and the prompt cache are per model and region
+        runtime = SimulatedBedrockRuntime(self.config, self.stats, self.quotas.setdefault(region_name, {}),
+                                          self.prompt_cache, region_name)
+        if service_name == 'bedrock-runtime':
+            return runtime
+        if service_name == 'bedrock':
+            return SimulatedBedrock(self.config, self.stats, s3, runtime, region_name)
+        raise ValueError(f"The simulator has no {service_name} service")
+
+    def put_text(self, bucket_name: str, key: str, text: str) -> None:
+        """Seed the simulated store without latency or events."""
+        self.storage.put_object(Bucket=bucket_name, Key=key, Body=text.encode('utf-8'))
+
+    def keys(self, bucket_name: str, prefix: str = '') -> List[str]:
+        return self.storage.keys(bucket_name, prefix)
+
+    def get_text(self, bucket_name: str, key: str) -> Optional[str]:
+        try:
+            return self.storage.get_object(Bucket=bucket_name, Key=key)['Body'].read().decode('utf-8')
+        except ClientError:
+            return None
@@ -0,0 +1,434 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Bucket the stages read from and write to unless PIPELINE_BUCKET names another one
+DEFAULT_BUCKET_NAME = 's3-genai-coffee-and-innovate'
+
+# Prefix of temporary files while a local write is in progress; never listed
+TEMP_FILE_PREFIX = '.tmp-'
+
+def get_bucket_name() -> str:
+    """The pipeline's bucket: PIPELINE_BUCKET, or the project bucket by default."""
+    return os.environ.get('PIPELINE_BUCKET', DEFAULT_BUCKET_NAME)
+
+def storage_error(code: str, message: str, status_code: int, operation_name: str) -> ClientError:
+    """The ClientError S3 would raise, so callers' error handling works unchanged on every backend."""
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status_code}}, operation_name)
+
+class ObjectBody:
+    """
+    botocore StreamingBody stand-in over bytes, or over a memory-mapped file.
+
+    Reads slice the buffer directly, so a mapped file is paged in by the OS as it is
+    read instead of being copied into memory in full first.
+    """
+
+    def __init__(self, buffer, start: int = 0, end: Optional[int] = None, on_close=None):
+        self.buffer = buffer
+        self.position = start
+        self.end = len(buffer) if end is None else min(end, len(buffer))
+        self.on_close = on_close
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        stop = self.end if amt is None else min(self.end, self.position + amt)
+        data = bytes(self.buffer[self.position:stop])
+        self.position = stop
+        return data
+
+    def iter_chunks(self, chunk_size: int = 1024) -> Iterator[bytes]:
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_lines(self, chunk_size: int = 1024, keepends: bool = False) -> Iterator[bytes]:
+        # As StreamingBody does: only the current chunk and a partial line are held at a time
+        pending = b''
+        for chunk in self.iter_chunks(chunk_size):
+            lines = (pending + chunk).splitlines(True)
+            for line in lines[:-1]:
+                yield line.splitlines(keepends)[0]
+            pending = lines[-1]
+        if pending:
+            yield pending.splitlines(keepends)[0]
+
+    def close(self) -> None:
+        if self.on_close is not None:
+            self.on_close()
+            self.on_close = None
+
+    def __enter__(self) -> "ObjectBody":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class StoredObject:
+    """Listing metadata of a stored object."""
+
+    def __init__(self, size: int, etag: str, last_modified: datetime):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+def parse_range(byte_range: Optional[str], size: int) -> Tuple[int, int]:
+    """
+    (start, end) offsets of an HTTP Range header; the whole object when unset.
+
+    Takes 'bytes=0-99', an open range ('bytes=100-') and a suffix range ('bytes=-500',
+    the last 500 bytes), and raises S3's InvalidRange error for a range that starts
+    past the end of the object.
+    """
+    if not byte_range:
+        return 0, size
+    start, _, end = byte_range.replace('bytes=', '').partition('-')
+    if not start:
+        return max(0, size - int(end)), size
+    if int(start) >= size:
+        raise storage_error('InvalidRange', 'The requested range is not satisfiable', 416, 'GetObject')
+    return int(start), min(size, int(end) + 1) if end else size
+
+def multipart_etag(parts: List[bytes]) -> str:
+    """ETag S3 gives a multipart object: the MD5 of the part MD5s and the part count."""
+    digests = b''.join(hashlib.md5(part).digest() for part in parts)
+    return f'"{hashlib.md5(digests).hexdigest()}-{len(parts)}"'
+
+class ObjectStorage:
+    """
+    Base for storage backends that stand in for the S3 client.
+
+    Implements the S3 calls the pipeline makes (get, put, head, delete, list_objects_v2
+    with Delimiter and paging, its paginator, uploads and multipart uploads) on top of
+    five primitives a backend provides: _open, _stat, _store, _remove and _scan. A
+    backend is handed out by the client registry as the 's3' client, so stage scripts,
+    manifests, checkpoints and batch jobs run on it unchanged, and missing keys raise
+    the same ClientError codes as S3.
+    """
+
+    def __init__(self):
+        # Multipart uploads in progress: upload id -> (bucket, key, {part number: part data})
+        self.uploads: Dict[str, Tuple[str, str, Dict[int, bytes]]] = {}
+        self.uploads_lock = threading.Lock()
+
+    def _open(self, bucket_name: str, key: str) -> Optional[Tuple[ObjectBody, StoredObject]]:
+        raise NotImplementedError
+
+    def _stat(self, bucket_name: str, key: str) -> Optional[StoredObject]:
+        raise NotImplementedError
+
+    def _store(self, bucket_name: str, key: str, data: bytes, etag: Optional[str] = None) -> StoredObject:
+        raise NotImplementedError
+
+    def _remove(self, bucket_name: str, key: str) -> None:
+        raise NotImplementedError
+
+    def _scan(self, bucket_name: str, prefix: str) -> Iterable[Tuple[str, StoredObject]]:
+        """Every (key, metadata) under `prefix`, in any order."""
+        raise NotImplementedError
+
+    def keys(self, bucket_name: str, prefix: str = '') -> List[str]:
+        """Sorted keys under `prefix`, without paging."""
+        return sorted(key for key, _ in self._scan(bucket_name, prefix))
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs) -> dict:
+        opened = self._open(Bucket, Key)
+        if opened is None:
+            raise storage_error('NoSuchKey', 'The specified key does not exist.', 404, 'GetObject')
+        body, obj = opened
+        try:
+            start, end = parse_range(Range, obj.size)
+        except ClientError:
+            body.close()
+            raise
+        body.position, body.end = start, end
+        return {'Body': body, 'ContentLength': end - start, 'ETag': obj.etag, 'LastModified': obj.last_modified,
+                'ResponseMetadata': {'HTTPStatusCode': 206 if Range else 200}}
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', **kwargs) -> dict:
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        obj = self._store(Bucket, Key, data)
+        return {'ETag': obj.etag, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        obj = self._stat(Bucket, Key)
+        if obj is None:
+            raise storage_error('404', 'Not Found', 404, 'HeadObject')
+        return {'ContentLength': obj.size, 'ETag': obj.etag, 'LastModified': obj.last_modified,
+                'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        self._remove(Bucket, Key)
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', Delimiter: Optional[str] = None,
+                        ContinuationToken: Optional[str] = None, StartAfter: Optional[str] = None,
+                        MaxKeys: int = 1000, **kwargs) -> dict:
+        objects = dict(self._scan(Bucket, Prefix))
+        # Keys with the delimiter past the prefix roll up into one CommonPrefixes entry,
+        # which counts (and sorts) as a single key of the page
+        common = set()
+        keys = list(objects)
+        if Delimiter:
+            for key in keys:
+                position = key.find(Delimiter, len(Prefix))
+                if position >= 0:
+                    common.add(key[:position + len(Delimiter)])
+            keys = list(common.union(key for key in keys if key.find(Delimiter, len(Prefix)) < 0))
+        keys.sort()
+        after = ContinuationToken or StartAfter
+        if after:
+            keys = [key for key in keys if key > after]
+        page = keys[:MaxKeys]
+        contents = [{'Key': key, 'ETag': objects[key].etag, 'LastModified': objects[key].last_modified,
+                     'Size': objects[key].size} for key in page if key not in common]
+        common_prefixes = [{'Prefix': key} for key in page if key in common]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > MaxKeys,
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+        if contents:
+            response['Contents'] = contents
+        if common_prefixes:
+            response['CommonPrefixes'] = common_prefixes
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation_name: str) -> "ListObjectsPaginator":
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f"{type(self).__name__} has no paginator for {operation_name}")
+        return ListObjectsPaginator(self)
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs) -> None:
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj.read())
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        with open(Filename, 'rb') as file:
+            self.upload_fileobj(file, Bucket, Key)
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        upload_id = uuid.uuid4().hex
+        with self.uploads_lock:
+            self.uploads[upload_id] = (Bucket, Key, {})
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body=b'', **kwargs) -> dict:
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self.uploads_lock:
+            if UploadId not in self.uploads:
+                raise storage_error('NoSuchUpload', 'The specified upload does not exist.', 404, 'UploadPart')
+            self.uploads[UploadId][2][PartNumber] = data
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"', 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict,
+                                  **kwargs) -> dict:
+        with self.uploads_lock:
+            upload = self.uploads.pop(UploadId, None)
+        if upload is None:
+            raise storage_error('NoSuchUpload', 'The specified upload does not exist.', 404,
+                                'CompleteMultipartUpload')
+        parts = [upload[2][part['PartNumber']] for part in MultipartUpload['Parts']]
+        obj = self._store(Bucket, Key, b''.join(parts), multipart_etag(parts))
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': obj.etag, 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> dict:
+        with self.uploads_lock:
+            self.uploads.pop(UploadId, None)
+        return {'ResponseMetadata': {'HTTPStatusCode': 204}}
+
+class ListObjectsPaginator:
+    def __init__(self, storage: ObjectStorage):
+        self.storage = storage
+
+    def paginate(self, **kwargs) -> Iterator[dict]:
+        kwargs['MaxKeys'] = kwargs.pop('PaginationConfig', {}).get('PageSize', 1000)
+        while True:
+            page = self.storage.list_objects_v2(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+class MemoryStorage(ObjectStorage):
+    """Objects held in a dict for the life of the process; for tests, the benchmark simulator and embedding."""
+
+    def __init__(self):
+        super().__init__()
+        self.objects: Dict[Tuple[str, str], Tuple[bytes, StoredObject]] = {}
+        self.lock = threading.Lock()
+
+    def _open(self, bucket_name: str, key: str) -> Optional[Tuple[ObjectBody, StoredObject]]:
+        with self.lock:
+            entry = self.objects.get((bucket_name, key))
+        return (ObjectBody(entry[0]), entry[1]) if entry is not None else None
+
+    def _stat(self, bucket_name: str, key: str) -> Optional[StoredObject]:
+        with self.lock:
+            entry = self.objects.get((bucket_name, key))
+        return entry[1] if entry is not None else None
+
+    def _store(self, bucket_name: str, key: str, data: bytes, etag: Optional[str] = None) -> StoredObject:
+        obj = StoredObject(len(data), etag or f'"{hashlib.md5(data).hexdigest()}"', datetime.now(timezone.utc))
+        with self.lock:
+            self.objects[(bucket_name, key)] = (data, obj)
+        return obj
+
+    def _remove(self, bucket_name: str, key: str) -> None:
+        with self.lock:
+            self.objects.pop((bucket_name, key), None)
+
+    def _scan(self, bucket_name: str, prefix: str) -> Iterable[Tuple[str, StoredObject]]:
+        with self.lock:
+            return [(key, entry[1]) for (bucket, key), entry in self.objects.items()
+                    if bucket == bucket_name and key.startswith(prefix)]
+
+class LocalStorage(ObjectStorage):
+    """
+    Objects as files under a local directory, so the pipeline runs without S3 or a network.
+
+    A key maps to the same relative path under `root`; `mounts` maps key prefixes to
+    other directories instead, e.g. {'target/': 'output/ModernITCodeGeneratorTool'}
+    to write into the repository's output tree. Bucket names are ignored: a local
+    store is one namespace.
+
+    Files are read through memory maps, writes are atomic renames, and the ETag is
+    derived from the file's size and modification time rather than a hash of its
+    content, so listing a large corpus never reads it.
+    """
+
+    def __init__(self, root: str, mounts: Optional[Dict[str, str]] = None):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        # Longest prefix first, so a nested mount wins over the one containing it
+        self.mounts = sorted(((prefix.rstrip('/') + '/', os.path.abspath(directory))
+                              for prefix, directory in (mounts or {}).items()),
+                             key=lambda mount: len(mount[0]), reverse=True)
+
+    def path_for(self, key: str) -> str:
+        prefix, directory = next(((prefix, directory) for prefix, directory in self.mounts if key.startswith(prefix)),
+                                 ('', self.root))
+        relative = key[len(prefix):]
+        path = os.path.normpath(os.path.join(directory, *relative.split('/')))
+        if path != directory and not path.startswith(directory + os.sep):
+            raise storage_error('InvalidKey', f"Key {key} resolves outside {directory}", 400, 'ResolveKey')
+        return path
+
+    def _stat_path(self, path: str) -> Optional[StoredObject]:
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not os.path.isfile(path):
+            return None
+        return self._object_from_stat(stat)
+
+    @staticmethod
+    def _object_from_stat(stat: os.stat_result) -> StoredObject:
+        return StoredObject(stat.st_size, f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+                            datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+    def _open(self, bucket_name: str, key: str) -> Optional[Tuple[ObjectBody, StoredObject]]:
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as file:
+                obj = self._object_from_stat(os.fstat(file.fileno()))
+                if not obj.size:
+                    return ObjectBody(b''), obj
+                # The mapping stays valid after the file is closed, until the body is closed
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+        return ObjectBody(mapped, on_close=mapped.close), obj
+
+    def _stat(self, bucket_name: str, key: str) -> Optional[StoredObject]:
+        return self._stat_path(self.path_for(key))
+
+    def _store(self, bucket_name: str, key: str, data: bytes, etag: Optional[str] = None) -> StoredObject:
+        path = self.path_for(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._stat_path(path)
+
+    def _remove(self, bucket_name: str, key: str) -> None:
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def _scan(self, bucket_name: str, prefix: str) -> Iterable[Tuple[str, StoredObject]]:
+        for key_prefix, directory in self.mounts + [('', self.root)]:
+            if not (prefix.startswith(key_prefix) or key_prefix.startswith(prefix)):
+                continue
+            # Only walk the part of the tree the prefix can reach
+            relative = prefix[len(key_prefix):] if prefix.startswith(key_prefix) else ''
+            start = os.path.join(directory, *relative.split('/')[:-1]) if '/' in relative else directory
+            for current, dirs, files in os.walk(start):
+                dirs.sort()
+                for name in files:
+                    if name.startswith(TEMP_FILE_PREFIX):
+                        continue
+                    path = os.path.join(current, name)
+                    key = key_prefix + os.path.relpath(path, directory).replace(os.sep, '/')
+                    if not key.startswith(prefix) or self._mount_of(key) != key_prefix:
+                        continue
+                    try:
+                        yield key, self._object_from_stat(os.stat(path))
+                    except FileNotFoundError:
+                        continue
+
+    def _mount_of(self, key: str) -> str:
+        return next((prefix for prefix, _ in self.mounts if key.startswith(prefix)), '')
+
+def parse_mounts(spec: str) -> Dict[str, str]:
+    """Key prefix -> directory from 'prefix=directory' pairs separated by commas."""
+    mounts = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(','))):
+        prefix, separator, directory = entry.partition('=')
+        if not separator:
+            raise ValueError(f"Invalid PIPELINE_LOCAL_MOUNTS entry {entry!r}; expected prefix=directory")
+        mounts[prefix.strip()] = os.path.expanduser(directory.strip())
+    return mounts
+
+def storage_from_env() -> Optional[ObjectStorage]:
+    """
+    Storage backend selected by PIPELINE_STORAGE: 's3' (the default, returns None), 'local' or 'memory'.
+
+    'local' keeps objects under PIPELINE_LOCAL_ROOT (default: the current directory),
+    with PIPELINE_LOCAL_MOUNTS mapping key prefixes to other directories, e.g.
+    "target=../../output/ModernITCodeGeneratorTool".
+    """
+    kind = os.environ.get('PIPELINE_STORAGE', 's3').lower()
+    if kind == 's3':
+        return None
+    if kind == 'memory':
+        logger.info("Using in-memory storage instead of S3; outputs are discarded at exit")
+        return MemoryStorage()
+    if kind == 'local':
+        root = os.path.expanduser(os.environ.get('PIPELINE_LOCAL_ROOT', '.'))
+        mounts = parse_mounts(os.environ.get('PIPELINE_LOCAL_MOUNTS', ''))
+        logger.info(f"Using local storage under {os.path.abspath(root)} instead of S3"
+                    + ''.join(f"; {prefix} -> {directory}" for prefix, directory in mounts.items()))
+        return LocalStorage(root, mounts)
+    raise ValueError(f"Unknown PIPELINE_STORAGE: {kind}")
@@ -0,0 +1,181 @@
+import io
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from pipeline.bedrock import (DEFAULT_MODEL_ID, cached_response, estimate_body_tokens, prepare_body,
+                              record_input_tokens)
+from pipeline.cache import get_response_cache, make_cache_key
+from pipeline.clients import client_region
+from pipeline.rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+def streaming_enabled() -> bool:
+    return os.environ.get('BEDROCK_STREAMING', '').lower() in ('1', 'true', 'yes')
+
+def get_spool_dir() -> str:
+    return os.path.expanduser(os.environ.get('BEDROCK_STREAM_SPOOL_DIR', '~/.cache/modernit_codegen/spool'))
+
+class StreamSpool:
+    """
+    Local file holding the text streamed so far for one request.
+
+    Named after the request's cache key, so a retry of the same request, even from a
+    later run, finds the partial output of an interrupted stream and resumes from it.
+    The file is removed once the response completes.
+    """
+
+    def __init__(self, directory: str, key: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{key}.partial")
+
+    def read(self) -> str:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as spool_file:
+                return spool_file.read()
+        except FileNotFoundError:
+            return ""
+
+    def open(self, initial_text: str):
+        spool_file = open(self.path, 'w', encoding='utf-8')
+        spool_file.write(initial_text)
+        spool_file.flush()
+        return spool_file
+
+    def discard(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class StreamMetrics:
+    def __init__(self, started: float):
+        self.started = started
+        self.first_token_at: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_write_input_tokens = 0
+        self.output_tokens = 0
+        self.stop_reason: Optional[str] = None
+
+    @property
+    def time_to_first_token(self) -> float:
+        return (self.first_token_at or self.finished or self.started) - self.started
+
+    @property
+    def tokens_per_second(self) -> float:
+        generating = (self.finished or self.started) - (self.first_token_at or self.started)
+        return self.output_tokens / generating if generating > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'time_to_first_token': round(self.time_to_first_token, 3),
+            'tokens_per_second': round(self.tokens_per_second, 1),
+            'input_tokens': self.input_tokens,
+            'cache_read_input_tokens': self.cache_read_input_tokens,
+            'cache_write_input_tokens': self.cache_write_input_tokens,
+            'output_tokens': self.output_tokens,
+            'stop_reason': self.stop_reason,
+        }
+
+def resume_body(body: str, partial_text: str) -> str:
+    """Ask the model to continue an interrupted response by prefilling it as the assistant turn."""
+    request = json.loads(body)
+    request['messages'] = request['messages'] + [{'role': 'assistant', 'content': partial_text}]
+    return json.dumps(request)
+
+def invoke_model_streaming(bedrock_client, body: str, model_id: str = DEFAULT_MODEL_ID,
+                           label: str = "request") -> dict:
+    """
+    Streaming counterpart of pipeline.bedrock.invoke_model.
+
+    Consumes invoke_model_with_response_stream as tokens arrive, appending the text to
+    a local spool so an interrupted stream is resumed rather than restarted on retry.
+    Logs time-to-first-token and tokens/sec, and returns a response shaped like
+    invoke_model's so callers read response['body'] exactly as before. Shares the
+    response cache and the rate limiter with invoke_model.
+    """
+    body = prepare_body(body, model_id)
+    cache = get_response_cache()
+    cache_key = make_cache_key(model_id, body)
+    if cache is not None:
+        cached_body = cache.get(cache_key)
+        if cached_body is not None:
+            logger.info(f"Bedrock response for {label} served from cache ({cache_key[:12]})")
+            return cached_response(cached_body)
+
+    spool = StreamSpool(get_spool_dir(), cache_key)
+    # A prefilled assistant turn may not end in whitespace
+    partial_text = spool.read().rstrip()
+    request_body = body
+    if partial_text:
+        logger.info(f"Resuming stream for {label} after {len(partial_text)} spooled characters")
+        request_body = resume_body(body, partial_text)
+
+    limiter = get_rate_limiter(model_id, client_region(bedrock_client))
+    texts = [partial_text]
+
+    with limiter.slot(estimate_body_tokens(request_body, model_id)):
+        metrics = StreamMetrics(time.monotonic())
+        try:
+            response = bedrock_client.invoke_model_with_response_stream(modelId=model_id, body=request_body)
+            with spool.open(partial_text) as spool_file:
+                for event in response['body']:
+                    if 'chunk' not in event:
+                        continue
+                    payload = json.loads(event['chunk']['bytes'])
+                    event_type = payload.get('type')
+                    if event_type == 'content_block_delta' and payload['delta'].get('type') == 'text_delta':
+                        if metrics.first_token_at is None:
+                            metrics.first_token_at = time.monotonic()
+                        texts.append(payload['delta']['text'])
+                        spool_file.write(payload['delta']['text'])
+                        spool_file.flush()
+                    elif event_type == 'message_start':
+                        usage = payload['message'].get('usage', {})
+                        metrics.input_tokens = usage.get('input_tokens', 0)
+                        metrics.cache_read_input_tokens = usage.get('cache_read_input_tokens', 0)
+                        metrics.cache_write_input_tokens = usage.get('cache_creation_input_tokens', 0)
+                    elif event_type == 'message_delta':
+                        metrics.stop_reason = payload.get('delta', {}).get('stop_reason')
+                        metrics.output_tokens = payload.get('usage', {}).get('output_tokens', 0)
+        except ClientError as e:
+            if e.response['Error'].get('Code') == 'ThrottlingException':
+                limiter.record_throttle()
+            raise
+        metrics.finished = time.monotonic()
+
+    limiter.record_success(metrics.output_tokens)
+    record_input_tokens(request_body, metrics.input_tokens + metrics.cache_read_input_tokens +
+                        metrics.cache_write_input_tokens, model_id)
+    logger.info(f"Stream for {label} finished ({metrics.stop_reason}): first token after "
+                f"{metrics.time_to_first_token:.2f}s, {metrics.output_tokens} output tokens "
+                f"at {metrics.tokens_per_second:.1f} tokens/sec")
+
+    body_bytes = json.dumps({
+        'type': 'message',
+        'role': 'assistant',
+        'content': [{'type': 'text', 'text': ''.join(texts)}],
+        'stop_reason': metrics.stop_reason,
+        'usage': {
+            'input_tokens': metrics.input_tokens,
+            'cache_read_input_tokens': metrics.cache_read_input_tokens,
+            'cache_creation_input_tokens': metrics.cache_write_input_tokens,
+            'output_tokens': metrics.output_tokens,
+        },
+    }).encode('utf-8')
+    if cache is not None:
+        cache.put(cache_key, body_bytes)
+    spool.discard()
+
+    return {
+        'ResponseMetadata': {'HTTPStatusCode': 200, 'HTTPHeaders': {}, 'StreamMetrics': metrics.as_dict()},
+        'contentType': 'application/json',
+        'body': io.BytesIO(body_bytes),
+    }
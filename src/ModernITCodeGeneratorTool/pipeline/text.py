@@ -0,0 +1,187 @@
+import codecs
+import logging
+from typing import Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from an S3 body at a time when streaming
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+# NUL and the other C0 controls except tab and line feed, plus DEL. Carriage returns go
+# too, which turns CRLF line ends into LF.
+CONTROL_BYTES = bytes(byte for byte in range(32) if byte not in (0x09, 0x0a)) + b'\x7f'
+
+# UTF-8 continuation bytes; deleting them while the lead byte becomes a space leaves
+# exactly one space per non-ASCII character without decoding anything
+UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xc0))
+
+# Maps every non-ASCII byte to a space: each character of a single-byte encoding (latin-1,
+# cp1252), or each UTF-8 lead byte once the continuation bytes are deleted
+NON_ASCII_TABLE = bytes(range(128)) + b' ' * 128
+
+# For files with old Mac line ends (CR only), which would otherwise lose every line break
+CR_TO_LF_TABLE = bytes.maketrans(b'\r', b'\n')
+
+def detect_encoding(data: bytes) -> str:
+    """'ascii', 'utf-8', 'utf-16' (from its byte order mark) or 'latin-1' for anything else."""
+    if data.isascii():
+        return 'ascii'
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        codecs.utf_8_decode(data, 'strict', True)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+def normalize_source_bytes(data: bytes, encoding: Optional[str] = None) -> str:
+    """
+    ASCII text of a source file with line breaks kept, in one translate pass and one decode.
+
+    Non-ASCII characters become one space each and NUL and other control characters are
+    dropped, as the prompts expect, but indentation and line structure are left alone.
+    `encoding` is detected from the bytes when not given.
+    """
+    encoding = encoding or detect_encoding(data)
+    if encoding == 'utf-16':
+        data = data.decode('utf-16').encode('utf-8')
+        encoding = 'utf-8'
+    if encoding == 'utf-8' and data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+
+    if b'\r' in data and b'\n' not in data:
+        data = data.translate(CR_TO_LF_TABLE)
+
+    if encoding == 'ascii':
+        normalized = data.translate(None, CONTROL_BYTES)
+    elif encoding == 'utf-8':
+        normalized = data.translate(NON_ASCII_TABLE, CONTROL_BYTES + UTF8_CONTINUATION_BYTES)
+    else:
+        normalized = data.translate(NON_ASCII_TABLE, CONTROL_BYTES)
+    # Pure ASCII now, so this decode is a plain copy
+    return normalized.decode('ascii')
+
+class IncrementalSourceDecoder:
+    """
+    Decodes a source file piece by piece as its bytes arrive, without holding the whole file.
+
+    Starts as UTF-8 (or UTF-16 when the first bytes are its byte order mark; a UTF-8 one
+    is dropped) and falls back to latin-1 from the first invalid byte on. That is the
+    same choice the scripts made with full decodes of the whole buffer, but made once,
+    in a single pass.
+    """
+
+    def __init__(self, name: str = 'source'):
+        self.name = name
+        self.encoding = None
+        self.decoder = None
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        if self.decoder is None:
+            if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+                self.encoding = 'utf-16'
+            else:
+                self.encoding = 'utf-8'
+            self.decoder = codecs.getincrementaldecoder('utf-8-sig' if self.encoding == 'utf-8'
+                                                        else self.encoding)('strict')
+        # Bytes the decoder held back from the previous piece belong to this one
+        pending = self.decoder.getstate()[0]
+        try:
+            return self.decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            if self.encoding == 'latin-1':
+                raise
+            logger.warning(f"{self.name} is not valid {self.encoding} ({e.reason}); decoding the rest as latin-1")
+            # e.object is the held-back bytes and this piece (less a UTF-8 byte order mark);
+            # the bytes before the invalid one are still decoded as they were meant
+            if self.encoding == 'utf-8':
+                valid, rest = e.object[:e.start].decode('utf-8'), e.object[e.start:]
+            else:
+                # UTF-16 byte order is only known to the decoder, so it decodes the valid part itself
+                split = e.start + len(data) - len(e.object)
+                valid, rest = (self.decoder.decode(data[:split]), data[split:]) if split > 0 else ('', pending + data)
+            self.encoding = 'latin-1'
+            self.decoder = codecs.getincrementaldecoder('latin-1')('strict')
+            return valid + self.decoder.decode(rest, final)
+
+class IncrementalSourceNormalizer:
+    """
+    normalize_source_bytes for a file whose bytes arrive in pieces.
+
+    Each piece is decoded with an IncrementalSourceDecoder and turned into ASCII on its
+    own, so neither the raw bytes nor the full text is needed. Line ends are settled as
+    they stream: CRLF and a lone CR (old Mac files) both become LF, and a CR that ends
+    a piece is held back until the next piece shows which of the two it is.
+    """
+
+    def __init__(self, name: str = 'source'):
+        self.decoder = IncrementalSourceDecoder(name)
+        self.held_cr = ''
+        self.bytes_read = 0
+
+    @property
+    def encoding(self) -> Optional[str]:
+        return self.decoder.encoding
+
+    def normalize(self, data: bytes, final: bool = False) -> str:
+        self.bytes_read += len(data)
+        text = self.held_cr + self.decoder.decode(data, final)
+        self.held_cr = ''
+        if text.endswith('\r') and not final:
+            text, self.held_cr = text[:-1], '\r'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if text.isascii():
+            return text.encode('ascii').translate(None, CONTROL_BYTES).decode('ascii')
+        # Decoded text re-encodes as valid UTF-8, which the byte tables turn into one space per character
+        return normalize_source_bytes(text.encode('utf-8'), 'utf-8')
+
+def iter_body_chunks(body, chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[bytes]:
+    """Raw pieces of a botocore StreamingBody (or any file-like object), closing it at the end."""
+    try:
+        if hasattr(body, 'iter_chunks'):
+            yield from body.iter_chunks(chunk_size)
+        else:
+            while True:
+                data = body.read(chunk_size)
+                if not data:
+                    break
+                yield data
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+def iter_decoded_lines(chunks: Iterable[bytes], name: str = 'source') -> Iterator[str]:
+    """Lines (with their line ends) of the text in `chunks`, decoded incrementally."""
+    decoder = IncrementalSourceDecoder(name)
+    partial = ''
+    for data in chunks:
+        text = partial + decoder.decode(data)
+        last_break = text.rfind('\n')
+        if last_break < 0:
+            partial = text
+            continue
+        yield from text[:last_break + 1].splitlines(keepends=True)
+        partial = text[last_break + 1:]
+    partial += decoder.decode(b'', final=True)
+    if partial:
+        yield from partial.splitlines(keepends=True)
+
+def iter_object_lines(s3_client, bucket_name: str, key: str,
+                      chunk_size: int = STREAM_CHUNK_BYTES) -> Iterator[str]:
+    """Lines of an S3 object, streamed and decoded as they arrive; memory stays at about one chunk."""
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    yield from iter_decoded_lines(iter_body_chunks(response['Body'], chunk_size), key)
+
+def read_object_text(s3_client, bucket_name: str, key: str, chunk_size: int = STREAM_CHUNK_BYTES) -> str:
+    """
+    Whole text of an S3 object, decoded incrementally while it streams in.
+
+    Unlike Body.read() followed by decode attempts, the raw bytes are never held in full
+    next to the text, and each byte is decoded once.
+    """
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    decoder = IncrementalSourceDecoder(key)
+    pieces = [decoder.decode(data) for data in iter_body_chunks(response['Body'], chunk_size)]
+    pieces.append(decoder.decode(b'', final=True))
+    return ''.join(pieces)
@@ -0,0 +1,131 @@
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = 100
+
+class TokenEstimator:
+    """
+    Local input token estimate, calibrated against the counts Bedrock reports.
+
+    The raw estimate is characters / `chars_per_token`. For each model, a correction
+    ratio (actual / raw) is kept as an exponentially weighted average of every
+    response's reported input token count, so estimates converge on the model's real
+    tokenizer for this codebase. The ratio and the latest estimate/actual pairs are
+    persisted to a JSON file so calibration carries over between runs. The file is
+    written at most every `save_interval` seconds, outside the lock the model-call
+    workers update the ratio under, and once more when the process exits.
+    """
+
+    def __init__(self, path: Optional[str], chars_per_token: float = 4.0, smoothing: float = 0.2,
+                 save_interval: float = 30.0):
+        self.path = path
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+        self.save_interval = save_interval
+        self.models: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.last_saved = time.monotonic()
+        self.unsaved = False
+
+    def load(self) -> "TokenEstimator":
+        if not self.path:
+            return self
+        try:
+            with open(self.path, 'r', encoding='utf-8') as calibration_file:
+                self.models = json.load(calibration_file).get('models', {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable token calibration file {self.path}: {e}")
+        return self
+
+    def ratio(self, model_id: str) -> float:
+        return self.models.get(model_id, {}).get('ratio', 1.0)
+
+    def raw_estimate(self, text: str) -> float:
+        return len(text) / self.chars_per_token
+
+    def estimate(self, text: str, model_id: str) -> int:
+        return int(self.raw_estimate(text) * self.ratio(model_id))
+
+    def record(self, model_id: str, text: str, actual_tokens: int) -> None:
+        """Fold one response's reported input token count into the model's correction ratio."""
+        raw_estimate = self.raw_estimate(text)
+        if actual_tokens <= 0 or raw_estimate <= 0:
+            return
+        with self.lock:
+            model = self.models.setdefault(model_id, {'ratio': 1.0, 'samples': 0, 'history': []})
+            estimate = int(raw_estimate * model['ratio'])
+            observed_ratio = actual_tokens / raw_estimate
+            if model['samples'] == 0:
+                model['ratio'] = observed_ratio
+            else:
+                model['ratio'] = (1 - self.smoothing) * model['ratio'] + self.smoothing * observed_ratio
+            model['samples'] += 1
+            model['history'] = (model['history'] + [[estimate, actual_tokens]])[-HISTORY_SIZE:]
+            logger.debug(f"Input tokens for {model_id}: estimated {estimate}, actual {actual_tokens}; "
+                         f"ratio now {model['ratio']:.3f} after {model['samples']} samples")
+            self.unsaved = True
+            due = time.monotonic() - self.last_saved >= self.save_interval
+        # A worker that finds another one already writing the file does not wait for it
+        if due and self.save_lock.acquire(blocking=False):
+            try:
+                self.save()
+            finally:
+                self.save_lock.release()
+
+    def flush(self) -> None:
+        """Write calibration recorded since the last save."""
+        with self.save_lock:
+            if self.unsaved:
+                self.save()
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with self.lock:
+            text = json.dumps({'chars_per_token': self.chars_per_token, 'models': self.models}, indent=2)
+            self.last_saved = time.monotonic()
+            self.unsaved = False
+        try:
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False, suffix='.tmp',
+                                             encoding='utf-8') as temp_file:
+                temp_file.write(text)
+            os.replace(temp_file.name, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write token calibration file {self.path}: {e}")
+
+    @classmethod
+    def from_env(cls) -> "TokenEstimator":
+        path = os.environ.get('BEDROCK_TOKEN_CALIBRATION_FILE', '~/.cache/modernit_codegen/token_calibration.json')
+        return cls(os.path.expanduser(path) if path else None).load()
+
+_token_estimator: Optional[TokenEstimator] = None
+_token_estimator_lock = threading.Lock()
+
+def get_token_estimator() -> TokenEstimator:
+    """Return the process-wide estimator, creating it from the environment on first use."""
+    global _token_estimator
+    with _token_estimator_lock:
+        if _token_estimator is None:
+            _token_estimator = TokenEstimator.from_env()
+            atexit.register(_token_estimator.flush)
+        return _token_estimator
+
+def flush_token_calibration() -> None:
+    """Write pending calibration now, e.g. at the end of a stage; a no-op if nothing was estimated."""
+    with _token_estimator_lock:
+        estimator = _token_estimator
+    if estimator is not None:
+        estimator.flush()
@@ -0,0 +1,53 @@
+import sys
+
+from pipeline.dependencies import PackageGraph
+
+
+def chain_graph(length: int) -> PackageGraph:
+    """pkg_0000 calls pkg_0001, which calls pkg_0002, and so on."""
+    names = [f"pkg_{i:04d}" for i in range(length)]
+    packages = {name: name.upper() for name in names}
+    references = {caller: {callee: {'RUN'}} for caller, callee in zip(names, names[1:])}
+    return PackageGraph(packages, {}, references)
+
+
+def test_components_of_chain_longer_than_recursion_limit():
+    length = sys.getrecursionlimit() + 500
+    graph = chain_graph(length)
+
+    components = graph.components()
+
+    assert len(components) == length
+    assert all(len(component) == 1 for component in components)
+    # Dependencies first: the end of the chain is converted before its callers
+    order = graph.conversion_order()
+    assert order[0] == f"pkg_{length - 1:04d}"
+    assert order[-1] == "pkg_0000"
+
+
+def test_cycle_closing_long_chain_is_one_component():
+    length = sys.getrecursionlimit() + 500
+    graph = chain_graph(length)
+    graph.references[f"pkg_{length - 1:04d}"] = {"pkg_0000": {'RUN'}}
+
+    assert graph.cycles() == [sorted(graph.packages)]
+
+
+def test_components_follow_dependencies():
+    packages = {name: name.upper() for name in ('a', 'b', 'c', 'd')}
+    references = {'a': {'b': {'X'}}, 'b': {'c': {'Y'}}, 'c': {'b': {'Z'}}, 'd': {'a': {'W'}}}
+    graph = PackageGraph(packages, {}, references)
+
+    assert graph.components() == [['b', 'c'], ['a'], ['d']]
+    assert graph.cycles() == [['b', 'c']]
+    assert graph.upstream('a') == ['b']
+
+
+def test_transitive_dependencies_cross_cycles():
+    packages = {name: name.upper() for name in ('a', 'b', 'c', 'd')}
+    references = {'a': {'b': {'X'}}, 'b': {'c': {'Y'}}, 'c': {'b': {'Z'}}, 'd': {'a': {'W'}}}
+    graph = PackageGraph(packages, {}, references)
+
+    assert graph.transitive_dependencies('d') == ['a', 'b', 'c']
+    assert graph.transitive_dependencies('b') == ['c']
+    assert graph.transitive_dependencies('c') == ['b']
@@ -0,0 +1,28 @@
+import codecs
+
+from pipeline.text import IncrementalSourceNormalizer, normalize_source_bytes
+
+
+def normalize_in_pieces(data: bytes, size: int) -> str:
+    normalizer = IncrementalSourceNormalizer('test')
+    pieces = [normalizer.normalize(data[i:i + size]) for i in range(0, len(data), size)]
+    pieces.append(normalizer.normalize(b'', final=True))
+    return ''.join(pieces)
+
+
+def test_pieces_normalize_like_the_whole_file():
+    samples = [
+        b"abc\r\ndef\r\n\x00x\ty\x7f\n",
+        b"line1\rline2\rline3\r",
+        "café ☃\r\nok\n".encode('utf-8'),
+        codecs.BOM_UTF8 + "hé\nx".encode('utf-8'),
+        "hé\r\nx\n".encode('utf-16'),
+        "abcédef\n".encode('latin-1'),
+    ]
+    for data in samples:
+        for size in (2, 3, 7, 1024):
+            assert normalize_in_pieces(data, size) == normalize_source_bytes(data)
+
+
+def test_crlf_split_between_pieces_is_one_line_break():
+    assert normalize_in_pieces(b"a\r\nb", 2) == "a\nb"